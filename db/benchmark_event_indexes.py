@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
+# See LICENSE in the project root for license information.
+
+'''
+Benchmark the composite event indexes added in schema-update.v2.1.7-met17.
+
+Seeds a throwaway set of teams, users and events (one million by default) into the database from an
+oncall config file, then reports the EXPLAIN plan and median latency of the hot event range queries,
+first without and then with the composite indexes.
+
+    python db/benchmark_event_indexes.py configs/config.yaml --events 1000000
+    python db/benchmark_event_indexes.py configs/config.yaml --cleanup
+
+Only run this against a scratch database: it adds and drops indexes on the event table.
+'''
+
+import argparse
+import random
+import statistics
+import time
+
+from oncall import db
+from oncall.utils import read_config
+
+PREFIX = 'bench-index-'
+DAY = 86400
+
+INDEXES = {
+    'event_team_id_start_end_idx': '(`team_id`, `start`, `end`)',
+    'event_user_id_start_end_idx': '(`user_id`, `start`, `end`)',
+    'event_schedule_id_start_idx': '(`schedule_id`, `start`)',
+}
+
+QUERIES = {
+    'events by team and range': (
+        '''SELECT `event`.`id` FROM `event`
+           WHERE `event`.`team_id` = %(team_id)s AND `event`.`start` < %(end)s AND `event`.`end` > %(start)s'''),
+    'team oncall now': (
+        '''SELECT `event`.`user_id` FROM `event`
+           WHERE `event`.`team_id` = %(team_id)s AND UNIX_TIMESTAMP() BETWEEN `event`.`start` AND `event`.`end`'''),
+    'user events from start': (
+        '''SELECT `event`.`id` FROM `event`
+           WHERE `event`.`user_id` = %(user_id)s AND `event`.`end` > %(start)s'''),
+    'busy users in range': (
+        '''SELECT DISTINCT `event`.`user_id` FROM `event`
+           WHERE `event`.`user_id` IN %(user_ids)s AND `event`.`start` < %(end)s AND `event`.`end` > %(start)s'''),
+    'schedule last epoch': (
+        '''SELECT MAX(`event`.`start`) FROM `event` WHERE `event`.`schedule_id` = %(schedule_id)s'''),
+}
+
+
+def seed(cursor, connection, n_events, n_teams, n_users):
+    cursor.execute('SELECT `id` FROM `role` ORDER BY `id`')
+    role_ids = [row[0] for row in cursor]
+    cursor.executemany('INSERT IGNORE INTO `team` (`name`, `scheduling_timezone`) VALUES (%s, "UTC")',
+                       [PREFIX + str(i) for i in range(n_teams)])
+    cursor.executemany('INSERT IGNORE INTO `user` (`name`, `active`) VALUES (%s, 1)',
+                       [PREFIX + str(i) for i in range(n_users)])
+    connection.commit()
+    cursor.execute('SELECT `id` FROM `team` WHERE `name` LIKE %s', PREFIX + '%')
+    team_ids = [row[0] for row in cursor]
+    cursor.execute('SELECT `id` FROM `user` WHERE `name` LIKE %s', PREFIX + '%')
+    user_ids = [row[0] for row in cursor]
+
+    # events spread over five years centered on now, one week long on average
+    now = int(time.time())
+    batch = []
+    for i in range(n_events):
+        start = now + random.randint(-900, 900) * 2 * DAY
+        batch.append((random.choice(team_ids), random.choice(role_ids), random.randint(1, 10000),
+                      random.choice(user_ids), start, start + random.randint(1, 14) * DAY // 2))
+        if len(batch) == 10000:
+            cursor.executemany('''INSERT INTO `event` (`team_id`, `role_id`, `schedule_id`, `user_id`, `start`, `end`)
+                                  VALUES (%s, %s, %s, %s, %s, %s)''', batch)
+            connection.commit()
+            batch = []
+    if batch:
+        cursor.executemany('''INSERT INTO `event` (`team_id`, `role_id`, `schedule_id`, `user_id`, `start`, `end`)
+                              VALUES (%s, %s, %s, %s, %s, %s)''', batch)
+        connection.commit()
+    cursor.execute('ANALYZE TABLE `event`')
+    cursor.fetchall()
+    return team_ids, user_ids
+
+
+def cleanup(cursor, connection):
+    # events go with their team and user through ON DELETE CASCADE
+    cursor.execute('DELETE FROM `team` WHERE `name` LIKE %s', PREFIX + '%')
+    cursor.execute('DELETE FROM `user` WHERE `name` LIKE %s', PREFIX + '%')
+    connection.commit()
+
+
+def set_indexes(cursor, present):
+    cursor.execute('SHOW INDEX FROM `event`')
+    existing = {row[2] for row in cursor}
+    for name, columns in INDEXES.items():
+        if present and name not in existing:
+            cursor.execute('ALTER TABLE `event` ADD INDEX `%s` %s' % (name, columns))
+        elif not present and name in existing:
+            cursor.execute('ALTER TABLE `event` DROP INDEX `%s`' % name)
+
+
+def run_queries(cursor, team_ids, user_ids, repeat):
+    now = int(time.time())
+    results = {}
+    for label, query in QUERIES.items():
+        timings = []
+        plan = None
+        for _ in range(repeat):
+            params = {
+                'team_id': random.choice(team_ids),
+                'user_id': random.choice(user_ids),
+                'user_ids': tuple(random.sample(user_ids, min(10, len(user_ids)))),
+                'schedule_id': random.randint(1, 10000),
+                'start': now - 7 * DAY,
+                'end': now + 21 * DAY,
+            }
+            if plan is None:
+                cursor.execute('EXPLAIN ' + query, params)
+                plan = [(row['table'], row['type'], row['key'], row['rows']) for row in cursor]
+            begin = time.time()
+            cursor.execute(query, params)
+            cursor.fetchall()
+            timings.append((time.time() - begin) * 1000)
+        results[label] = (plan, statistics.median(timings))
+    return results
+
+
+def report(title, results):
+    print('== %s' % title)
+    for label, (plan, median_ms) in results.items():
+        print('%-26s %8.2f ms  %s' % (label, median_ms, plan))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('config')
+    parser.add_argument('--events', type=int, default=1000000)
+    parser.add_argument('--teams', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--skip-seed', action='store_true', help='reuse previously seeded benchmark rows')
+    parser.add_argument('--cleanup', action='store_true', help='remove the seeded benchmark rows and exit')
+    args = parser.parse_args()
+
+    db.init(read_config(args.config)['db'])
+    connection = db.connect()
+    cursor = connection.cursor()
+    if args.cleanup:
+        cleanup(cursor, connection)
+        return
+
+    if args.skip_seed:
+        cursor.execute('SELECT `id` FROM `team` WHERE `name` LIKE %s', PREFIX + '%')
+        team_ids = [row[0] for row in cursor]
+        cursor.execute('SELECT `id` FROM `user` WHERE `name` LIKE %s', PREFIX + '%')
+        user_ids = [row[0] for row in cursor]
+    else:
+        team_ids, user_ids = seed(cursor, connection, args.events, args.teams, args.users)
+
+    dict_cursor = connection.cursor(db.DictCursor)
+    set_indexes(cursor, False)
+    report('without composite indexes', run_queries(dict_cursor, team_ids, user_ids, args.repeat))
+    set_indexes(cursor, True)
+    report('with composite indexes', run_queries(dict_cursor, team_ids, user_ids, args.repeat))
+    cursor.close()
+    dict_cursor.close()
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+-- -----------------------------------------------------
+-- Update to Table `event`
+-- -----------------------------------------------------
+
+-- Composite indexes for the time-range lookups made by the events, oncall, summary and
+-- ical endpoints, the reminder and the scheduler (team/user + start/end, schedule + start).
+ALTER TABLE `event`
+  ADD INDEX `event_team_id_start_end_idx` (`team_id` ASC, `start` ASC, `end` ASC),
+  ADD INDEX `event_user_id_start_end_idx` (`user_id` ASC, `start` ASC, `end` ASC),
+  ADD INDEX `event_schedule_id_start_idx` (`schedule_id` ASC, `start` ASC);
@@ -0,0 +1,11 @@
+-- -----------------------------------------------------
+-- Update to Table `notification_queue`
+-- -----------------------------------------------------
+
+-- Lease columns set by the notifier when it claims due messages, so that a message is queued
+-- for sending once even when sending is slow or several notifiers poll the table. The index
+-- covers the notifier poll on active, due messages.
+ALTER TABLE `notification_queue`
+  ADD COLUMN `claimed_by` VARCHAR(64) NULL DEFAULT NULL,
+  ADD COLUMN `claimed_until` BIGINT(20) UNSIGNED NULL DEFAULT NULL,
+  ADD INDEX `notification_queue_active_send_time_idx` (`active` ASC, `send_time` ASC);
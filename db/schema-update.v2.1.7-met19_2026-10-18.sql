@@ -0,0 +1,9 @@
+-- -----------------------------------------------------
+-- Update to Table `event`
+-- -----------------------------------------------------
+
+-- The reminder finds the first event of each link by looking for an earlier event with the same
+-- link_id; (link_id, start) answers that from the index alone. It supersedes the link_id index.
+ALTER TABLE `event`
+  ADD INDEX `event_link_id_start_idx` (`link_id` ASC, `start` ASC),
+  DROP INDEX `event_link_id_idx`;
@@ -0,0 +1,12 @@
+-- -----------------------------------------------------
+-- Update to Table `notification_queue`
+-- -----------------------------------------------------
+
+-- Retry metadata for the notifier: failed messages stay active and are retried at next_attempt,
+-- with exponential backoff, until they reach the configured number of attempts and are moved to
+-- the dead-letter state (active = 0, dead_letter = 1). last_error holds the most recent failure.
+ALTER TABLE `notification_queue`
+  ADD COLUMN `attempts` INT(11) UNSIGNED NOT NULL DEFAULT 0,
+  ADD COLUMN `next_attempt` BIGINT(20) UNSIGNED NULL DEFAULT NULL,
+  ADD COLUMN `last_error` VARCHAR(1024) NULL DEFAULT NULL,
+  ADD COLUMN `dead_letter` BOOL NOT NULL DEFAULT FALSE;
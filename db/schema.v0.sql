@@ -235,7 +235,10 @@ CREATE TABLE IF NOT EXISTS `event` (
   INDEX `event_role_id_fk_idx` (`role_id` ASC),
   INDEX `event_user_id_fk_idx` (`user_id` ASC),
   INDEX `event_team_id_fk_idx` (`team_id` ASC),
-  INDEX `event_link_id_idx` (`link_id` ASC),
+  INDEX `event_link_id_start_idx` (`link_id` ASC, `start` ASC),
+  INDEX `event_team_id_start_end_idx` (`team_id` ASC, `start` ASC, `end` ASC),
+  INDEX `event_user_id_start_end_idx` (`user_id` ASC, `start` ASC, `end` ASC),
+  INDEX `event_schedule_id_start_idx` (`schedule_id` ASC, `start` ASC),
   CONSTRAINT `event_user_id_fk`
     FOREIGN KEY (`user_id`)
     REFERENCES `user` (`id`)
@@ -410,7 +413,14 @@ CREATE TABLE IF NOT EXISTS `notification_queue` (
   `type_id` BIGINT(20) UNSIGNED NOT NULL,
   `active` BOOL,
   `sent` BOOL,
+  `claimed_by` VARCHAR(64) NULL DEFAULT NULL,
+  `claimed_until` BIGINT(20) UNSIGNED NULL DEFAULT NULL,
+  `attempts` INT(11) UNSIGNED NOT NULL DEFAULT 0,
+  `next_attempt` BIGINT(20) UNSIGNED NULL DEFAULT NULL,
+  `last_error` VARCHAR(1024) NULL DEFAULT NULL,
+  `dead_letter` BOOL NOT NULL DEFAULT FALSE,
   PRIMARY KEY (`id`),
+  INDEX `notification_queue_active_send_time_idx` (`active` ASC, `send_time` ASC),
   CONSTRAINT `notification_queue_user_id_fk` FOREIGN KEY (`user_id`) REFERENCES `user` (`id`)
     ON DELETE CASCADE,
   CONSTRAINT `notification_queue_type_id_fk` FOREIGN KEY (`type_id`) REFERENCES `notification_type` (`id`)
@@ -3,6 +3,15 @@
 
 
 def init(application, config):
+    from . import roster_visibility
+    cache_config = config.get('roster_visibility', {})
+    roster_visibility.snapshot_cache.configure(max_size=cache_config.get('max_size'), ttl=cache_config.get('ttl'))
+
+    from . import oncall_snapshot
+    cache_config = config.get('oncall_snapshot', {})
+    oncall_snapshot.snapshot_cache.configure(max_size=cache_config.get('max_size'), ttl=cache_config.get('ttl'))
+    oncall_snapshot.service_cache.configure(max_size=cache_config.get('max_size'), ttl=cache_config.get('ttl'))
+
     from . import teams, team, team_summary, team_oncall, team_changes
     application.add_route('/api/v0/teams', teams)
     application.add_route('/api/v0/teams/{team}', team)
@@ -45,6 +54,9 @@ def init(application, config):
     application.add_route('/api/v0/services/{service}/oncall', service_oncall)
     application.add_route('/api/v0/services/{service}/oncall/{role}', service_oncall)
 
+    from . import bulk_oncall
+    application.add_route('/api/v0/oncall', bulk_oncall)
+
     from . import team_services, team_service, service_teams
     application.add_route('/api/v0/team_services', team_service)
     application.add_route('/api/v0/teams/{team}/services', team_services)
@@ -80,7 +92,8 @@ def init(application, config):
     application.add_route('/api/v0/notification_types', notification_types)
     application.add_route('/api/v0/modes', modes)
 
-    from . import search
+    from . import search, search_index
+    search_index.init(config.get('search_index', {}))
     application.add_route('/api/v0/search', search)
 
     from . import audit
@@ -100,7 +113,10 @@ def init(application, config):
     application.add_route('/api/v0/teams/{team}/subscriptions', team_subscriptions)
     application.add_route('/api/v0/teams/{team}/subscriptions/{subscription}/{role}', team_subscription)
 
-    from . import user_ical, team_ical
+    from . import ical, user_ical, team_ical
+    cache_config = config.get('ical_cache', {})
+    ical.ical_cache.configure(max_size=cache_config.get('max_size'), ttl=cache_config.get('ttl'))
+    ical.max_cached_body = cache_config.get('max_body_size', ical.max_cached_body)
     application.add_route('/api/v0/users/{user_name}/ical', user_ical)
     application.add_route('/api/v0/teams/{team}/ical', team_ical)
 
@@ -70,7 +70,7 @@ def on_get(req, resp):
     :query start: lower bound for audit entry's timestamp (unix timestamp)
     :query end: upper bound for audit entry's timestamp (unix timestamp)
     '''
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
     if 'action' in req.params:
         req.params['action'] = req.get_param_as_list('action')
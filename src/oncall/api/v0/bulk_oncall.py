@@ -0,0 +1,176 @@
+# Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
+# See LICENSE in the project root for license information.
+
+import time
+from collections import defaultdict
+from falcon import HTTPBadRequest
+from ujson import dumps as json_dumps
+from ... import db
+from .oncall_snapshot import oncall_rows
+
+
+def get_entity_teams(cursor, teams, services):
+    '''
+    :return: dict of team name to (id, override_phone_number), and dict of service name to the
+             list of (team id, team name, override_phone_number) of the teams owning it
+    '''
+    team_info, service_teams = {}, defaultdict(list)
+    queries, args = [], []
+    if teams:
+        queries.append('''SELECT `team`.`id`, `team`.`name`, `team`.`override_phone_number`, NULL AS `service`
+                          FROM `team` WHERE `team`.`name` IN %s''')
+        args.append(teams)
+    if services:
+        queries.append('''SELECT `team`.`id`, `team`.`name`, `team`.`override_phone_number`, `service`.`name` AS `service`
+                          FROM `team_service`
+                          JOIN `service` ON `service`.`id` = `team_service`.`service_id`
+                          JOIN `team` ON `team`.`id` = `team_service`.`team_id`
+                          WHERE `service`.`name` IN %s''')
+        args.append(services)
+    cursor.execute(' UNION ALL '.join(queries), args)
+    for row in cursor:
+        if row['service'] is None:
+            team_info[row['name']] = (row['id'], row['override_phone_number'])
+        else:
+            service_teams[row['service']].append((row['id'], row['name'], row['override_phone_number']))
+    return team_info, service_teams
+
+
+def get_oncall_events(cursor, team_ids, roles, at):
+    '''
+    Events of the given teams, and of the team/role pairs they subscribe to, ongoing at the given time.
+
+    :return: dict of team id to its list of events, each with its user's contacts
+    '''
+    cursor.execute('SELECT `team_id`, `subscription_id`, `role_id` FROM `team_subscription` WHERE `team_id` IN %s',
+                   (list(team_ids),))
+    subscriptions = defaultdict(set)
+    for row in cursor:
+        subscriptions[row['team_id']].add((row['subscription_id'], row['role_id']))
+
+    query = '''
+        SELECT `event`.`id`, `event`.`team_id`, `event`.`role_id`,
+               `user`.`full_name` AS `full_name`,
+               `event`.`start`, `event`.`end`,
+               `contact_mode`.`name` AS `mode`,
+               `user_contact`.`destination`,
+               `user`.`name` AS `user`,
+               `team`.`name` AS `team`,
+               `role`.`name` AS `role`
+        FROM `event`
+        JOIN `user` ON `event`.`user_id` = `user`.`id`
+        JOIN `team` ON `event`.`team_id` = `team`.`id`
+        JOIN `role` ON `role`.`id` = `event`.`role_id`
+        LEFT JOIN `user_contact` ON `user`.`id` = `user_contact`.`user_id`
+        LEFT JOIN `contact_mode` ON `contact_mode`.`id` = `user_contact`.`mode_id`
+        WHERE %s BETWEEN `event`.`start` AND `event`.`end`
+            AND `event`.`team_id` IN %s'''
+    event_team_ids = set(team_ids) | {team_id for subs in subscriptions.values() for team_id, _ in subs}
+    args = [at, list(event_team_ids)]
+    if roles:
+        query += ' AND `role`.`name` IN %s'
+        args.append(roles)
+    cursor.execute(query, args)
+
+    events = {}
+    for row in cursor:
+        event = events.get(row['id'])
+        if event is None:
+            event = events[row['id']] = row
+            event['contacts'] = {}
+        mode = row.pop('mode')
+        destination = row.pop('destination')
+        if mode:
+            event['contacts'][mode] = destination
+
+    team_events = defaultdict(list)
+    for team_id in team_ids:
+        subs = subscriptions[team_id]
+        team_events[team_id] = [event for event in events.values()
+                                if event['team_id'] == team_id or (event['team_id'], event['role_id']) in subs]
+    return team_events
+
+
+def on_get(req, resp):
+    '''
+    Get the users on call for several teams and services at once, optionally limited to some roles
+    and at a given time (defaulting to now). Each team and service resolves exactly as
+    ``/api/v0/teams/{team}/oncall`` and ``/api/v0/services/{service}/oncall`` do, including team
+    subscriptions and override phone numbers. Unknown teams and services map to empty lists.
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+       GET /api/v0/oncall?team=team-foo&service=service-foo&service=service-bar&role=primary HTTP/1.1
+       Host: example.com
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: application/json
+
+       {
+         "teams": {
+           "team-foo": [
+             {
+               "user": "foo",
+               "full_name": "Foo Icecream",
+               "team": "team-foo",
+               "role": "primary",
+               "start": 1487426400,
+               "end": 1487469600,
+               "contacts": {
+                 "call": "+1 123-456-7890",
+                 "email": "foo@example.com"
+               }
+             }
+           ]
+         },
+         "services": {
+           "service-foo": [...],
+           "service-bar": []
+         }
+       }
+
+    :query team: team name, may be repeated
+    :query service: service name, may be repeated
+    :query role: role name to limit the lookup to, may be repeated
+    :query at: unix timestamp to resolve on-call at, defaults to now
+
+    :statuscode 200: no error
+    :statuscode 400: neither team nor service given
+    '''
+    teams = req.get_param_as_list('team') or []
+    services = req.get_param_as_list('service') or []
+    roles = req.get_param_as_list('role')
+    at = req.get_param_as_int('at')
+    if at is None:
+        at = int(time.time())
+    if not teams and not services:
+        raise HTTPBadRequest(title='Invalid request', description='team or service required')
+
+    connection = db.connect(req)
+    cursor = connection.cursor(db.DictCursor)
+    team_info, service_teams = get_entity_teams(cursor, teams, services)
+    team_ids = {team_id for team_id, _ in team_info.values()}
+    team_ids.update(team_id for owners in service_teams.values() for team_id, _, _ in owners)
+    team_events = get_oncall_events(cursor, team_ids, roles, at) if team_ids else {}
+    cursor.close()
+    connection.close()
+
+    payload = {'teams': {}, 'services': {}}
+    for team in teams:
+        if team not in team_info:
+            payload['teams'][team] = []
+            continue
+        team_id, override_number = team_info[team]
+        payload['teams'][team] = oncall_rows(team_events[team_id], lambda event: override_number)
+    for service in services:
+        owners = service_teams.get(service, [])
+        override_numbers = {name: number for _, name, number in owners}
+        events = [event for team_id, _, _ in owners for event in team_events[team_id]]
+        payload['services'][service] = oncall_rows(events, lambda event: override_numbers.get(event['team']))
+    resp.text = json_dumps(payload)
@@ -13,6 +13,8 @@ from ...utils import (
 from ...constants import EVENT_DELETED, EVENT_EDITED
 
 from .events import columns, all_columns
+from .ical import invalidate_ical
+from .oncall_snapshot import invalidate_oncall
 
 update_columns = {
     'start': '`start`=%(start)s',
@@ -64,7 +66,7 @@ def on_get(req, resp, event_id):
                JOIN `role` ON `role`.`id` = `event`.`role_id`
                WHERE `event`.`id` = %%s''' % cols
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
     cursor.execute(query, event_id)
     data = cursor.fetchone()
@@ -114,7 +116,7 @@ def on_put(req, resp, event_id):
             description='Invalid column'
         )
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
     try:
         cursor.execute('''SELECT
@@ -181,6 +183,8 @@ def on_put(req, resp, event_id):
         raise
     else:
         connection.commit()
+        invalidate_ical(teams=[event_data['team_id']], users=[event_data['user_id'], new_ev_data['user_id']])
+        invalidate_oncall(teams=[event_data['team_id']])
     finally:
         cursor.close()
         connection.close()
@@ -201,7 +205,7 @@ def on_delete(req, resp, event_id):
     :statuscode 403: Delete not allowed; logged in user is not a team member
     :statuscode 404: Event not found
     """
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
 
     try:
@@ -232,6 +236,8 @@ def on_delete(req, resp, event_id):
         create_audit({'old_event': ev}, ev['team'], EVENT_DELETED, req, cursor)
 
         connection.commit()
+        invalidate_ical(teams=[ev['team_id']], users=[ev['user_id']])
+        invalidate_oncall(teams=[ev['team_id']])
     finally:
         cursor.close()
         connection.close()
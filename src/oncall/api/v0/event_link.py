@@ -10,6 +10,8 @@ from ...utils import (
 )
 from ...auth import login_required, check_calendar_auth
 from ...constants import EVENT_DELETED, EVENT_EDITED
+from .ical import invalidate_ical
+from .oncall_snapshot import invalidate_oncall
 
 update_columns = {
     'role': '`role_id`=(SELECT `id` FROM `role` WHERE `name`=%(role)s)',
@@ -33,7 +35,7 @@ def on_delete(req, resp, link_id):
     :statuscode 403: Delete not allowed; logged in user is not a team member
     :statuscode 404: Events not found
     """
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
 
     try:
@@ -63,6 +65,8 @@ def on_delete(req, resp, link_id):
                             start_time=ev['start'])
         create_audit({'old_event': data}, ev['team'], EVENT_DELETED, req, cursor)
         connection.commit()
+        invalidate_ical(teams=[ev['team_id']], users=[ev['user_id']])
+        invalidate_oncall(teams=[ev['team_id']])
     finally:
         cursor.close()
         connection.close()
@@ -96,7 +100,7 @@ def on_put(req, resp, link_id):
             title='Invalid event update',
             description='Invalid column'
         )
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
 
     try:
@@ -153,6 +157,8 @@ def on_put(req, resp, link_id):
                             EVENT_EDITED, {event_summary['user_id'], new_ev['user_id']}, cursor,
                             start_time=event_summary['start'])
         connection.commit()
+        invalidate_ical(teams=[event_summary['team_id']], users=[event_summary['user_id'], new_ev['user_id']])
+        invalidate_oncall(teams=[event_summary['team_id']])
     finally:
         cursor.close()
         connection.close()
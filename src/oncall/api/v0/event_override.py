@@ -9,6 +9,9 @@ from ...auth import login_required, check_calendar_auth_by_id
 from ... import db, constants
 from ...utils import load_json_body, user_in_team, create_notification, create_audit
 from ...constants import EVENT_SUBSTITUTED
+from .users import get_user_data
+from .ical import invalidate_ical
+from .oncall_snapshot import invalidate_oncall
 
 
 @login_required
@@ -76,7 +79,7 @@ def on_post(req, resp):
                                 JOIN `user` ON `event`.`user_id` = `user`.`id`
                             WHERE `event`.`id` IN %s'''
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
     try:
         cursor.execute(get_events_query, (event_ids,))
@@ -204,8 +207,9 @@ def on_post(req, resp):
 
         cursor.execute(event_return_query, (event_ids,))
         ret_data = cursor.fetchall()
-        cursor.execute('SELECT full_name, id FROM user WHERE id IN %s', ((user_id, events[0]['user_id']),))
-        full_names = {row['id']: row['full_name'] for row in cursor}
+        full_names = {u['id']: u['full_name'] for u in get_user_data(['id', 'full_name'], {},
+                                                                     dbinfo=(connection, cursor),
+                                                                     ids=[user_id, events[0]['user_id']])}
         context = {'full_name_0': full_names[user_id], 'full_name_1': full_names[events[0]['user_id']],
                    'role': ret_data[0]['role'], 'team': ret_data[0]['team']}
         create_notification(context, events[0]['team_id'], [events[0]['role_id']], EVENT_SUBSTITUTED,
@@ -217,6 +221,8 @@ def on_post(req, resp):
         raise
     else:
         connection.commit()
+        invalidate_ical(teams=[team_id], users={user_id} | {ev['user_id'] for ev in events})
+        invalidate_oncall(teams=[team_id])
     finally:
         cursor.close()
         connection.close()
@@ -8,6 +8,9 @@ from ... import db, constants
 from ...utils import load_json_body, create_notification, create_audit
 from ...auth import login_required, check_calendar_auth_by_id
 from ...constants import EVENT_SWAPPED
+from .users import get_user_data
+from .ical import invalidate_ical
+from .oncall_snapshot import invalidate_oncall
 
 
 @login_required
@@ -53,7 +56,7 @@ def on_post(req, resp):
             description='Must provide 2 events'
         )
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
     try:
         # Accumulate event info for each link/event id
@@ -116,9 +119,9 @@ def on_post(req, resp):
         cursor.execute(change_queries[1],
                        (user_0, [e1['id'] for e1 in events_1]))
 
-        cursor.execute('SELECT id, full_name FROM user WHERE id IN %s',
-                       ([user_0, user_1],))
-        full_names = {row['id']: row['full_name'] for row in cursor}
+        full_names = {u['id']: u['full_name'] for u in get_user_data(['id', 'full_name'], {},
+                                                                     dbinfo=(connection, cursor),
+                                                                     ids=[user_0, user_1])}
         cursor.execute('SELECT name FROM team WHERE id = %s',
                        events[0]['team_id'])
         team_name = cursor.fetchone()['name']
@@ -139,6 +142,8 @@ def on_post(req, resp):
                       'events_swapped': (events_0, events_1)},
                      team_name, EVENT_SWAPPED, req, cursor)
         connection.commit()
+        invalidate_ical(teams=[events[0]['team_id']], users=[user_0, user_1])
+        invalidate_oncall(teams=[events[0]['team_id']])
 
     except HTTPError:
         raise
@@ -1,6 +1,7 @@
 # Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
 # See LICENSE in the project root for license information.
 
+import base64
 import time
 import logging
 from falcon import HTTP_201, HTTPError, HTTPBadRequest
@@ -12,6 +13,8 @@ from ...utils import (
     load_json_body, user_in_team_by_name, create_notification, create_audit
 )
 from ...constants import EVENT_CREATED
+from .ical import invalidate_ical
+from .oncall_snapshot import invalidate_oncall
 
 logger = logging.getLogger('oncall.api.v0.events')
 
@@ -72,8 +75,101 @@ constraints = {
     'user__endswith': '`user`.`name` LIKE CONCAT("%%", %s)'
 }
 
+# Events fetched per query when streaming
+stream_batch_size = 1000
+
 TEAM_PARAMS = {'team', 'team__eq', 'team__contains', 'team__startswith', 'team_endswith', 'team_id'}
 
+# Team and user equality constraints expressed on the event table's own columns, so that they can be
+# answered from the (team_id, start, end) and (user_id, start, end) indexes rather than from the joins.
+event_constraints = {
+    'team': '`event`.`team_id` = (SELECT `id` FROM `team` WHERE `name` = %s)',
+    'team__eq': '`event`.`team_id` = (SELECT `id` FROM `team` WHERE `name` = %s)',
+    'team_id': '`event`.`team_id` = %s',
+    'user': '`event`.`user_id` = (SELECT `id` FROM `user` WHERE `name` = %s)',
+    'user__eq': '`event`.`user_id` = (SELECT `id` FROM `user` WHERE `name` = %s)',
+}
+
+
+def constraint_rank(key):
+    if key in event_constraints:
+        return 0
+    if key.startswith('start') or key.startswith('end'):
+        return 1
+    return 2
+
+
+def build_where_clause(keys, get_value):
+    '''
+    Build WHERE clause fragments and values for the given constraint keys. Clauses lead with the
+    indexed event columns: team/user equality first, then the start/end range, then everything else.
+
+    :param keys: iterable of keys from ``constraints``
+    :param get_value: callable returning the value of a key, e.g. ``req.get_param``
+    :return: (where_params, where_vals)
+    '''
+    where_params = []
+    where_vals = []
+    for key in sorted(keys, key=lambda k: (constraint_rank(k), k)):
+        where_params.append(event_constraints.get(key, constraints[key]))
+        where_vals.append(get_value(key))
+    return where_params, where_vals
+
+
+def encode_page_token(start, event_id):
+    return base64.urlsafe_b64encode(('%d:%d' % (start, event_id)).encode()).decode()
+
+
+def decode_page_token(token):
+    try:
+        start, event_id = base64.urlsafe_b64decode(token.encode()).decode().split(':')
+        return int(start), int(event_id)
+    except (ValueError, UnicodeError):
+        raise HTTPBadRequest(title='Invalid page token')
+
+
+def stream_rows(query, where_params, where_vals, page_start=None, page_id=None, limit=None):
+    '''
+    Rows of the events query, ordered by start and id, fetched stream_batch_size at a time with a keyset
+    condition. A connection is checked out of the pool only while each batch is read, never while the
+    client reads the response; as with paginated requests, each batch sees the events as of its own query.
+    '''
+    while limit is None or limit > 0:
+        batch_size = stream_batch_size if limit is None else min(limit, stream_batch_size)
+        batch_params, batch_vals = list(where_params), list(where_vals)
+        if page_start is not None:
+            batch_params.append('(`event`.`start` > %s OR (`event`.`start` = %s AND `event`.`id` > %s))')
+            batch_vals += [page_start, page_start, page_id]
+        connection = db.connect()
+        cursor = connection.cursor(db.DictCursor)
+        try:
+            cursor.execute('%s WHERE %s ORDER BY `event`.`start`, `event`.`id` LIMIT %d'
+                           % (query, ' AND '.join(batch_params), batch_size), batch_vals)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+            connection.close()
+        for row in rows:
+            page_start, page_id = row.pop('_page_start'), row.pop('_page_id')
+            yield row
+        if len(rows) < batch_size:
+            return
+        if limit is not None:
+            limit -= len(rows)
+
+
+def ndjson_chunks(rows):
+    for row in rows:
+        yield (json_dumps(row) + '\n').encode()
+
+
+def json_array_chunks(rows):
+    separator = b'['
+    for row in rows:
+        yield separator + json_dumps(row).encode()
+        separator = b','
+    yield b']' if separator == b',' else b'[]'
+
 
 def on_get(req, resp):
     """
@@ -146,6 +242,12 @@ def on_get(req, resp):
     :query user__contains: user name contains param
     :query user__startswith: user name starts with param
     :query user__endswith: user name ends with param
+    :query limit: return at most this many events, ordered by start and id, as
+        ``{"events": [...], "next_token": "..."}``. Pass ``next_token`` back as ``page_token``
+        to get the following page; it is null on the last page.
+    :query page_token: continuation token from a previous page
+    :query stream: ``ndjson`` or ``json`` to stream the events, ordered by start and id, as
+        newline-delimited JSON or as a JSON array
 
     :statuscode 200: no error
     :statuscode 400: bad request
@@ -154,11 +256,24 @@ def on_get(req, resp):
     if fields:
         fields = [columns[f] for f in fields if f in columns]
     req.params.pop('fields', None)
+    limit = req.get_param_as_int('limit', min_value=1)
+    page_start = page_id = None
+    if req.get_param('page_token'):
+        page_start, page_id = decode_page_token(req.get_param('page_token'))
+    stream = req.get_param('stream')
+    if stream not in (None, 'ndjson', 'json'):
+        raise HTTPBadRequest(title='Invalid stream format', description='stream must be ndjson or json')
+    for key in ('limit', 'page_token', 'stream'):
+        req.params.pop(key, None)
     include_sub = req.get_param_as_bool('include_subscribed')
     if include_sub is None:
         include_sub = True
     req.params.pop('include_subscribed', None)
     cols = ', '.join(fields) if fields else all_columns
+    paginate = limit and not stream
+    if paginate or stream:
+        # pages and stream batches continue from the last row's (start, id), whatever fields were asked for
+        cols += ', `event`.`start` AS `_page_start`, `event`.`id` AS `_page_id`'
     if any(key not in constraints for key in req.params):
         raise HTTPBadRequest(
             title='Bad constraint param'
@@ -167,7 +282,7 @@ def on_get(req, resp):
     # Getting Team ID
     query = 'SELECT `id` FROM `team` WHERE `name`=%s'
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
 
     team_params = req.params.keys() & TEAM_PARAMS
@@ -182,41 +297,27 @@ def on_get(req, resp):
                LEFT JOIN `schedule` ON `schedule`.`id` = `event`.`schedule_id`
                LEFT JOIN `roster` ON `roster`.`id` = `schedule`.`roster_id`''' % cols
 
-    where_params = []
-    where_vals = []
-
     # Build where clause. If including subscriptions, deal with team parameters later
     params = req.params.keys() - TEAM_PARAMS if include_sub else req.params
-    for key in params:
-        val = req.get_param(key)
-        if key in constraints:
-            where_params.append(constraints[key])
-            where_vals.append(val)
+    where_params, where_vals = build_where_clause(params, req.get_param)
 
     # Deal with team subscriptions and team parameters
-    team_where = []
-    subs_vals = []
     if include_sub and team_params:
-
-        for key in team_params:
-            val = req.get_param(key)
-            team_where.append(constraints[key])
-            subs_vals.append(val)
-        subs_and = ' AND '.join(team_where)
+        subs_keys = sorted(team_params)
+        subs_and = ' AND '.join(constraints[key] for key in subs_keys)
+        subs_vals = [req.get_param(key) for key in subs_keys]
         cursor.execute('''SELECT `subscription_id`, `role_id` FROM `team_subscription`
                           JOIN `team` ON `team_id` = `team`.`id`
                           WHERE %s''' % subs_and,
                        subs_vals)
+        team_where, team_vals = build_where_clause(team_params, req.get_param)
+        team_and = ' AND '.join(team_where)
         if cursor.rowcount != 0:
             # Build where clause based on team params and subscriptions
-            subs_and = '(%s OR (%s))' % (subs_and, ' OR '.join(['`team`.`id` = %s AND `role`.`id` = %s' %
+            team_and = '(%s OR (%s))' % (team_and, ' OR '.join(['`event`.`team_id` = %s AND `event`.`role_id` = %s' %
                                                                 (row['subscription_id'], row['role_id']) for row in cursor]))
-        where_params.append(subs_and)
-        where_vals += subs_vals
-
-    where_query = ' AND '.join(where_params)
-    if where_query:
-        query = '%s WHERE %s' % (query, where_query)
+        where_params.insert(0, team_and)
+        where_vals = team_vals + where_vals
 
     session = req.env['beaker.session']
     user = None
@@ -224,33 +325,48 @@ def on_get(req, resp):
         user = session['user']
 
     roster = get_roster_by_team_id(cursor, team_id, user)
-    
+
+    # Only events of users visible in the team's rosters are returned, and only ongoing ones to anonymous users
+    users = {user['name'] for roster in roster.values() for user in roster['users']}
+    where_params.append('`user`.`name` IN %s' if users else 'FALSE')
+    if users:
+        where_vals.append(list(users))
+    if user is None:
+        now = int(time.time())
+        where_params.append('`event`.`start` <= %s AND `event`.`end` >= %s')
+        where_vals += [now, now]
+
+    if stream:
+        cursor.close()
+        connection.close()
+        resp.content_type = 'application/x-ndjson' if stream == 'ndjson' else 'application/json'
+        rows = stream_rows(query, where_params, where_vals, page_start, page_id, limit)
+        resp.stream = ndjson_chunks(rows) if stream == 'ndjson' else json_array_chunks(rows)
+        return
+
+    if page_start is not None:
+        where_params.append('(`event`.`start` > %s OR (`event`.`start` = %s AND `event`.`id` > %s))')
+        where_vals += [page_start, page_start, page_id]
+    query = '%s WHERE %s' % (query, ' AND '.join(where_params))
+    if limit or page_start is not None:
+        query += ' ORDER BY `event`.`start`, `event`.`id`'
+    if limit:
+        query += ' LIMIT %d' % limit
+
     cursor.execute(query, where_vals)
     data = cursor.fetchall()
-
     cursor.close()
     connection.close()
 
-    # Clean the data
-    users = {user['name'] for roster in roster.values() for user in roster['users']}
-    now = int(time.time())
-
-    filtered_data = []
-
-    for i in range(len(data)):
-        row = data[i]
-        if row['user'] in users:
-            if user is not None:
-                filtered_data.append(data[i])
-            else:
-                if row['end'] >= now and row['start'] <= now:
-                    filtered_data.append(data[i])
-            continue
-        
-        data[i]['user'] = row['role_display_name']
-        data[i]['full_name'] = None
-
-    resp.text = json_dumps(filtered_data)
+    if not paginate:
+        resp.text = json_dumps(data)
+        return
+    next_token = None
+    if len(data) == limit:
+        next_token = encode_page_token(data[-1]['_page_start'], data[-1]['_page_id'])
+    for row in data:
+        del row['_page_start'], row['_page_id']
+    resp.text = json_dumps({'events': data, 'next_token': next_token})
 
 
 @login_required
@@ -324,7 +440,7 @@ def on_post(req, resp):
         columns.append('`note`')
         values.append('%(note)s')
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
 
     if not user_in_team_by_name(cursor, data['user'], data['team']):
@@ -358,6 +474,8 @@ def on_post(req, resp):
                      req,
                      cursor)
         connection.commit()
+        invalidate_ical(teams=[ev_info['team_id']], users=[ev_info['user_id']])
+        invalidate_oncall(teams=[ev_info['team_id']])
     except db.IntegrityError as e:
         err_msg = str(e.args[1])
         if err_msg == 'Column \'role_id\' cannot be null':
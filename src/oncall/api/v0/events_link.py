@@ -10,6 +10,8 @@ from ...utils import (
     load_json_body, gen_link_id, user_in_team_by_name
 )
 from ...auth import login_required, check_calendar_auth
+from .ical import invalidate_ical
+from .oncall_snapshot import invalidate_oncall
 
 
 @login_required
@@ -88,7 +90,7 @@ def on_post(req, resp):
     event_values = []
     link_id = gen_link_id()
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
 
     columns = ('`start`', '`end`', '`user_id`', '`team_id`', '`role_id`', '`link_id`, `note`')
@@ -144,8 +146,11 @@ def on_post(req, resp):
         insert_query = 'INSERT INTO `event` (%s) VALUES (%s)' % (','.join(columns), ','.join(values))
         cursor.executemany(insert_query, event_values)
         connection.commit()
-        cursor.execute('SELECT `id` FROM `event` WHERE `link_id`=%s ORDER BY `start`', link_id)
-        ev_ids = [row[0] for row in cursor]
+        cursor.execute('SELECT `id`, `user_id` FROM `event` WHERE `link_id`=%s ORDER BY `start`', link_id)
+        rows = cursor.fetchall()
+        ev_ids = [row[0] for row in rows]
+        invalidate_ical(teams=[team_id[0]], users={row[1] for row in rows})
+        invalidate_oncall(teams=[team_id[0]])
     except db.IntegrityError as e:
         err_msg = str(e.args[1])
         if err_msg == 'Column \'role_id\' cannot be null':
@@ -1,75 +1,213 @@
 # Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
 # See LICENSE in the project root for license information.
 
+import uuid
 from datetime import datetime as dt
 from datetime import UTC
 from ... import db
+from ...cache import TTLCache
 from icalendar import Calendar, Event, vCalAddress, vText
 
+# Rendered feeds, keyed by feed and request options. Each entry carries ('team', id) and ('user', id)
+# tags for the teams and users it depends on, which invalidate_ical() matches against.
+ical_cache = TTLCache('ical', max_size=1024, ttl=300)
+# Feeds larger than this many bytes are not cached.
+max_cached_body = 1024 * 1024
+# Events read per query while streaming a feed
+feed_batch_size = 1000
+
+CALENDAR_END = b'END:VCALENDAR\r\n'
 
-def events_to_ical(events, identifier, contact=True):
-    connection = db.connect()
-    cursor = connection.cursor(db.DictCursor)
 
+def get_user_info(cursor, usernames, contact=True):
+    '''
+    Full names, and contacts if requested, of the given users in one query.
+    '''
+    users = {username: {'username': username, 'contacts': {}} for username in usernames}
+    if not users:
+        return users
+    if contact:
+        cursor.execute('''
+            SELECT
+                `user`.`name` AS username,
+                `user`.`full_name` AS full_name,
+                `contact_mode`.`name` AS contact_mode,
+                `user_contact`.`destination` AS destination
+            FROM `user_contact`
+            JOIN `contact_mode` ON `contact_mode`.`id` = `user_contact`.`mode_id`
+            JOIN `user` ON `user`.`id` = `user_contact`.`user_id`
+            WHERE `user`.`name` IN %s
+        ''', (list(users),))
+    else:
+        cursor.execute('''
+            SELECT `user`.`name` AS username, `user`.`full_name` AS full_name
+            FROM `user`
+            WHERE `user`.`name` IN %s
+        ''', (list(users),))
+
+    for row in cursor:
+        info = users[row['username']]
+        info['full_name'] = row['full_name']
+        if contact:
+            info['contacts'][row['contact_mode']] = row['destination']
+    return users
+
+
+def calendar_header(identifier):
+    '''
+    The VCALENDAR preamble as icalendar serializes it, without the closing END:VCALENDAR line.
+    '''
     ical = Calendar()
     ical.add('calscale', 'GREGORIAN')
     ical.add('prodid', '-//Oncall//Oncall calendar feed//EN')
     ical.add('version', '2.0')
     ical.add('x-wr-calname', '%s Oncall Calendar' % identifier)
+    return ical.to_ical()[:-len(CALENDAR_END)]
 
-    users = {}
 
+def make_event(event, user, contact=True):
+    full_name = user.get('full_name', user['username'])
+    cal_event = Event()
+    cal_event.add('uid', 'event-%s@oncall' % event['id'])
+    cal_event.add('dtstart', dt.fromtimestamp(event['start'], UTC))
+    cal_event.add('dtend', dt.fromtimestamp(event['end'], UTC))
+    cal_event.add('dtstamp', dt.now(UTC))
+    cal_event.add('summary',
+                  '%s %s shift: %s' % (event['team'], event['role'], full_name))
+    cal_event.add('description',
+                  '%s\n' % full_name +
+                  ('\n'.join(['%s: %s' % (mode, dest) for mode, dest in user['contacts'].items()]) if contact else ''))
+    cal_event.add('TRANSP', 'TRANSPARENT')
+
+    # Attach info about the user oncall
+    attendee = vCalAddress('MAILTO:%s' % (user['contacts'].get('email') if contact else ''))
+    attendee.params['cn'] = vText(full_name)
+    attendee.params['ROLE'] = vText('REQ-PARTICIPANT')
+    cal_event.add('attendee', attendee, encode=0)
+    return cal_event
+
+
+def iter_ical(events, users, identifier, contact=True):
+    '''
+    Serialize a feed one VEVENT at a time. A Calendar serializes its subcomponents one after the
+    other, so the concatenated chunks are byte for byte what Calendar.to_ical() returns for the
+    same events, without holding them all in memory.
+    '''
+    yield calendar_header(identifier)
     for event in events:
-        username = event['user']
-        if username not in users:
-            if contact:
-                cursor.execute('''
-                    SELECT
-                        `user`.`full_name` AS full_name,
-                        `contact_mode`.`name` AS contact_mode,
-                        `user_contact`.`destination` AS destination
-                    FROM `user_contact`
-                    JOIN `contact_mode` ON `contact_mode`.`id` = `user_contact`.`mode_id`
-                    JOIN `user` ON `user`.`id` = `user_contact`.`user_id`
-                    WHERE `user`.`name` = %s
-                ''', username)
-            else:
-                cursor.execute('''
-                    SELECT `user`.`full_name` AS full_name
-                    FROM `user`
-                    WHERE `user`.`name` = %s
-                ''', username)
-
-            info = {'username': username, 'contacts': {}}
-            for row in cursor:
-                info['full_name'] = row['full_name']
-                if contact:
-                    info['contacts'][row['contact_mode']] = row['destination']
-            users[username] = info
-        user = users[username]
-
-        # Create the event itself
-        full_name = user.get('full_name', user['username'])
-        cal_event = Event()
-        cal_event.add('uid', 'event-%s@oncall' % event['id'])
-        cal_event.add('dtstart', dt.fromtimestamp(event['start'], UTC))
-        cal_event.add('dtend', dt.fromtimestamp(event['end'], UTC))
-        cal_event.add('dtstamp', dt.now(UTC))
-        cal_event.add('summary',
-                      '%s %s shift: %s' % (event['team'], event['role'], full_name))
-        cal_event.add('description',
-                      '%s\n' % full_name +
-                      ('\n'.join(['%s: %s' % (mode, dest) for mode, dest in user['contacts'].items()]) if contact else ''))
-        cal_event.add('TRANSP', 'TRANSPARENT')
-
-        # Attach info about the user oncall
-        attendee = vCalAddress('MAILTO:%s' % (user['contacts'].get('email') if contact else ''))
-        attendee.params['cn'] = vText(full_name)
-        attendee.params['ROLE'] = vText('REQ-PARTICIPANT')
-        cal_event.add('attendee', attendee, encode=0)
-
-        ical.add_component(cal_event)
+        yield make_event(event, users[event['user']], contact).to_ical()
+    yield CALENDAR_END
+
 
+def events_to_ical(events, identifier, contact=True):
+    connection = db.connect()
+    cursor = connection.cursor(db.DictCursor)
+    users = get_user_info(cursor, {event['user'] for event in events}, contact)
     cursor.close()
     connection.close()
-    return ical.to_ical()
+    return b''.join(iter_ical(events, users, identifier, contact))
+
+
+def event_tags(events):
+    tags = set()
+    for event in events:
+        tags.add(('team', event['team_id']))
+        tags.add(('user', event['user_id']))
+    return tags
+
+
+def invalidate_ical(teams=(), users=()):
+    '''
+    Drop the cached feeds depending on any of the given team or user ids, or every feed if none are given.
+    '''
+    if not teams and not users:
+        ical_cache.clear()
+        return
+    tags = {('team', team_id) for team_id in teams} | {('user', user_id) for user_id in users}
+    ical_cache.invalidate_where(lambda key, value: not tags.isdisjoint(value['tags']))
+
+
+def feed_events(query, args, users, tags, contact):
+    '''
+    The events of a feed, ordered by start and id, read feed_batch_size at a time with a keyset condition
+    appended to query (which must end with its WHERE clause). A connection is checked out only while each
+    batch and the info of its new users are read. Users are added to users, and cache tags to tags.
+    '''
+    page_start = page_id = None
+    while True:
+        batch_query, batch_args = query, list(args)
+        if page_start is not None:
+            batch_query += ' AND (`event`.`start` > %s OR (`event`.`start` = %s AND `event`.`id` > %s))'
+            batch_args += [page_start, page_start, page_id]
+        connection = db.connect()
+        cursor = connection.cursor(db.DictCursor)
+        try:
+            cursor.execute(batch_query + ' ORDER BY `event`.`start`, `event`.`id` LIMIT %d' % feed_batch_size,
+                           batch_args)
+            events = cursor.fetchall()
+            users.update(get_user_info(cursor, {event['user'] for event in events} - users.keys(), contact))
+        finally:
+            cursor.close()
+            connection.close()
+        tags.update(event_tags(events))
+        for event in events:
+            yield event
+        if len(events) < feed_batch_size:
+            return
+        page_start, page_id = events[-1]['start'], events[-1]['id']
+
+
+def cache_chunks(chunks, key, entry, generation):
+    '''
+    Pass a streamed feed through, then store its body in ical_cache under key, unless it outgrew
+    max_cached_body or the cache was invalidated since generation.
+    '''
+    body, size = ([] if ical_cache.ttl > 0 else None), 0
+    for chunk in chunks:
+        if body is not None:
+            body.append(chunk)
+            size += len(chunk)
+            if size > max_cached_body:
+                body = None
+        yield chunk
+    if body is not None:
+        entry['body'] = b''.join(body)
+        ical_cache.set(key, entry, generation=generation)
+
+
+def respond(req, resp, key, identifier, contact, prepare):
+    '''
+    Serve a feed from the cache with an ETag, answering 304 when it matches If-None-Match.
+    On a miss, stream it: prepare(cursor) returns the (query, args) selecting the feed's events and the
+    feed's own cache tags. Events are read in batches (see feed_events) and written one VEVENT at a time,
+    so memory does not grow with the feed and no connection is held while the client reads it. The
+    ETag of a streamed feed is picked before it is rendered, and stored with it if it gets cached.
+    '''
+    entry = ical_cache.get(key)
+    if entry is not None:
+        resp.etag = entry['etag']
+        if any(tag == '*' or tag == entry['etag'] for tag in req.if_none_match or ()):
+            resp.status = '304 Not Modified'
+            return
+        resp.set_header('Content-Type', 'text/calendar')
+        resp.data = entry['body']
+        return
+
+    # read before querying, so that a feed invalidated while it is rendered is not cached
+    generation = ical_cache.generation
+    connection = db.connect(req)
+    # end any snapshot taken by the auth checks, so the feed is read after the generation
+    connection.commit()
+    cursor = connection.cursor(db.DictCursor)
+    try:
+        query, args, tags = prepare(cursor)
+    finally:
+        cursor.close()
+        connection.close()
+
+    users = {}
+    entry = {'etag': uuid.uuid4().hex, 'tags': tags}
+    events = feed_events(query, args, users, tags, contact)
+    resp.etag = entry['etag']
+    resp.set_header('Content-Type', 'text/calendar')
+    resp.stream = cache_chunks(iter_ical(events, users, identifier, contact), key, entry, generation)
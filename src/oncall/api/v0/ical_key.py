@@ -10,11 +10,11 @@ def generate_ical_key():
     return str(uuid.uuid4())
 
 
-def check_ical_team(team, requester):
+def check_ical_team(team, requester, req=None):
     """
     Currently we allow users to request ical key for any team calendar
     """
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
 
     cursor.execute(
@@ -31,8 +31,8 @@ def check_ical_team(team, requester):
     return team_exist_and_active != 0
 
 
-def check_ical_key_requester(key, requester):
-    connection = db.connect()
+def check_ical_key_requester(key, requester, req=None):
+    connection = db.connect(req)
     cursor = connection.cursor()
 
     cursor.execute(
@@ -49,8 +49,8 @@ def check_ical_key_requester(key, requester):
     return is_requester != 0
 
 
-def get_name_and_type_from_key(key):
-    connection = db.connect()
+def get_name_and_type_from_key(key, req=None):
+    connection = db.connect(req)
     cursor = connection.cursor()
 
     result = None
@@ -70,8 +70,8 @@ def get_name_and_type_from_key(key):
     return result
 
 
-def get_ical_key(requester, name, type):
-    connection = db.connect()
+def get_ical_key(requester, name, type, req=None):
+    connection = db.connect(req)
     cursor = connection.cursor()
 
     cursor.execute(
@@ -94,8 +94,8 @@ def get_ical_key(requester, name, type):
     return key
 
 
-def update_ical_key(requester, name, type, key):
-    connection = db.connect()
+def update_ical_key(requester, name, type, key, req=None):
+    connection = db.connect(req)
     cursor = connection.cursor()
 
     cursor.execute(
@@ -111,8 +111,8 @@ def update_ical_key(requester, name, type, key):
     connection.close()
 
 
-def delete_ical_key(requester, name, type):
-    connection = db.connect()
+def delete_ical_key(requester, name, type, req=None):
+    connection = db.connect(req)
     cursor = connection.cursor()
 
     cursor.execute(
@@ -130,8 +130,8 @@ def delete_ical_key(requester, name, type):
     connection.close()
 
 
-def get_ical_key_detail(key):
-    connection = db.connect()
+def get_ical_key_detail(key, req=None):
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
 
     cursor.execute(
@@ -149,8 +149,8 @@ def get_ical_key_detail(key):
     return results
 
 
-def get_ical_key_detail_by_requester(requester):
-    connection = db.connect()
+def get_ical_key_detail_by_requester(requester, req=None):
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
 
     cursor.execute(
@@ -167,8 +167,8 @@ def get_ical_key_detail_by_requester(requester):
     return results
 
 
-def invalidate_ical_key(key):
-    connection = db.connect()
+def invalidate_ical_key(key, req=None):
+    connection = db.connect(req)
     cursor = connection.cursor()
 
     cursor.execute(
@@ -184,8 +184,8 @@ def invalidate_ical_key(key):
     connection.close()
 
 
-def invalidate_ical_key_by_requester(requester):
-    connection = db.connect()
+def invalidate_ical_key_by_requester(requester, req=None):
+    connection = db.connect(req)
     cursor = connection.cursor()
 
     cursor.execute(
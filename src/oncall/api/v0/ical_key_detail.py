@@ -11,13 +11,13 @@ from .ical_key import get_ical_key_detail, invalidate_ical_key, check_ical_key_r
 @login_required
 def on_get(req, resp, key):
     challenger = req.context['user']
-    if not (check_ical_key_requester(key, challenger) or check_ical_key_admin(challenger)):
+    if not (check_ical_key_requester(key, challenger, req) or check_ical_key_admin(challenger, req)):
         raise HTTPForbidden(
             title='Unauthorized',
             description='Action not allowed: "%s" is not an admin of ical_key' % (challenger, ),
         )
 
-    results = get_ical_key_detail(key)
+    results = get_ical_key_detail(key, req)
     if not results:
         raise HTTPNotFound()
 
@@ -28,10 +28,10 @@ def on_get(req, resp, key):
 @login_required
 def on_delete(req, resp, key):
     challenger = req.context['user']
-    if not (check_ical_key_requester(key, challenger) or check_ical_key_admin(challenger)):
+    if not (check_ical_key_requester(key, challenger, req) or check_ical_key_admin(challenger, req)):
         raise HTTPForbidden(
             title='Unauthorized',
             description='Action not allowed: "%s" is not an admin of ical_key' % (challenger, ),
         )
 
-    invalidate_ical_key(key)
+    invalidate_ical_key(key, req)
@@ -14,13 +14,13 @@ from .ical_key import (
 @login_required
 def on_get(req, resp, requester):
     challenger = req.context['user']
-    if not (challenger == requester or check_ical_key_admin(challenger)):
+    if not (challenger == requester or check_ical_key_admin(challenger, req)):
         raise HTTPForbidden(
             title='Unauthorized',
             description='Action not allowed: "%s" is not allowed to view ical_keys of "%s"' % (challenger, requester),
         )
 
-    results = get_ical_key_detail_by_requester(requester)
+    results = get_ical_key_detail_by_requester(requester, req)
     if not results:
         raise HTTPNotFound()
 
@@ -31,10 +31,10 @@ def on_get(req, resp, requester):
 @login_required
 def on_delete(req, resp, requester):
     challenger = req.context['user']
-    if not (challenger == requester or check_ical_key_admin(challenger)):
+    if not (challenger == requester or check_ical_key_admin(challenger, req)):
         raise HTTPForbidden(
             title='Unauthorized',
             description='Action not allowed: "%s" is not allowed to delete ical_keys of "%s"' % (challenger, requester),
         )
 
-    invalidate_ical_key_by_requester(requester)
+    invalidate_ical_key_by_requester(requester, req)
@@ -30,7 +30,7 @@ def on_get(req, resp, team):
     """
     challenger = req.context['user']
 
-    key = get_ical_key(challenger, team, 'team')
+    key = get_ical_key(challenger, team, 'team', req)
     if key is None:
         raise HTTPNotFound()
 
@@ -45,14 +45,14 @@ def on_post(req, resp, team):
 
     """
     challenger = req.context['user']
-    if not check_ical_team(team, challenger):
+    if not check_ical_team(team, challenger, req):
         raise HTTPBadRequest(
             title='Invalid team name',
             description='Team "%s" does not exist or is inactive' % team,
         )
 
     key = generate_ical_key()
-    update_ical_key(challenger, team, 'team', key)
+    update_ical_key(challenger, team, 'team', key, req)
 
     resp.status = HTTP_201
     resp.text = key
@@ -67,4 +67,4 @@ def on_delete(req, resp, team):
     """
     challenger = req.context['user']
 
-    delete_ical_key(challenger, team, 'team')
+    delete_ical_key(challenger, team, 'team', req)
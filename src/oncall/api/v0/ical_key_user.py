@@ -32,7 +32,7 @@ def on_get(req, resp, user_name):
             description='Action not allowed: "%s" is not allowed to view ical_key of "%s"' % (challenger, user_name)
         )
 
-    key = get_ical_key(challenger, user_name, 'user')
+    key = get_ical_key(challenger, user_name, 'user', req)
     if key is None:
         raise HTTPNotFound()
 
@@ -59,7 +59,7 @@ def on_post(req, resp, user_name):
         )
 
     key = generate_ical_key()
-    update_ical_key(challenger, user_name, 'user', key)
+    update_ical_key(challenger, user_name, 'user', key, req)
 
     resp.status = HTTP_201
     resp.text = key
@@ -82,4 +82,4 @@ def on_delete(req, resp, user_name):
             description='Action not allowed: "%s" is not allowed to delete ical_key of "%s"' % (challenger, user_name)
         )
 
-    delete_ical_key(challenger, user_name, 'user')
+    delete_ical_key(challenger, user_name, 'user', req)
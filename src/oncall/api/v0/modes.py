@@ -9,7 +9,7 @@ def on_get(req, resp):
     """
     Get all contact modes
     """
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     cursor.execute('SELECT `name` FROM `contact_mode`')
     data = [row[0] for row in cursor]
@@ -30,7 +30,7 @@ def on_get(req, resp):
             }
         ]
     """
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
     cursor.execute('SELECT `name`, `is_reminder` FROM `notification_type`')
     data = cursor.fetchall()
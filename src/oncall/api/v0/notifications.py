@@ -21,7 +21,7 @@ def on_get(req, resp):
             where_vals.append(req.get_param(col))
     if where:
         query += 'WHERE %s' % ', '.join(where)
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
     cursor.execute(query, where_vals)
     data = cursor.fetchall()
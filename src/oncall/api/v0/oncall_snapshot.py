@@ -0,0 +1,165 @@
+# Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
+# See LICENSE in the project root for license information.
+
+'''
+In-process snapshot of who is on call now and next, shared by team_oncall, service_oncall and team_summary.
+
+A team's snapshot holds the current events and, per (team, role), the next events of the team and of
+the team/role pairs it subscribes to, along with the users' contacts. It also records when it stops
+being valid: the first end of a current event or start of a next one. A lookup at or past that time
+reloads it, so shifts roll over exactly at their boundaries. Snapshots are otherwise reloaded every ttl
+seconds, to pick up changes made through other processes, and dropped through invalidate_oncall() by the
+handlers that change events, teams, users or services in this one.
+'''
+
+import time
+from ...cache import TTLCache
+
+snapshot_cache = TTLCache('oncall_snapshot', max_size=4096, ttl=30)
+# Teams owning each service, with their override numbers
+service_cache = TTLCache('service_teams', max_size=4096, ttl=30)
+
+event_columns = '''
+    `event`.`id`, `event`.`start`, `event`.`end`, `event`.`user_id`, `event`.`team_id`, `event`.`role_id`,
+    `user`.`name` AS `user`, `user`.`full_name`, `user`.`photo_url`,
+    `team`.`name` AS `team`,
+    `role`.`name` AS `role`, `role`.`display_name` AS `role_display_name`,
+    `roster`.`name` AS `roster`'''
+
+event_joins = '''
+    JOIN `user` ON `event`.`user_id` = `user`.`id`
+    JOIN `team` ON `event`.`team_id` = `team`.`id`
+    JOIN `role` ON `event`.`role_id` = `role`.`id`
+    LEFT JOIN `schedule` ON `schedule`.`id` = `event`.`schedule_id`
+    LEFT JOIN `roster` ON `roster`.`id` = `schedule`.`roster_id`'''
+
+
+def load_snapshot(cursor, team, now):
+    cursor.execute('SELECT `id`, `name`, `override_phone_number` FROM `team` WHERE `name` = %s', team)
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    team_id = row['id']
+    snapshot = {
+        'team_id': team_id,
+        'team': row['name'],
+        'override_phone_number': row['override_phone_number'],
+        'team_ids': {team_id},
+        'current': {},
+        'next': [],
+        'valid_until': None,
+    }
+
+    cursor.execute('SELECT `subscription_id`, `role_id` FROM `team_subscription` WHERE `team_id` = %s', team_id)
+    team_where = '`event`.`team_id` = %s'
+    args = [team_id]
+    for row in cursor:
+        team_where += ' OR (`event`.`team_id` = %s AND `event`.`role_id` = %s)'
+        args += [row['subscription_id'], row['role_id']]
+        snapshot['team_ids'].add(row['subscription_id'])
+
+    cursor.execute('SELECT %s FROM `event` %s WHERE (%s) AND `event`.`start` <= %%s AND `event`.`end` >= %%s'
+                   % (event_columns, event_joins, team_where), args + [now, now])
+    current = cursor.fetchall()
+    cursor.execute('''SELECT %s FROM `event` %s
+                      JOIN (SELECT `event`.`team_id`, `event`.`role_id`, MIN(`event`.`start`) AS `start`
+                            FROM `event` WHERE `event`.`start` > %%s AND (%s)
+                            GROUP BY `event`.`team_id`, `event`.`role_id`) AS `t1`
+                        ON `event`.`team_id` = `t1`.`team_id` AND `event`.`role_id` = `t1`.`role_id`
+                            AND `event`.`start` = `t1`.`start`'''
+                   % (event_columns, event_joins, team_where), [now] + args)
+    snapshot['next'] = cursor.fetchall()
+
+    contacts = {}
+    user_ids = {event['user_id'] for event in current} | {event['user_id'] for event in snapshot['next']}
+    if user_ids:
+        cursor.execute('''SELECT `user_contact`.`user_id`, `contact_mode`.`name` AS `mode`, `user_contact`.`destination`
+                          FROM `user_contact` JOIN `contact_mode` ON `contact_mode`.`id` = `user_contact`.`mode_id`
+                          WHERE `user_contact`.`user_id` IN %s''', (list(user_ids),))
+        for row in cursor:
+            contacts.setdefault(row['user_id'], {})[row['mode']] = row['destination']
+
+    transitions = []
+    for event in current:
+        event['contacts'] = contacts.get(event['user_id'], {})
+        snapshot['current'].setdefault(event['role'], []).append(event)
+        transitions.append(event['end'] + 1)
+    for event in snapshot['next']:
+        event['contacts'] = contacts.get(event['user_id'], {})
+        transitions.append(event['start'])
+    if transitions:
+        snapshot['valid_until'] = min(transitions)
+    return snapshot
+
+
+def get_snapshot(cursor, team):
+    '''
+    :return: the on-call snapshot of the named team, or None if there is no such team
+    '''
+    now = int(time.time())
+    snapshot = snapshot_cache.get(team)
+    if snapshot is None or (snapshot['valid_until'] is not None and now >= snapshot['valid_until']):
+        snapshot = load_snapshot(cursor, team, now)
+        if snapshot is not None:
+            snapshot_cache.set(team, snapshot)
+    return snapshot
+
+
+def get_current(snapshot, role=None):
+    if role is not None:
+        return snapshot['current'].get(role, [])
+    return [event for events in snapshot['current'].values() for event in events]
+
+
+def get_service_teams(cursor, service):
+    '''
+    :return: list of (name, override_phone_number) of the teams owning the service
+    '''
+    teams = service_cache.get(service)
+    if teams is None:
+        cursor.execute('''SELECT `team`.`name`, `team`.`override_phone_number` FROM `team_service`
+                          JOIN `service` ON `service`.`id` = `team_service`.`service_id`
+                          JOIN `team` ON `team`.`id` = `team_service`.`team_id`
+                          WHERE `service`.`name` = %s''', service)
+        teams = [(row['name'], row['override_phone_number']) for row in cursor]
+        service_cache.set(service, teams)
+    return teams
+
+
+def invalidate_oncall(teams=()):
+    '''
+    Drop the snapshots depending on events of any of the given team ids, or every snapshot and
+    service mapping if no team is given.
+    '''
+    if not teams:
+        snapshot_cache.clear()
+        service_cache.clear()
+        return
+    teams = set(teams)
+    snapshot_cache.invalidate_where(lambda key, value: not teams.isdisjoint(value['team_ids']))
+
+
+def invalidate_service_teams(service):
+    service_cache.invalidate(service)
+
+
+def oncall_rows(events, override_number):
+    '''
+    Format current events the way team_oncall and service_oncall return them: one row per user, with
+    the primary's call and sms contacts replaced by override_number(event) if set.
+    '''
+    ret = {}
+    for event in events:
+        if event['user'] in ret:
+            continue
+        row = {key: event[key] for key in ('full_name', 'start', 'end', 'user', 'team', 'role')}
+        row['contacts'] = dict(event['contacts'])
+        if not row['contacts']:
+            # as returned by the row-per-contact query these endpoints used to run
+            row['destination'] = None
+        number = override_number(event)
+        if number and event['role'] == 'primary':
+            row['contacts']['call'] = number
+            row['contacts']['sms'] = number
+        ret[event['user']] = row
+    return list(ret.values())
@@ -5,6 +5,8 @@ from ... import db
 from ...utils import load_json_body
 from ...auth import check_team_auth, login_required
 from .schedules import get_schedules
+from .ical import invalidate_ical
+from .oncall_snapshot import invalidate_oncall
 from falcon import HTTPNotFound
 from oncall.bin.scheduler import load_scheduler
 
@@ -33,7 +35,7 @@ def on_post(req, resp, schedule_id):
     data = load_json_body(req)
     start_time = data['start']
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
     cursor.execute('''SELECT `scheduler`.`name` FROM `schedule`
                       JOIN `scheduler` ON `schedule`.`scheduler_id` = `scheduler`.`id`
@@ -43,8 +45,11 @@ def on_post(req, resp, schedule_id):
         raise HTTPNotFound()
     scheduler_name = cursor.fetchone()['name']
     scheduler = load_scheduler(scheduler_name)
-    schedule = get_schedules({'id': schedule_id})[0]
+    schedule = get_schedules({'id': schedule_id}, dbinfo=(connection, cursor))[0]
     check_team_auth(schedule['team'], req)
     scheduler.populate(schedule, start_time, (connection, cursor))
+    cursor.execute('SELECT `user_id` FROM `roster_user` WHERE `roster_id` = %s', schedule['roster_id'])
+    invalidate_ical(teams=[schedule['team_id']], users=[row['user_id'] for row in cursor])
+    invalidate_oncall(teams=[schedule['team_id']])
     cursor.close()
     connection.close()
@@ -5,21 +5,22 @@ from ... import db
 from .schedules import get_schedules
 from falcon import HTTPNotFound
 from oncall.bin.scheduler import load_scheduler
+from oncall.scheduler.default import MemoryEventStore
 import operator
 
 
 def on_get(req, resp, schedule_id):
     """
-    Run the scheduler on demand from a given point in time. Unlike populate it doen't permanently delete or insert anything.
+    Run the scheduler on demand from a given point in time. Unlike populate it doen't permanently delete or insert anything:
+    the relevant events are loaded once and the scheduler runs against an in-memory copy of them.
     """
     start_time = float(req.get_param('start', required=True))
     start__lt = req.get_param('start__lt', required=True)
     end__ge = req.get_param('end__ge', required=True)
     team__eq = req.get_param('team__eq', required=True)
     last_end = 0
-    table_name = 'temp_event'
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
     cursor.execute('''SELECT `scheduler`.`name` FROM `schedule`
                       JOIN `scheduler` ON `schedule`.`scheduler_id` = `scheduler`.`id`
@@ -29,7 +30,7 @@ def on_get(req, resp, schedule_id):
         raise HTTPNotFound()
     scheduler_name = cursor.fetchone()['name']
     scheduler = load_scheduler(scheduler_name)
-    schedule = get_schedules({'id': schedule_id})[0]
+    schedule = get_schedules({'id': schedule_id}, dbinfo=(connection, cursor))[0]
     team_id = schedule['team_id']
 
     # get earliest relevant end time
@@ -43,24 +44,49 @@ def on_get(req, resp, schedule_id):
     if cursor.rowcount != 0:
         last_end = min(cursor.fetchall(), key=operator.itemgetter('last_end'))['last_end']
 
-    # create a temporary table with the events that include members of the team's rosters and subscriptions
-    query = '''
-        CREATE TEMPORARY TABLE `temp_event` AS
-        (SELECT DISTINCT `event`.`id`, `event`.`team_id`, `event`.`role_id`,
+    # load the events of the members of the team's rosters and subscriptions
+    cursor.execute('''
+        SELECT DISTINCT `event`.`id`, `event`.`team_id`, `event`.`role_id`,
         `event`.`schedule_id`, `event`.`link_id`, `event`.`user_id`,
-        `event`.`start`, `event`.`end`, `event`.`note`
+        `event`.`start`, `event`.`end`, `event`.`note`,
+        `team`.`name` AS `team`, `role`.`name` AS `role`, `user`.`name` AS `user`, `user`.`full_name`
         FROM `event`
         INNER JOIN `roster_user`
         ON `event`.`user_id`=`roster_user`.`user_id`
+        JOIN `team` ON `team`.`id` = `event`.`team_id`
+        JOIN `role` ON `role`.`id` = `event`.`role_id`
+        JOIN `user` ON `user`.`id` = `event`.`user_id`
         WHERE `roster_user`.`roster_id` IN
         (SELECT `id` FROM `roster` WHERE (`team_id` = %s OR `team_id` IN (SELECT `subscription_id` FROM team_subscription WHERE `team_id` = %s)))
-        AND `event`.`end` >= %s)
-    '''
+        AND `event`.`end` >= %s
+        ORDER BY `event`.`id`
+    ''', (team_id, team_id, last_end))
+    events = cursor.fetchall()
 
-    cursor.execute(query, (team_id, team_id, last_end))
+    cursor.execute('''SELECT `roster_user`.`user_id`, `roster_user`.`in_rotation`, `user`.`active`,
+                             `user`.`name`, `user`.`full_name`
+                      FROM `roster_user` JOIN `user` ON `user`.`id` = `roster_user`.`user_id`
+                      WHERE `roster_user`.`roster_id` = %s''', schedule['roster_id'])
+    roster = cursor.fetchall()
+    cursor.execute('''SELECT `user_id` FROM `schedule_order` WHERE `schedule_id` = %s
+                      ORDER BY `priority`, `user_id`''', schedule_id)
+    schedule_order = [row['user_id'] for row in cursor]
 
-    scheduler.populate(schedule, start_time, (connection, cursor), table_name)
-    resp.text = scheduler.build_preview_response(cursor, start__lt, end__ge, team__eq, table_name)
-    cursor.execute("DROP TEMPORARY TABLE `temp_event`")
+    # subscriptions of the scheduled team and of the team being previewed
+    cursor.execute('''SELECT `team`.`id`, `team`.`name` FROM `team` WHERE `team`.`id` = %s OR `team`.`name` = %s''',
+                   (team_id, team__eq))
+    team_ids = {row['name']: row['id'] for row in cursor}
+    subscriptions = {tid: [] for tid in team_ids.values()}
+    if team_ids:
+        cursor.execute('''SELECT `team_id`, `subscription_id`, `role_id` FROM `team_subscription`
+                          WHERE `team_id` IN %s''', (list(team_ids.values()),))
+        for row in cursor:
+            subscriptions[row['team_id']].append((row['subscription_id'], row['role_id']))
+    cursor.execute("SELECT `id` FROM `role` WHERE `name` = 'vacation'")
+    row = cursor.fetchone()
     cursor.close()
     connection.close()
+
+    store = MemoryEventStore(events, roster, schedule_order, subscriptions, team_ids, row['id'] if row else None)
+    scheduler.preview(schedule, start_time, store)
+    resp.text = scheduler.build_preview_response(store, start__lt, end__ge, team__eq)
@@ -7,8 +7,8 @@ from falcon import HTTPNotFound
 
 from . import ical
 from .ical_key import get_name_and_type_from_key
-from .user_ical import get_user_events
-from .team_ical import get_team_events
+from .user_ical import get_user_events_query, get_user_tags
+from .team_ical import get_team_events_query, get_team_tags
 
 allow_no_auth = True
 
@@ -21,17 +21,23 @@ def on_get(req, resp, key):
     roles = req.get_param_as_list('roles')
     excluded_teams = req.get_param_as_list('excludedTeams')
 
-    name_and_type = get_name_and_type_from_key(key)
+    name_and_type = get_name_and_type_from_key(key, req)
     if name_and_type is None:
         raise HTTPNotFound()
 
     name, type = name_and_type
-    start = int(time.time())
-    events = []
-    if type == 'user':
-        events = get_user_events(name, start, roles=roles, excluded_teams=excluded_teams)
-    elif type == 'team':
-        events = get_team_events(name, start, roles=roles, include_subscribed=True)
 
-    resp.text = ical.events_to_ical(events, name, contact=False)
-    resp.set_header('Content-Type', 'text/calendar')
+    def prepare(cursor):
+        start = int(time.time())
+        if type == 'user':
+            query, args = get_user_events_query(cursor, name, start, roles, excluded_teams)
+            return query, args, get_user_tags(cursor, name)
+        query, args = get_team_events_query(cursor, name, start, roles, include_subscribed=True)
+        return query, args, get_team_tags(cursor, name)
+
+    # the same feed as the authenticated endpoints without contacts, so it shares their cache entries
+    if type == 'user':
+        key = ('user', name, None, tuple(roles or ()), False, tuple(excluded_teams or ()))
+    else:
+        key = ('team', name, None, tuple(roles or ()), False, True)
+    ical.respond(req, resp, key, name, False, prepare)
@@ -4,16 +4,20 @@
 from falcon import HTTPNotFound
 from ... import db
 from ...auth import debug_only
+from .roster_visibility import invalidate_roster_visibility
+from .oncall_snapshot import invalidate_oncall
 
 
 @debug_only
 def on_delete(req, resp, role):
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     # TODO: also remove any schedule and event that references the role?
     cursor.execute('DELETE FROM `role` WHERE `name`=%s', role)
     deleted = cursor.rowcount
     connection.commit()
+    invalidate_roster_visibility()
+    invalidate_oncall()
     cursor.close()
     connection.close()
 
@@ -95,7 +95,7 @@ def on_get(req, resp):
     if where_queries:
         query = '%s WHERE %s' % (query, where_queries)
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
     cursor.execute(query, where_vals)
     data = cursor.fetchall()
@@ -108,7 +108,7 @@ def on_get(req, resp):
 def on_post(req, resp):
     data = load_json_body(req)
     new_role = data['name']
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     try:
         cursor.execute('INSERT INTO `role` (`name`) VALUES (%s)', new_role)
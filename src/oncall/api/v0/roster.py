@@ -5,12 +5,15 @@ from urllib.parse import unquote
 from falcon import HTTPError, HTTPNotFound, HTTPBadRequest
 from ujson import dumps as json_dumps
 
-from ...auth import login_required, check_team_auth
+from ...auth import login_required, check_team_auth, invalidate_permissions
 from ... import db
 from ...utils import load_json_body, invalid_char_reg
 from .schedules import get_schedules
 from ...constants import ROSTER_DELETED, ROSTER_EDITED
 from ...utils import create_audit
+from .roster_visibility import invalidate_roster_visibility
+from .oncall_snapshot import invalidate_oncall
+from .search_index import invalidate_search_index
 
 
 def on_get(req, resp, team, roster):
@@ -62,7 +65,7 @@ def on_get(req, resp, team, roster):
     :statuscode 200: no error
     """
     team, roster = unquote(team), unquote(roster)
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
 
     cursor.execute('''SELECT `roster`.`id` AS `roster`, `team`.`id` AS `team` FROM `roster`
@@ -121,7 +124,7 @@ def on_put(req, resp, team, roster):
             description='missing roster name or order'
         )
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     try:
         if roster_order:
@@ -164,6 +167,8 @@ def on_put(req, resp, team, roster):
                 (name, team, roster))
             create_audit({'old_name': roster, 'new_name': name}, team, ROSTER_EDITED, req, cursor)
             connection.commit()
+            invalidate_roster_visibility(team=team)
+            invalidate_oncall()
     except db.IntegrityError as e:
         err_msg = str(e.args[1])
         if 'Duplicate entry' in err_msg:
@@ -185,7 +190,7 @@ def on_delete(req, resp, team, roster):
     """
     team, roster = unquote(team), unquote(roster)
     check_team_auth(team, req)
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
 
     cursor.execute('SELECT `user_id` FROM `roster_user` JOIN `roster` ON `roster_user`.`roster_id` = `roster`.`id` '
@@ -216,6 +221,10 @@ def on_delete(req, resp, team, roster):
         create_audit({'name': roster}, team, ROSTER_DELETED, req, cursor)
 
     connection.commit()
+    invalidate_search_index('team_users')
+    invalidate_permissions(team=team)
+    invalidate_roster_visibility(team=team)
+    invalidate_oncall()
     cursor.close()
     connection.close()
 
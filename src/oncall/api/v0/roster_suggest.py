@@ -10,7 +10,7 @@ def on_get(req, resp, team, roster, role):
     start = req.get_param_as_int('start', required=True)
     end = req.get_param_as_int('end', required=True)
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     try:
         cursor.execute('SELECT id FROM role WHERE name = %s', role)
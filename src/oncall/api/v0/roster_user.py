@@ -4,10 +4,12 @@
 from urllib.parse import unquote
 from falcon import HTTPNotFound, HTTPBadRequest, HTTP_200
 
-from ...auth import login_required, check_team_auth
+from ...auth import login_required, check_team_auth, invalidate_permissions
 from ...utils import load_json_body, unsubscribe_notifications, create_audit
 from ... import db
 from ...constants import ROSTER_USER_DELETED, ROSTER_USER_EDITED
+from .roster_visibility import invalidate_roster_visibility
+from .search_index import invalidate_search_index
 
 
 @login_required
@@ -35,7 +37,7 @@ def on_delete(req, resp, team, roster, user):
     """
     team, roster = unquote(team), unquote(roster)
     check_team_auth(team, req)
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     cursor.execute('''SELECT `id` FROM `roster`
                       WHERE `team_id` = (SELECT `id` FROM `team` WHERE name = %s)
@@ -72,6 +74,9 @@ def on_delete(req, resp, team, roster, user):
     if cursor.rowcount != 0:
         unsubscribe_notifications(team, user, cursor)
     connection.commit()
+    invalidate_search_index('team_users')
+    invalidate_permissions(user=user)
+    invalidate_roster_visibility(team=team)
     cursor.close()
     connection.close()
     resp.status = HTTP_200
@@ -115,7 +120,7 @@ def on_put(req, resp, team, roster, user):
             description='missing field "in_rotation"'
         )
     in_rotation = int(in_rotation)
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
 
     cursor.execute('''UPDATE `roster_user` SET `in_rotation`=%s
@@ -130,6 +135,7 @@ def on_put(req, resp, team, roster, user):
                  req,
                  cursor)
     connection.commit()
+    invalidate_roster_visibility(team=team)
     cursor.close()
     connection.close()
     resp.status = HTTP_200
@@ -6,11 +6,13 @@ from falcon import HTTPError, HTTP_201, HTTPBadRequest, HTTPNotFound
 from ujson import dumps as json_dumps
 import logging
 
-from ...auth import login_required, check_team_auth
+from ...auth import login_required, check_team_auth, invalidate_permissions
 from .users import get_user_data
 from ... import db
 from ...utils import load_json_body, subscribe_notifications, create_audit
 from ...constants import ROSTER_USER_ADDED
+from .roster_visibility import invalidate_roster_visibility
+from .search_index import invalidate_search_index
 
 logger = logging.getLogger('oncall.api.v0.roster_users')
 
@@ -36,7 +38,7 @@ def on_get(req, resp, team, roster):
         ["jdoe", "asmith"]
     """
     team, roster = unquote(team), unquote(roster)
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     query = '''SELECT `user`.`name` FROM `user`
                JOIN `roster_user` ON `roster_user`.`user_id`=`user`.`id`
@@ -112,7 +114,7 @@ def on_post(req, resp, team, roster):
         )
     check_team_auth(team, req)
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     cursor.execute('''(SELECT `id` FROM `team` WHERE `name`=%s)
                       UNION ALL
@@ -163,6 +165,9 @@ def on_post(req, resp, team, roster):
         create_audit({'roster': roster, 'user': user_name, 'request_body': data}, team,
                      ROSTER_USER_ADDED, req, cursor)
         connection.commit()
+        invalidate_search_index('team_users')
+        invalidate_permissions(user=user_name)
+        invalidate_roster_visibility(team=team)
     except db.IntegrityError as err:
         logger.error('Failed to add user to roaster: %s', repr(err))
 
@@ -175,5 +180,9 @@ def on_post(req, resp, team, roster):
         cursor.close()
         connection.close()
 
+    connection = db.connect(req)
+    cursor = connection.cursor(db.DictCursor)
     resp.status = HTTP_201
-    resp.text = json_dumps(get_user_data(None, {'name': user_name})[0])
+    resp.text = json_dumps(get_user_data(None, {'name': user_name}, dbinfo=(connection, cursor))[0])
+    cursor.close()
+    connection.close()
@@ -0,0 +1,122 @@
+# Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
+# See LICENSE in the project root for license information.
+
+'''
+Decides which roster members of a team a viewer may see.
+
+The rules (previously one correlated SQL query per call) are:
+
+* gods and team admins see every roster member;
+* anonymous viewers (no matching user) see members currently on call with a role whose display order is <= 1;
+* viewers on a roster of the team, holding schedule roles with display orders D, see members who have ever
+  held a role with display order <= max(D), or who are currently on call with a display order of d + 1
+  for some d in D;
+* everybody else sees nobody.
+
+Everything except the event-dependent parts is kept in a per-team snapshot, which the write handlers
+drop through invalidate_roster_visibility() after changing rosters, schedules, admins or names.
+'''
+
+from ...cache import TTLCache
+
+snapshot_cache = TTLCache('roster_visibility', max_size=1024, ttl=30)
+
+
+def load_team_snapshot(cursor, team_id):
+    cursor.execute('SELECT `name` FROM `team` WHERE `id` = %s', team_id)
+    row = cursor.fetchone()
+    snapshot = {
+        'team': row['name'] if row else None,
+        'rosters': [],
+        'members': [],
+        'admins': set(),
+        'schedule_orders': {},
+    }
+
+    cursor.execute('SELECT `id`, `name` FROM `roster` WHERE `team_id` = %s ORDER BY `id`', team_id)
+    snapshot['rosters'] = [(row['id'], row['name']) for row in cursor]
+
+    cursor.execute('''SELECT `roster_user`.`roster_id`, `user`.`id`, `user`.`name`, `roster_user`.`in_rotation`
+                      FROM `roster_user`
+                      JOIN `roster` ON `roster_user`.`roster_id` = `roster`.`id`
+                      JOIN `user` ON `roster_user`.`user_id` = `user`.`id`
+                      WHERE `roster`.`team_id` = %s
+                      ORDER BY `user`.`name`''', team_id)
+    snapshot['members'] = [(row['roster_id'], row['id'], row['name'], bool(row['in_rotation']))
+                           for row in cursor]
+
+    cursor.execute('SELECT `user_id` FROM `team_admin` WHERE `team_id` = %s', team_id)
+    snapshot['admins'] = {row['user_id'] for row in cursor}
+
+    # display orders of the schedule roles held by each roster member of the team
+    cursor.execute('''SELECT `roster_user`.`user_id`, `role`.`display_order`
+                      FROM `schedule`
+                      JOIN `roster_user` ON `roster_user`.`roster_id` = `schedule`.`roster_id`
+                      JOIN `role` ON `role`.`id` = `schedule`.`role_id`
+                      WHERE `schedule`.`team_id` = %s''', team_id)
+    for row in cursor:
+        snapshot['schedule_orders'].setdefault(row['user_id'], set()).add(row['display_order'])
+    return snapshot
+
+
+def get_team_snapshot(cursor, team_id):
+    snapshot = snapshot_cache.get(team_id)
+    if snapshot is None:
+        snapshot = load_team_snapshot(cursor, team_id)
+        snapshot_cache.set(team_id, snapshot)
+    return snapshot
+
+
+def invalidate_roster_visibility(team=None):
+    '''
+    Drop the snapshot of the named team, or every snapshot if no team is given.
+    '''
+    if team is None:
+        snapshot_cache.clear()
+    else:
+        snapshot_cache.invalidate_where(lambda key, value: value['team'] == team)
+
+
+def get_current_display_orders(cursor, user_ids):
+    cursor.execute('''SELECT `event`.`user_id`, `role`.`display_order`
+                      FROM `event` JOIN `role` ON `role`.`id` = `event`.`role_id`
+                      WHERE `event`.`user_id` IN %s
+                      AND `event`.`start` <= UNIX_TIMESTAMP() AND `event`.`end` >= UNIX_TIMESTAMP()''',
+                   (tuple(user_ids),))
+    orders = {}
+    for row in cursor:
+        orders.setdefault(row['user_id'], set()).add(row['display_order'])
+    return orders
+
+
+def get_visible_user_ids(cursor, snapshot, viewer):
+    '''
+    :param viewer: dict with the viewer's ``id`` and ``god`` flag, or None for anonymous viewers
+    :return: set of ids of the team's roster members the viewer may see
+    '''
+    member_ids = {member[1] for member in snapshot['members']}
+    if not member_ids:
+        return set()
+    if viewer is not None and (viewer['god'] or viewer['id'] in snapshot['admins']):
+        return member_ids
+
+    if viewer is None:
+        current = get_current_display_orders(cursor, member_ids)
+        return {user_id for user_id, orders in current.items() if min(orders) <= 1}
+
+    viewer_orders = snapshot['schedule_orders'].get(viewer['id'])
+    if not viewer_orders:
+        return set()
+    current = get_current_display_orders(cursor, member_ids)
+    visible = {user_id for user_id, orders in current.items()
+               if any(order + 1 in orders for order in viewer_orders)}
+
+    remaining = member_ids - visible
+    if remaining:
+        cursor.execute('''SELECT `user`.`id` FROM `user`
+                          WHERE `user`.`id` IN %s
+                          AND EXISTS (SELECT 1 FROM `event` JOIN `role` ON `role`.`id` = `event`.`role_id`
+                                      WHERE `event`.`user_id` = `user`.`id` AND `role`.`display_order` <= %s)''',
+                       (tuple(remaining), max(viewer_orders)))
+        visible.update(row['id'] for row in cursor)
+    return visible
@@ -10,6 +10,7 @@ from ...constants import ROSTER_CREATED
 from ...auth import login_required, check_team_auth
 from ... import db
 from .schedules import get_schedules
+from .roster_visibility import get_team_snapshot, get_visible_user_ids, invalidate_roster_visibility
 
 logger = logging.getLogger('oncall.api.v0.rosters')
 
@@ -25,109 +26,35 @@ constraints = {
 
 
 def get_roster_by_team_id(cursor, team_id, user=None, params=None):
+    snapshot = get_team_snapshot(cursor, team_id)
+
     # get all rosters for a team
-    query = 'SELECT `id`, `name` from `roster`'
-    where_params = []
-    where_vals = []
-    if params:
+    if params and any(key in constraints for key in params):
+        where_params = ['`roster`.`team_id`= %s']
+        where_vals = [team_id]
         for key, val in params.items():
             if key in constraints:
                 where_params.append(constraints[key])
                 where_vals.append(val)
-    where_params.append('`roster`.`team_id`= %s')
-    where_vals.append(team_id)
-    where_clause = ' WHERE %s' % ' AND '.join(where_params)
-
-    cursor.execute(query + where_clause, where_vals)
-    rosters = dict((row['name'], {'users': [], 'schedules': [], 'id': row['id']})
-                   for row in cursor)
+        cursor.execute('SELECT `id`, `name` from `roster` WHERE %s ORDER BY `id`' % ' AND '.join(where_params),
+                       where_vals)
+        roster_rows = [(row['id'], row['name']) for row in cursor]
+    else:
+        roster_rows = snapshot['rosters']
+    rosters = dict((name, {'users': [], 'schedules': [], 'id': roster_id}) for roster_id, name in roster_rows)
+    roster_names = dict(roster_rows)
 
     # get user id from user name
-    query = 'SELECT `id` FROM `user` WHERE `name`=%s'
-    cursor.execute(query, user or 'undefined')
-
-    user_id = -1
-
-    if cursor.rowcount > 0:
-        user_id = cursor.fetchone()['id']
-    
-    # get users for each roster
-    query = '''SELECT `roster`.`name` AS `roster`,
-                      `user`.`name` AS `user`,
-                      `roster_user`.`in_rotation` AS `in_rotation`
-               FROM `roster_user`
-               JOIN `roster` ON `roster_user`.`roster_id`=`roster`.`id`
-               JOIN `user` ON `roster_user`.`user_id`=`user`.`id`
-               LEFT JOIN `event` ON `event`.`user_id`=`user`.`id`
-               LEFT JOIN `role` ON `event`.`role_id`=`role`.`id`'''
-
-    where_params.append(
-        '''(
-            # IF SUPER USER
-            (
-                SELECT ux.id
-                FROM user ux
-                LEFT JOIN team_admin tax ON tax.user_id = ux.id
-                WHERE ux.id = @UserId
-                AND (
-                    ux.god = 1
-                    OR
-                    tax.team_id = @TeamId
-                )
-                LIMIT 1
-            ) IS NOT NULL
-            OR
-            # IF ANONYMOUS
-            (
-                (
-                    SELECT id
-                    FROM user
-                    WHERE id = @UserId
-                ) IS NULL
-                AND role.display_order <= 1
-                AND UNIX_TIMESTAMP() BETWEEN event.start AND event.end
-            )
-            OR
-            # IF LOGGED IN AND IN TEAM
-            (
-                (
-                    SELECT True
-                    FROM role role_y
-                    JOIN schedule sy ON sy.role_id = role_y.id
-                    JOIN roster_user ruy ON ruy.roster_id = sy.roster_id
-                    WHERE ruy.user_id = @UserId
-                    AND sy.team_id = @TeamId
-                    AND (
-                        role_y.display_order >= role.display_order
-                        OR
-                        (
-                            SELECT True
-                            FROM event ey
-                            JOIN role r ON ey.role_id = r.id
-                            WHERE UNIX_TIMESTAMP() BETWEEN ey.start AND ey.end
-                            AND ey.user_id = user.id
-                            AND role_y.display_order + 1 = r.display_order
-                            LIMIT 1
-                        )
-                    )
-                    LIMIT 1
-                ) IS NOT NULL
-            )
-        )'''
-        .replace('@UserId', str(user_id))
-        .replace('@TeamId', str(team_id))
-    )
-    where_clause = ' WHERE %s' % ' AND '.join(where_params)
-
-    query += where_clause
-    query += ' GROUP BY `roster`.`name`, `user`.`name`'
-    
-    cursor.execute(query, where_vals)
-    for row in cursor:
-        rosters[row['roster']]['users'].append(
-            {'name': row['user'], 'in_rotation': bool(row['in_rotation'])})
+    cursor.execute('SELECT `id`, `god` FROM `user` WHERE `name`=%s', user or 'undefined')
+    viewer = cursor.fetchone()
+
+    # get users for each roster, restricted to those the viewer is allowed to see
+    visible = get_visible_user_ids(cursor, snapshot, viewer)
+    for roster_id, user_id, user_name, in_rotation in snapshot['members']:
+        if roster_id in roster_names and user_id in visible:
+            rosters[roster_names[roster_id]]['users'].append({'name': user_name, 'in_rotation': in_rotation})
     # get all schedules for a team
-    data = get_schedules({'team_id': team_id})
+    data = get_schedules({'team_id': team_id}, dbinfo=(cursor.connection, cursor))
     for schedule in data:
         if schedule['roster'] in rosters:
             rosters[schedule['roster']]['schedules'].append(schedule)
@@ -196,7 +123,7 @@ def on_get(req, resp, team):
 
     """
     team = unquote(team)
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
 
     cursor.execute('SELECT `id` FROM `team` WHERE `name`=%s', team)
@@ -264,7 +191,7 @@ def on_post(req, resp, team):
 
     check_team_auth(team, req)
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     try:
         cursor.execute('''INSERT INTO `roster` (`name`, `team_id`)
@@ -278,6 +205,7 @@ def on_post(req, resp, team):
         )
     create_audit({'roster_id': cursor.lastrowid, 'request_body': data}, team, ROSTER_CREATED, req, cursor)
     connection.commit()
+    invalidate_roster_visibility(team=team)
     cursor.close()
     connection.close()
 
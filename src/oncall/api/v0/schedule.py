@@ -9,6 +9,8 @@ from ... import db
 from ...utils import load_json_body
 from json import dumps as json_dumps
 from .schedules import validate_simple_schedule, get_schedules
+from .roster_visibility import invalidate_roster_visibility
+from .oncall_snapshot import invalidate_oncall
 
 columns = {
     'role': '`role_id`=(SELECT `id` FROM `role` WHERE `name`=%(role)s)',
@@ -29,12 +31,14 @@ def verify_auth(req, schedule_id, connection, cursor):
         cursor.close()
         connection.close()
         raise HTTPNotFound()
+    team = cursor.fetchone()[0]
     try:
-        check_team_auth(cursor.fetchone()[0], req)
+        check_team_auth(team, req)
     except HTTPForbidden:
         cursor.close()
         connection.close()
         raise
+    return team
 
 
 def on_get(req, resp, schedule_id):
@@ -76,7 +80,12 @@ def on_get(req, resp, schedule_id):
             }
     """
 
-    resp.text = json_dumps(get_schedules({'id': schedule_id}, fields=req.get_param_as_list('fields'))[0])
+    connection = db.connect(req)
+    cursor = connection.cursor(db.DictCursor)
+    resp.text = json_dumps(get_schedules({'id': schedule_id}, dbinfo=(connection, cursor),
+                                         fields=req.get_param_as_list('fields'))[0])
+    cursor.close()
+    connection.close()
 
 
 @login_required
@@ -126,9 +135,9 @@ def on_put(req, resp, schedule_id):
     cols = ', '.join(columns[col] for col in data)
 
     update = 'UPDATE `schedule` SET ' + cols + ' WHERE `id`=%d' % int(schedule_id)
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
-    verify_auth(req, schedule_id, connection, cursor)
+    team = verify_auth(req, schedule_id, connection, cursor)
 
     # Validate simple schedule events
     if events:
@@ -162,6 +171,10 @@ def on_put(req, resp, schedule_id):
                               VALUES (%s, (SELECT `id` FROM `user` WHERE `name` = %s), %s)''',
                            params)
     connection.commit()
+    invalidate_roster_visibility(team=team)
+    if 'team' in data:
+        invalidate_roster_visibility(team=data['team'])
+    invalidate_oncall()
     cursor.close()
     connection.close()
 
@@ -180,12 +193,14 @@ def on_delete(req, resp, schedule_id):
     :statuscode 200: Successful delete
     :statuscode 404: Schedule not found
     """
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
-    verify_auth(req, schedule_id, connection, cursor)
+    team = verify_auth(req, schedule_id, connection, cursor)
     cursor.execute('DELETE FROM `schedule` WHERE `id`=%s', int(schedule_id))
     deleted = cursor.rowcount
     connection.commit()
+    invalidate_roster_visibility(team=team)
+    invalidate_oncall()
     cursor.close()
     connection.close()
 
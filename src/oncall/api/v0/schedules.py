@@ -8,6 +8,7 @@ from ujson import dumps as json_dumps
 from ...utils import load_json_body
 from ...auth import login_required, check_team_auth
 from ... import db
+from .roster_visibility import invalidate_roster_visibility
 
 HOUR = 60 * 60
 WEEK = 24 * HOUR * 7
@@ -267,7 +268,11 @@ def on_get(req, resp, team, roster):
     params = req.params
     params['team'] = team
     params['roster'] = roster
-    data = get_schedules(params, fields=fields)
+    connection = db.connect(req)
+    cursor = connection.cursor(db.DictCursor)
+    data = get_schedules(params, fields=fields, dbinfo=(connection, cursor))
+    cursor.close()
+    connection.close()
 
     resp.text = json_dumps(data)
 
@@ -430,7 +435,7 @@ def on_post(req, resp, team, roster):
                                  %(auto_populate_threshold)s,
                                  %(advanced_mode)s,
                                  (SELECT `id` FROM `scheduler` WHERE `name` = %(scheduler_name)s))'''
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
     try:
         scheduler_arg = data.pop('scheduler', None)
@@ -462,6 +467,7 @@ def on_post(req, resp, team, roster):
         )
     else:
         connection.commit()
+        invalidate_roster_visibility(team=team)
     finally:
         cursor.close()
         connection.close()
@@ -3,6 +3,7 @@
 
 from ... import db
 from ujson import dumps
+from . import search_index
 
 
 def on_get(req, resp):
@@ -75,46 +76,57 @@ def on_get(req, resp):
     if not fields:
         fields = ['teams', 'services', 'users']
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
 
     data = {}
     if 'teams' in fields:
-        query = 'SELECT `name` FROM `team` WHERE `team`.`name` LIKE CONCAT("%%", %s, "%%") ' \
-                'AND `active` = TRUE'
-        cursor.execute(query, keyword)
-        data['teams'] = [r[0] for r in cursor]
+        teams = search_index.search_teams(keyword)
+        if teams is None:
+            query = 'SELECT `name` FROM `team` WHERE `team`.`name` LIKE CONCAT("%%", %s, "%%") ' \
+                    'AND `active` = TRUE'
+            cursor.execute(query, keyword)
+            teams = [r[0] for r in cursor]
+        data['teams'] = teams
 
     if 'services' in fields:
-        query = '''SELECT `service`.`name` as `service`, `team`.`name` as `team` FROM `service`
-                JOIN `team_service` ON `service`.`id` = `team_service`.`service_id`
-                JOIN `team` ON `team`.`id` = `team_service`.`team_id`
-                WHERE `service`.`name` LIKE CONCAT("%%", %s, "%%") AND `team`.`active` = TRUE'''
-        cursor.execute(query, keyword)
-        services = {}
-        for row in cursor:
-            serv, team = row
-            if serv in services:
-                services[serv].append(team)
-            else:
-                services[serv] = [team]
+        services = search_index.search_services(keyword)
+        if services is None:
+            query = '''SELECT `service`.`name` as `service`, `team`.`name` as `team` FROM `service`
+                    JOIN `team_service` ON `service`.`id` = `team_service`.`service_id`
+                    JOIN `team` ON `team`.`id` = `team_service`.`team_id`
+                    WHERE `service`.`name` LIKE CONCAT("%%", %s, "%%") AND `team`.`active` = TRUE'''
+            cursor.execute(query, keyword)
+            services = {}
+            for row in cursor:
+                serv, team = row
+                if serv in services:
+                    services[serv].append(team)
+                else:
+                    services[serv] = [team]
         data['services'] = services
 
     if 'users' in fields:
-        query = '''SELECT  `full_name`, `name` FROM `user`
-                   WHERE `active` = TRUE AND (`name` LIKE CONCAT(%s, "%%") OR `full_name` LIKE CONCAT(%s, "%%"))'''
-        cursor.execute(query, (keyword, keyword))
-        data['users'] = [{'full_name': r[0], 'name': r[1]} for r in cursor]
+        users = search_index.search_users(keyword)
+        if users is None:
+            query = '''SELECT  `full_name`, `name` FROM `user`
+                       WHERE `active` = TRUE AND (`name` LIKE CONCAT(%s, "%%") OR `full_name` LIKE CONCAT(%s, "%%"))'''
+            cursor.execute(query, (keyword, keyword))
+            users = [{'full_name': r[0], 'name': r[1]} for r in cursor]
+        data['users'] = users
 
     if 'team_users' in fields:
-        filter = '%s%%' % keyword
         team = req.get_param('team', required=True)
-        query = '''SELECT `user`.`full_name`, `user`.`name`
-                   FROM `team_user` JOIN `user` ON `team_user`.`user_id` = `user`.`id`
-                   WHERE `team_user`.`team_id` = (SELECT `id` FROM `team` WHERE `name` = %s)
-                   AND (`name` LIKE %s OR `full_name` LIKE %s)'''
-        cursor.execute(query, (team, filter, filter))
-        data['users'] = [{'full_name': r[0], 'name': r[1]} for r in cursor]
+        users = search_index.search_team_users(team, keyword)
+        if users is None:
+            filter = '%s%%' % keyword
+            query = '''SELECT `user`.`full_name`, `user`.`name`
+                       FROM `team_user` JOIN `user` ON `team_user`.`user_id` = `user`.`id`
+                       WHERE `team_user`.`team_id` = (SELECT `id` FROM `team` WHERE `name` = %s)
+                       AND (`name` LIKE %s OR `full_name` LIKE %s)'''
+            cursor.execute(query, (team, filter, filter))
+            users = [{'full_name': r[0], 'name': r[1]} for r in cursor]
+        data['users'] = users
 
     cursor.close()
     connection.close()
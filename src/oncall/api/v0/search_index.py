@@ -0,0 +1,263 @@
+# Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
+# See LICENSE in the project root for license information.
+
+'''
+In-process trigram index answering /api/v0/search without LIKE scans.
+
+The index has four sections, loaded from the database at startup: active teams, services of active
+teams, users, and team memberships. After that, sections are only ever loaded by a refresher thread,
+never while serving a search. It reloads all of them every refresh_interval seconds, to pick up changes
+made through other processes (e.g. other API workers or user sync), and the stale ones as soon as the
+write handlers mark them through invalidate_search_index(). Searches fall back to SQL while a section
+they need is stale, has not been loaded, or has not been refreshed for two refresh intervals.
+
+Under a preforking server (uWSGI without lazy-apps) init() runs in the master, and its threads do not
+survive the fork. Each process therefore starts its own refresher the first time it uses the index.
+'''
+
+import logging
+import os
+import time
+from threading import Event, Lock, Thread
+
+from ... import db
+
+logger = logging.getLogger('oncall.api.v0.search_index')
+
+enabled = True
+refresh_interval = 30
+
+sections = {}
+loaded_at = {}
+stale = {'teams', 'services', 'users', 'team_users'}
+# set to wake the refresher up early, when sections are marked stale
+wakeup = Event()
+# pid of the process whose refresher thread is running
+refresher_pid = None
+refresher_lock = Lock()
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex(object):
+    '''
+    Case-insensitive substring and prefix search over entries, each searchable by one or more strings.
+    Results are ranked exact match first, then prefix matches, then other substring matches, with
+    shorter and then alphabetically lower strings first within each group.
+    '''
+
+    def __init__(self, entries, keys):
+        '''
+        :param keys: callable returning the searchable strings of an entry
+        '''
+        self.entries = entries
+        self.keys = [tuple(key.lower() for key in keys(entry) if key) for entry in entries]
+        self.postings = {}
+        for i, entry_keys in enumerate(self.keys):
+            for gram in set().union(*(trigrams(key) for key in entry_keys)):
+                self.postings.setdefault(gram, []).append(i)
+
+    def candidates(self, keyword):
+        if len(keyword) < 3:
+            return range(len(self.entries))
+        postings = sorted((self.postings.get(gram, ()) for gram in trigrams(keyword)), key=len)
+        found = set(postings[0])
+        for ids in postings[1:]:
+            if not found:
+                break
+            found.intersection_update(ids)
+        return found
+
+    def search(self, keyword, prefix=False, within=None):
+        '''
+        :param prefix: match only at the start of the searchable strings
+        :param within: optional set of entry positions to limit the search to
+        :return: matching entries, ranked
+        '''
+        keyword = keyword.lower()
+        ids = within if within is not None else self.candidates(keyword)
+        ranked = []
+        for i in ids:
+            best = None
+            for key in self.keys[i]:
+                if key == keyword:
+                    rank = (0, len(key), key)
+                elif key.startswith(keyword):
+                    rank = (1, len(key), key)
+                elif not prefix and keyword in key:
+                    rank = (2, len(key), key)
+                else:
+                    continue
+                if best is None or rank < best:
+                    best = rank
+            if best is not None:
+                ranked.append((best, i))
+        ranked.sort()
+        return [self.entries[i] for _, i in ranked]
+
+
+def load_teams(cursor):
+    cursor.execute('SELECT `name` FROM `team` WHERE `active` = TRUE')
+    return TrigramIndex([row[0] for row in cursor], lambda name: (name,))
+
+
+def load_services(cursor):
+    cursor.execute('''SELECT `service`.`name`, `team`.`name` FROM `service`
+                      JOIN `team_service` ON `service`.`id` = `team_service`.`service_id`
+                      JOIN `team` ON `team`.`id` = `team_service`.`team_id`
+                      WHERE `team`.`active` = TRUE''')
+    service_teams = {}
+    for service, team in cursor:
+        service_teams.setdefault(service, []).append(team)
+    index = TrigramIndex(list(service_teams), lambda name: (name,))
+    index.service_teams = service_teams
+    return index
+
+
+def load_users(cursor):
+    cursor.execute('SELECT `id`, `name`, `full_name`, `active` FROM `user`')
+    users = [{'id': row[0], 'name': row[1], 'full_name': row[2], 'active': bool(row[3])} for row in cursor]
+    index = TrigramIndex(users, lambda user: (user['name'], user['full_name']))
+    index.positions = {user['id']: i for i, user in enumerate(users)}
+    return index
+
+
+def load_team_users(cursor):
+    cursor.execute('''SELECT `team`.`name`, `team_user`.`user_id`
+                      FROM `team_user` JOIN `team` ON `team`.`id` = `team_user`.`team_id`''')
+    team_users = {}
+    for team, user_id in cursor:
+        team_users.setdefault(team, set()).add(user_id)
+    return team_users
+
+
+loaders = {
+    'teams': load_teams,
+    'services': load_services,
+    'users': load_users,
+    'team_users': load_team_users,
+}
+
+
+def get_section(name):
+    '''
+    :return: the named section of the index, or None if search should fall back to SQL
+    '''
+    if not enabled:
+        return None
+    start_refresher()
+    if name in stale:
+        return None
+    # the refresher is stuck or failing to load the section
+    if time.time() - loaded_at.get(name, 0) > 2 * refresh_interval:
+        return None
+    return sections.get(name)
+
+
+def invalidate_search_index(*names):
+    '''
+    Mark the named sections (teams, services, users, team_users) stale, or all of them if none are given.
+    '''
+    stale.update(names or loaders)
+    if enabled:
+        start_refresher()
+        wakeup.set()
+
+
+def refresh(names=None):
+    '''
+    Reload the named sections, by default those that are stale or were loaded refresh_interval seconds ago.
+    '''
+    if names is None:
+        now = time.time()
+        names = [name for name in loaders if name in stale or now - loaded_at.get(name, 0) >= refresh_interval]
+    if not names:
+        return
+    connection = db.connect()
+    cursor = connection.cursor()
+    try:
+        for name in names:
+            # cleared before loading, so that writes committed meanwhile mark it stale again
+            stale.discard(name)
+            try:
+                sections[name] = loaders[name](cursor)
+                loaded_at[name] = time.time()
+            except Exception:
+                logger.exception('Failed to load search index section %s', name)
+                stale.add(name)
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def refresher():
+    while True:
+        try:
+            refresh()
+        except Exception:
+            logger.exception('Failed to refresh search index')
+        wakeup.wait(refresh_interval)
+        wakeup.clear()
+
+
+def start_refresher():
+    '''
+    Start the refresher thread of this process, unless it is running already.
+    '''
+    global refresher_pid
+    pid = os.getpid()
+    if refresher_pid == pid:
+        return
+    with refresher_lock:
+        if refresher_pid == pid:
+            return
+        refresher_pid = pid
+    Thread(target=refresher, name='search-index-refresher', daemon=True).start()
+
+
+def search_teams(keyword):
+    index = get_section('teams')
+    return None if index is None else index.search(keyword)
+
+
+def search_services(keyword):
+    index = get_section('services')
+    if index is None:
+        return None
+    return {service: index.service_teams[service] for service in index.search(keyword)}
+
+
+def search_users(keyword):
+    index = get_section('users')
+    if index is None:
+        return None
+    return [{'full_name': user['full_name'], 'name': user['name']}
+            for user in index.search(keyword, prefix=True) if user['active']]
+
+
+def search_team_users(team, keyword):
+    users = get_section('users')
+    team_users = get_section('team_users')
+    if users is None or team_users is None:
+        return None
+    within = {users.positions[user_id] for user_id in team_users.get(team, ()) if user_id in users.positions}
+    return [{'full_name': user['full_name'], 'name': user['name']}
+            for user in users.search(keyword, prefix=True, within=within)]
+
+
+def init(config):
+    global enabled, refresh_interval
+    enabled = config.get('enabled', True)
+    refresh_interval = config.get('refresh_interval', refresh_interval)
+    if not enabled:
+        return
+    # sections that fail to load here are retried by the refresher
+    try:
+        refresh(list(loaders))
+    except Exception:
+        logger.exception('Failed to build search index')
+    # this may be a master about to fork its workers: don't let them share the connection used here
+    if db.engine is not None:
+        db.engine.dispose()
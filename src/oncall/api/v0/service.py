@@ -6,7 +6,9 @@ from ujson import dumps
 from ...utils import load_json_body
 
 from ... import db
+from .oncall_snapshot import invalidate_service_teams
 from ...auth import debug_only
+from .search_index import invalidate_search_index
 
 
 def on_get(req, resp, service):
@@ -34,7 +36,7 @@ def on_get(req, resp, service):
         }
 
     """
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
     cursor.execute('SELECT `id`, `name` FROM `service` WHERE `name`=%s', service)
     results = cursor.fetchall()
@@ -52,11 +54,13 @@ def on_put(req, resp, service):
     Change name for a service. Currently unused/debug only.
     """
     data = load_json_body(req)
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     cursor.execute('UPDATE `service` SET `name`=%s WHERE `name`=%s',
                    (data['name'], service))
     connection.commit()
+    invalidate_search_index('services')
+    invalidate_service_teams(service)
     cursor.close()
     connection.close()
 
@@ -66,13 +70,15 @@ def on_delete(req, resp, service):
     """
     Delete a service. Currently unused/debug only.
     """
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
 
     # FIXME: also delete team service mappings?
     cursor.execute('DELETE FROM `service` WHERE `name`=%s', service)
     deleted = cursor.rowcount
     connection.commit()
+    invalidate_search_index('services')
+    invalidate_service_teams(service)
     cursor.close()
     connection.close()
 
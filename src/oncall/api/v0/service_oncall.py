@@ -3,6 +3,7 @@
 
 from ujson import dumps as json_dumps
 from ... import db
+from .oncall_snapshot import get_snapshot, get_current, get_service_teams, oncall_rows
 
 
 def on_get(req, resp, service, role=None):
@@ -40,67 +41,17 @@ def on_get(req, resp, service, role=None):
         ]
 
     '''
-    get_oncall_query = '''
-        SELECT `user`.`full_name` AS `full_name`,
-               `event`.`start`, `event`.`end`,
-               `contact_mode`.`name` AS `mode`,
-               `user_contact`.`destination`,
-               `user`.`name` AS `user`,
-               `team`.`name` AS `team`,
-               `role`.`name` AS `role`
-        FROM `event`
-        JOIN `user` ON `event`.`user_id` = `user`.`id`
-        JOIN `team` ON `event`.`team_id` = `team`.`id`
-        JOIN `role` ON `role`.`id` = `event`.`role_id`
-        LEFT JOIN `team_subscription` ON `subscription_id` = `team`.`id`
-            AND `team_subscription`.`role_id` = `role`.`id`
-        LEFT JOIN `user_contact` ON `user`.`id` = `user_contact`.`user_id`
-        LEFT JOIN `contact_mode` ON `contact_mode`.`id` = `user_contact`.`mode_id`
-        WHERE UNIX_TIMESTAMP() BETWEEN `event`.`start` AND `event`.`end`
-            AND (`team`.`id` IN %s OR `team_subscription`.`team_id` IN %s)'''
-
-    query_params = []
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
-    # Get subscription teams for teams owning the service, along with the teams that own the service
-    cursor.execute('''SELECT `team_id`, `team`.`override_phone_number`, `team`.`name` FROM `team_service`
-                      JOIN `service` ON `service`.`id` = `team_service`.`service_id`
-                      JOIN `team` ON `team`.`id` = `team_service`.`team_id`
-                      WHERE `service`.`name` = %s''',
-                   service)
-    data = cursor.fetchall()
-    team_ids = [row['team_id'] for row in data]
-    team_override_numbers = {row['name']: row['override_phone_number'] for row in data}
-    if not team_ids:
-        resp.text = json_dumps([])
-        cursor.close()
-        connection.close()
-        return
-    query_params += [team_ids, team_ids]
-    if role is not None:
-        get_oncall_query += ' AND `role`.`name` = %s'
-        query_params.append(role)
-    cursor.execute(get_oncall_query, query_params)
-    data = cursor.fetchall()
-    ret = {}
-    for row in data:
-        user = row['user']
-        # add data row into accumulator only if not already there
-        if user not in ret:
-            ret[user] = row
-            ret[user]['contacts'] = {}
-        mode = row.pop('mode')
-        if not mode:
-            continue
-        dest = row.pop('destination')
-        ret[user]['contacts'][mode] = dest
-    data = list(ret.values())
-    for event in data:
-        override_number = team_override_numbers.get(event['team'])
-        if override_number and event['role'] == 'primary':
-            event['contacts']['call'] = override_number
-            event['contacts']['sms'] = override_number
-
+    # Current events of the teams owning the service, along with those of the teams they subscribe to
+    teams = get_service_teams(cursor, service)
+    events = []
+    for team, _ in teams:
+        snapshot = get_snapshot(cursor, team)
+        if snapshot is not None:
+            events += get_current(snapshot, role)
     cursor.close()
     connection.close()
+    team_override_numbers = dict(teams)
+    data = oncall_rows(events, lambda event: team_override_numbers.get(event['team']))
     resp.text = json_dumps(data)
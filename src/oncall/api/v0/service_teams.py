@@ -28,7 +28,7 @@ def on_get(req, resp, service):
             "team-foo"
         ]
     """
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     cursor.execute('''SELECT `team`.`name` FROM `service`
                       JOIN `team_service` ON `team_service`.`service_id`=`service`.`id`
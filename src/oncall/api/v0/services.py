@@ -73,7 +73,7 @@ def on_get(req, resp):
     if where_query:
         query = '%s WHERE %s' % (query, where_query)
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     cursor.execute(query, where_vals)
     data = [r[0] for r in cursor]
@@ -86,7 +86,7 @@ def on_get(req, resp):
 def on_post(req, resp):
     data = load_json_body(req)
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     try:
         cursor.execute('INSERT INTO `service` (`name`) VALUES (%(name)s)', data)
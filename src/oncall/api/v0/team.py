@@ -3,18 +3,20 @@
 import logging
 import uuid
 import time
-import sys
-import oncall.utils
 from urllib.parse import unquote
 from falcon import HTTPNotFound, HTTPBadRequest, HTTPError
 from ujson import dumps as json_dumps
 
-from ... import db, iris
+from ... import db, iris, settings
 from .users import get_user_data
 from .rosters import get_roster_by_team_id
-from ...auth import login_required, check_team_auth
+from ...auth import login_required, check_team_auth, invalidate_permissions
 from ...utils import load_json_body, invalid_char_reg, create_audit
 from ...constants import TEAM_DELETED, TEAM_EDITED, SUPPORTED_TIMEZONES
+from .roster_visibility import invalidate_roster_visibility
+from .ical import invalidate_ical
+from .oncall_snapshot import invalidate_oncall
+from .search_index import invalidate_search_index
 
 logger = logging.getLogger('oncall.api.v0.team')
 
@@ -28,8 +30,9 @@ def populate_team_users(cursor, team_dict, user=None):
                       JOIN `user` ON `team_user`.`user_id`=`user`.`id`
                       WHERE `team_id`=%s''',
                    team_dict['id'])
-    team_dict['users'] = dict((r['name'], get_user_data(None, {'name__eq': r['name']})[0])
-                              for r in cursor)
+    names = [r['name'] for r in cursor]
+    users = get_user_data(None, {}, dbinfo=(cursor.connection, cursor), names=names)
+    team_dict['users'] = {u['name']: u for u in users}
 
 
 def populate_team_admins(cursor, team_dict, user=None):
@@ -37,8 +40,7 @@ def populate_team_admins(cursor, team_dict, user=None):
         team_dict['admins'] = []
         return
 
-    config = oncall.utils.read_config(sys.argv[1])
-    minimum_display_order_to_see_admins = config.get('minimum_display_order_to_see_admins', 2)
+    minimum_display_order_to_see_admins = settings.get('minimum_display_order_to_see_admins', 2)
 
     cursor.execute('''SELECT `user`.`id`
                       FROM `user`
@@ -186,7 +188,7 @@ def on_get(req, resp, team):
     fields = req.get_param_as_list('fields')
     active = req.get_param('active', default=True)
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
     cursor.execute('''SELECT `id`, `name`, `email`, `slack_channel`, `slack_channel_notifications`,
                              `scheduling_timezone`, `iris_plan`, `iris_enabled`, `override_phone_number`, `api_managed_roster`, `description`
@@ -242,7 +244,7 @@ def on_put(req, resp, team):
     check_team_auth(team, req)
     data = load_json_body(req)
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
 
     data_cols = data.keys()
@@ -293,6 +295,13 @@ def on_put(req, resp, team):
         cursor.execute(update_query, query_params)
         create_audit({'request_body': data}, team, TEAM_EDITED, req, cursor)
         connection.commit()
+        invalidate_search_index('teams', 'services', 'team_users')
+        invalidate_permissions(team=team)
+        if 'name' in data:
+            invalidate_permissions(team=data['name'])
+        invalidate_roster_visibility(team=team)
+        invalidate_ical()
+        invalidate_oncall()
     except db.IntegrityError as e:
         err_msg = str(e.args[1])
         if 'Duplicate entry' in err_msg:
@@ -327,7 +336,7 @@ def on_delete(req, resp, team):
     new_team = str(uuid.uuid4())
     deletion_date = time.time()
     check_team_auth(team, req)
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     # Soft delete: set team inactive, delete future events for it
     cursor.execute('UPDATE `team` SET `active` = FALSE WHERE `name`=%s', team)
@@ -349,5 +358,10 @@ def on_delete(req, resp, team):
     cursor.execute('UPDATE `team` SET `name` = %s WHERE `name`= %s', (new_team, team))
     cursor.execute('INSERT INTO `deleted_team` (team_id, new_name, old_name, deletion_date) VALUES (%s, %s, %s, %s)', (team_id, new_team, team, deletion_date))
     connection.commit()
+    invalidate_search_index('teams', 'services', 'team_users')
+    invalidate_permissions(team=team)
+    invalidate_roster_visibility(team=team)
+    invalidate_ical()
+    invalidate_oncall()
     cursor.close()
     connection.close()
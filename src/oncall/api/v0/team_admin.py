@@ -3,10 +3,12 @@
 
 from falcon import HTTPNotFound
 
-from ...auth import login_required, check_team_auth
+from ...auth import login_required, check_team_auth, invalidate_permissions
 from ... import db
 from ...utils import unsubscribe_notifications, create_audit
 from ...constants import ADMIN_DELETED
+from .roster_visibility import invalidate_roster_visibility
+from .search_index import invalidate_search_index
 
 
 @login_required
@@ -24,7 +26,7 @@ def on_delete(req, resp, team, user):
     :statuscode 404: Team admin not found
     """
     check_team_auth(team, req)
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
 
     cursor.execute('''DELETE FROM `team_admin`
@@ -49,5 +51,8 @@ def on_delete(req, resp, team, user):
     if cursor.rowcount != 0:
         unsubscribe_notifications(team, user, cursor)
     connection.commit()
+    invalidate_search_index('team_users')
+    invalidate_permissions(user=user)
+    invalidate_roster_visibility(team=team)
     cursor.close()
     connection.close()
@@ -6,9 +6,11 @@ from falcon import HTTPError, HTTP_201, HTTPBadRequest
 from ujson import dumps as json_dumps
 from ... import db
 from .users import get_user_data
-from ...auth import login_required, check_team_auth
+from ...auth import login_required, check_team_auth, invalidate_permissions
 from ...utils import load_json_body, subscribe_notifications, create_audit
 from ...constants import ADMIN_CREATED
+from .roster_visibility import invalidate_roster_visibility
+from .search_index import invalidate_search_index
 
 
 def on_get(req, resp, team):
@@ -36,7 +38,7 @@ def on_get(req, resp, team):
         ]
     """
     team = unquote(team)
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     cursor.execute('''SELECT `user`.`name` FROM `user`
                       JOIN `team_admin` ON `team_admin`.`user_id`=`user`.`id`
@@ -100,7 +102,7 @@ def on_post(req, resp, team):
             title='name attribute missing from request'
         )
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
 
     cursor.execute('''(SELECT `id` FROM `team` WHERE `name`=%s)
@@ -125,6 +127,9 @@ def on_post(req, resp, team):
         subscribe_notifications(team, user_name, cursor)
         create_audit({'user': user_name}, team, ADMIN_CREATED, req, cursor)
         connection.commit()
+        invalidate_search_index('team_users')
+        invalidate_permissions(user=user_name)
+        invalidate_roster_visibility(team=team)
     except db.IntegrityError as e:
         err_msg = str(e.args[1])
         if err_msg == "Column 'team_id' cannot be null":
@@ -142,5 +147,9 @@ def on_post(req, resp, team):
         cursor.close()
         connection.close()
 
+    connection = db.connect(req)
+    cursor = connection.cursor(db.DictCursor)
     resp.status = HTTP_201
-    resp.text = json_dumps(get_user_data(None, {'name': user_name})[0])
+    resp.text = json_dumps(get_user_data(None, {'name': user_name}, dbinfo=(connection, cursor))[0])
+    cursor.close()
+    connection.close()
@@ -9,7 +9,7 @@ def on_get(req, resp, team):
     audit_query = '''SELECT `audit_log`.`description`, `audit_log`.`timestamp`,
                             `audit_log`.`owner_name`, `audit_log`.`action_name`
                      FROM `audit_log` WHERE `team_name` = %s'''
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
     cursor.execute(audit_query, team)
     data = cursor.fetchall()
@@ -4,13 +4,9 @@
 import time
 from . import ical
 from .roles import get_role_ids
-from ... import db
 
 
-def get_team_events(team, start, roles=None, include_subscribed=False):
-    connection = db.connect()
-    cursor = connection.cursor(db.DictCursor)
-
+def get_team_events_query(cursor, team, start, roles=None, include_subscribed=False):
     role_condition = ''
     role_ids = get_role_ids(cursor, roles)
     if role_ids:
@@ -39,7 +35,9 @@ def get_team_events(team, start, roles=None, include_subscribed=False):
             `user`.`name` AS user,
             `role`.`name` AS role,
             `event`.`start`,
-            `event`.`end`
+            `event`.`end`,
+            `event`.`team_id`,
+            `event`.`user_id`
         FROM `event`
             JOIN `team` ON `event`.`team_id` = `team`.`id`
             JOIN `user` ON `event`.`user_id` = `user`.`id`
@@ -47,13 +45,22 @@ def get_team_events(team, start, roles=None, include_subscribed=False):
         WHERE
             `event`.`end` > %s AND
         ''' + team_condition + role_condition
+    return query, (start, team)
 
-    cursor.execute(query, (start, team))
 
-    events = cursor.fetchall()
-    cursor.close()
-    connection.close()
-    return events
+def get_team_tags(cursor, team):
+    '''
+    Cache tags for a team feed: the team itself and the teams it subscribes to.
+    '''
+    cursor.execute('''SELECT `team`.`id`, `team_subscription`.`subscription_id`
+                      FROM `team` LEFT JOIN `team_subscription` ON `team_subscription`.`team_id` = `team`.`id`
+                      WHERE `team`.`name` = %s''', team)
+    tags = set()
+    for row in cursor:
+        tags.add(('team', row['id']))
+        if row['subscription_id'] is not None:
+            tags.add(('team', row['subscription_id']))
+    return tags
 
 
 def on_get(req, resp, team):
@@ -72,9 +79,8 @@ def on_get(req, resp, team):
         BEGIN:VCALENDAR
         ...
     """
-    start = req.get_param_as_int('start')
-    if start is None:
-        start = int(time.time())
+    start_param = req.get_param_as_int('start')
+    start = int(time.time()) if start_param is None else start_param
     contact = req.get_param_as_bool('contact')
     if contact is None:
         contact = True
@@ -83,6 +89,9 @@ def on_get(req, resp, team):
     if include_sub is None:
         include_sub = True
 
-    events = get_team_events(team, start, roles=roles, include_subscribed=include_sub)
-    resp.text = ical.events_to_ical(events, team, contact)
-    resp.set_header('Content-Type', 'text/calendar')
+    def prepare(cursor):
+        query, args = get_team_events_query(cursor, team, start, roles, include_sub)
+        return query, args, get_team_tags(cursor, team)
+
+    key = ('team', team, start_param, tuple(roles or ()), contact, include_sub)
+    ical.respond(req, resp, key, team, contact, prepare)
@@ -47,7 +47,7 @@ def on_post(req, resp, team):
         dynamic = True
     elif plan == CUSTOM or plan is None:
         # Default to team's custom plan for backwards compatibility
-        connection = db.connect()
+        connection = db.connect(req)
         cursor = connection.cursor()
         cursor.execute('SELECT iris_plan FROM team WHERE name = %s', team)
         if cursor.rowcount == 0:
@@ -8,6 +8,8 @@ from ujson import dumps as json_dumps
 
 from ...auth import login_required, check_team_auth
 from ... import db
+from .oncall_snapshot import invalidate_service_teams
+from .search_index import invalidate_search_index
 
 
 def on_get(req, resp):
@@ -38,7 +40,7 @@ def on_get(req, resp):
     query = '''SELECT `team`.`name` as team_name, `service`.`name` as service_name FROM `team_service`
                       JOIN `service` ON `team_service`.`service_id`=`service`.`id`
                       JOIN `team` ON `team_service`.`team_id`=`team`.`id`'''
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     cursor.execute(query)
     data = [{'team': r[0], 'service': r[1]} for r in cursor]
@@ -63,7 +65,7 @@ def on_delete(req, resp, team, service):
     """
     team = unquote(team)
     check_team_auth(team, req)
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
 
     cursor.execute('''DELETE FROM `team_service`
@@ -75,5 +77,7 @@ def on_delete(req, resp, team, service):
         raise HTTPNotFound()
 
     connection.commit()
+    invalidate_search_index('services')
+    invalidate_service_teams(service)
     cursor.close()
     connection.close()
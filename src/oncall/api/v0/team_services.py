@@ -8,6 +8,8 @@ from ...auth import login_required, check_team_auth
 from ...utils import load_json_body
 
 from ... import db
+from .oncall_snapshot import invalidate_service_teams
+from .search_index import invalidate_search_index
 
 
 def on_get(req, resp, team):
@@ -34,7 +36,7 @@ def on_get(req, resp, team):
         ]
     """
     team = unquote(team)
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     cursor.execute('''SELECT `service`.`name` FROM `service`
                       JOIN `team_service` ON `team_service`.`service_id`=`service`.`id`
@@ -81,7 +83,7 @@ def on_post(req, resp, team):
     data = load_json_body(req)
 
     service = data['name']
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     try:
         # TODO: allow many to many mapping for team/service?
@@ -104,6 +106,8 @@ def on_post(req, resp, team):
                           )''',
                        (team, service))
         connection.commit()
+        invalidate_search_index('services')
+        invalidate_service_teams(service)
     except db.IntegrityError as e:
         err_msg = str(e.args[1])
         if err_msg == 'Column \'service_id\' cannot be null':
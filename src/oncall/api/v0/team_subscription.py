@@ -4,12 +4,14 @@
 from ... import db
 from ...auth import login_required, check_team_auth
 from falcon import HTTPNotFound
+from .ical import invalidate_ical
+from .oncall_snapshot import invalidate_oncall
 
 
 @login_required
 def on_delete(req, resp, team, subscription, role):
     check_team_auth(team, req)
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
 
     cursor.execute('''DELETE FROM `team_subscription`
@@ -19,6 +21,8 @@ def on_delete(req, resp, team, subscription, role):
                    (team, subscription, role))
     deleted = cursor.rowcount
     connection.commit()
+    invalidate_ical()
+    invalidate_oncall()
     cursor.close()
     connection.close()
     if deleted == 0:
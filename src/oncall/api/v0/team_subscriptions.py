@@ -6,13 +6,15 @@ from ujson import dumps as json_dumps
 from falcon import HTTPError, HTTPBadRequest, HTTP_201
 from ...utils import load_json_body
 from ...auth import login_required, check_team_auth
+from .ical import invalidate_ical
+from .oncall_snapshot import invalidate_oncall
 import logging
 
 logger = logging.getLogger('oncall-api')
 
 
 def on_get(req, resp, team):
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
     cursor.execute('''SELECT `subscription`.`name` AS `subscription`, `role`.`name` AS `role` FROM `team`
                       JOIN `team_subscription` ON `team`.`id` = `team_subscription`.`team_id`
@@ -42,7 +44,7 @@ def on_post(req, resp, team):
             title='Invalid subscription',
             description='Subscription team must be different from subscribing team'
         )
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     try:
         cursor.execute('''INSERT INTO `team_subscription` (`team_id`, `subscription_id`, `role_id`) VALUES
@@ -69,6 +71,8 @@ def on_post(req, resp, team):
         )
     else:
         connection.commit()
+        invalidate_ical()
+        invalidate_oncall()
     finally:
         cursor.close()
         connection.close()
@@ -7,9 +7,15 @@ from ujson import dumps
 from collections import defaultdict
 from falcon import HTTPNotFound
 from .rosters import get_roster_by_team_id
+from .oncall_snapshot import get_snapshot, get_current
 
 logger = logging.getLogger('oncall.api.v0.team_summary')
 
+current_fields = ('full_name', 'photo_url', 'start', 'end', 'user_id', 'user', 'team', 'role',
+                  'role_display_name', 'roster')
+next_fields = ('role', 'role_display_name', 'roster', 'full_name', 'start', 'end', 'photo_url', 'user',
+               'user_id', 'role_id', 'team_id')
+
 
 def on_get(req, resp, team):
     '''
@@ -115,141 +121,50 @@ def on_get(req, resp, team):
         }
 
     '''
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
 
-    cursor.execute('SELECT `id`, `override_phone_number` FROM `team` WHERE `name` = %s', team)
-    if cursor.rowcount < 1:
+    snapshot = get_snapshot(cursor, team)
+    if snapshot is None:
         raise HTTPNotFound()
-    data = cursor.fetchone()
-    team_id = data['id']
-    override_num = data['override_phone_number']
+    override_num = snapshot['override_phone_number']
 
     session = req.env['beaker.session']
     user = None
     if 'user' in session:
         user = session['user']
 
-    roster = get_roster_by_team_id(cursor, team_id, user)
+    roster = get_roster_by_team_id(cursor, snapshot['team_id'], user)
     allowed_users = {user['name'] for roster in roster.values() for user in roster['users']}
+    cursor.close()
+    connection.close()
 
-    if len(allowed_users) > 0:
-        query = 'SELECT id FROM `user` WHERE `name` IN %s' % (tuple(allowed_users),)
-        cursor.execute(query)
-        allowed_users = {row['id'] for row in cursor}
-    else:
-        allowed_users = set()
-
-    users = set([])
-    payload = {}
-    team_where = None
-
-    if len(allowed_users) > 0:
-        current_query = '''
-            SELECT `user`.`full_name` AS `full_name`,
-                `user`.`photo_url`,
-                `event`.`start`, `event`.`end`,
-                `event`.`user_id`,
-                `user`.`name` AS `user`,
-                `team`.`name` AS `team`,
-                `role`.`name` AS `role`,
-                `role`.`display_name` AS `role_display_name`,
-                `roster`.`name` AS `roster`
-            FROM `event`
-            JOIN `user` ON `event`.`user_id` = `user`.`id`
-            JOIN `team` ON `event`.`team_id` = `team`.`id`
-            JOIN `role` ON `role`.`id` = `event`.`role_id`
-            JOIN `schedule` ON `schedule`.`id` = `event`.`schedule_id`
-            JOIN `roster` ON `roster`.`id` = `schedule`.`roster_id`
-            WHERE UNIX_TIMESTAMP() BETWEEN `event`.`start` AND `event`.`end`'''
-        current_query += ' AND `user`.`id` IN %s' % (tuple(allowed_users),)
-        team_where = '`team`.`id` = %s'
-        cursor.execute('''SELECT `subscription_id`, `role_id` FROM `team_subscription`
-                        JOIN `team` ON `team_id` = `team`.`id`
-                        WHERE %s''' % team_where,
-                    team_id)
-
-        if cursor.rowcount != 0:
-            # Check conditions are true for either team OR subscriber
-            team_where = '(%s OR (%s))' % (team_where, ' OR '.join(
-                ['`event`.`team_id` = %s AND `event`.`role_id` = %s' %
-                (row['subscription_id'], row['role_id']) for row in cursor]))
-
-        cursor.execute(' AND '.join((current_query, team_where)), team_id)
+    payload = {'current': {}, 'next': {}}
+    # events without a schedule (hence roster) are left out of the summary
+    if allowed_users:
         payload['current'] = defaultdict(list)
-        for event in cursor:
-            payload['current'][event['role']].append(event)
-            users.add(event['user_id'])
-    else:
-        payload['current'] = {}
-
-    if team_where is None:
-        payload['next'] = {}
-    else:
-        next_query = '''
-            SELECT `role`.`name` AS `role`,
-                `role`.`display_name` AS `role_display_name`,
-                `roster`.`name` AS `roster`,
-                `user`.`full_name` AS `full_name`,
-                `event`.`start`,
-                `event`.`end`,
-                `user`.`photo_url`,
-                `user`.`name` AS `user`,
-                `event`.`user_id`,
-                `event`.`role_id`,
-                `event`.`team_id`
-            FROM `event`
-            JOIN `role` ON `event`.`role_id` = `role`.`id`
-            JOIN `user` ON `event`.`user_id` = `user`.`id`
-            JOIN `schedule` ON `schedule`.`id` = `event`.`schedule_id`
-            JOIN `roster` ON `roster`.`id` = `schedule`.`roster_id`
-
-            JOIN (SELECT `event`.`role_id`, `event`.`team_id`, MIN(`event`.`start` - UNIX_TIMESTAMP()) AS dist
-                FROM `event` JOIN `team` ON `team`.`id` = `event`.`team_id`
-                WHERE `start` > UNIX_TIMESTAMP() AND %s
-                GROUP BY `event`.`role_id`, `event`.`team_id`) AS t1
-                ON `event`.`role_id` = `t1`.`role_id`
-                    AND `event`.`start` - UNIX_TIMESTAMP() = `t1`.dist
-                    AND `event`.`team_id` = `t1`.`team_id`''' % team_where
-        cursor.execute(next_query, team_id)
+        for event in get_current(snapshot):
+            if event['roster'] is not None and event['user'] in allowed_users:
+                payload['current'][event['role']].append(
+                    {key: event[key] for key in current_fields})
         payload['next'] = defaultdict(list)
-        for event in cursor:
-            payload['next'][event['role']].append(event)
-            users.add(event['user_id'])
-
-        users = allowed_users & users
+        for event in snapshot['next']:
+            if event['roster'] is not None:
+                payload['next'][event['role']].append({key: event[key] for key in next_fields})
 
+        users = {event['user_id'] for part in payload.values() for event_list in part.values()
+                 for event in event_list if event['user'] in allowed_users}
         if users:
-            # TODO: write a test for empty users
-            contacts_query = '''
-                SELECT `contact_mode`.`name` AS `mode`,
-                    `user_contact`.`destination`,
-                    `user_contact`.`user_id`
-                FROM `user`
-                    JOIN `user_contact` ON `user`.`id` = `user_contact`.`user_id`
-                    JOIN `contact_mode` ON `contact_mode`.`id` = `user_contact`.`mode_id`
-                WHERE `user`.`id` IN %s'''
-
-            cursor.execute(contacts_query, (users,))
-            contacts = cursor.fetchall()
-
+            contacts = {event['user_id']: event['contacts']
+                        for event in get_current(snapshot) + snapshot['next']}
             for part in payload.values():
                 for event_list in part.values():
                     for event in event_list:
-                        event['user_contacts'] = dict((c['mode'], c['destination'])
-                                                    for c in contacts
-                                                    if c['user_id'] == event['user_id'])
+                        event['user_contacts'] = dict(contacts[event['user_id']]) if event['user_id'] in users else {}
 
         if override_num:
-            try:
-                for event in payload['current']['primary']:
-                    event['user_contacts']['call'] = override_num
-                    event['user_contacts']['sms'] = override_num
-            except KeyError:
-                # No current primary events exist, do nothing
-                pass
-
-    cursor.close()
-    connection.close()
+            for event in payload['current'].get('primary', []):
+                event['user_contacts']['call'] = override_num
+                event['user_contacts']['sms'] = override_num
 
     resp.text = dumps(payload)
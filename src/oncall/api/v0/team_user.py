@@ -6,8 +6,9 @@ from urllib.parse import unquote
 from falcon import HTTPNotFound
 from ujson import dumps as json_dumps
 
-from ...auth import login_required, check_team_auth
+from ...auth import login_required, check_team_auth, invalidate_permissions
 from ... import db
+from .search_index import invalidate_search_index
 
 
 def on_get(req, resp):
@@ -38,7 +39,7 @@ def on_get(req, resp):
     query = '''SELECT `team`.`name` as team_name, `user`.`name` as user_name FROM `team_user`
                       JOIN `user` ON `team_user`.`user_id`=`user`.`id`
                       JOIN `team` ON `team_user`.`team_id`=`team`.`id`'''
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     cursor.execute(query)
     data = [{'team': r[0], 'user': r[1]} for r in cursor]
@@ -63,7 +64,7 @@ def on_delete(req, resp, team, user):
     """
     team = unquote(team)
     check_team_auth(team, req)
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
 
     cursor.execute('''DELETE FROM `team_user`
@@ -75,5 +76,7 @@ def on_delete(req, resp, team, user):
         raise HTTPNotFound()
 
     connection.commit()
+    invalidate_search_index('team_users')
+    invalidate_permissions(user=user)
     cursor.close()
     connection.close()
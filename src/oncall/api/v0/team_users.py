@@ -5,8 +5,9 @@ from falcon import HTTPError, HTTP_201
 from ujson import dumps as json_dumps
 from .users import get_user_data
 from ... import db
-from ...auth import login_required, check_team_auth
+from ...auth import login_required, check_team_auth, invalidate_permissions
 from ...utils import load_json_body
+from .search_index import invalidate_search_index
 
 constraints = {'active': '`team`.`active` = %s'}
 
@@ -46,7 +47,7 @@ def on_get(req, resp, team):
         query += ' AND `team`.`active` = %s'
         query_params.append(active)
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     cursor.execute(query, query_params)
     data = [r[0] for r in cursor]
@@ -71,7 +72,7 @@ def on_post(req, resp, team):
             description='name missing for user'
         )
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     try:
         cursor.execute('''INSERT INTO `team_user` (`team_id`, `user_id`)
@@ -81,6 +82,8 @@ def on_post(req, resp, team):
                           )''',
                        (team, user_name))
         connection.commit()
+        invalidate_search_index('team_users')
+        invalidate_permissions(user=user_name)
     except db.IntegrityError as e:
         err_msg = str(e.args[1])
         if err_msg == 'Column \'user_id\' cannot be null':
@@ -98,5 +101,9 @@ def on_post(req, resp, team):
         cursor.close()
         connection.close()
 
+    connection = db.connect(req)
+    cursor = connection.cursor(db.DictCursor)
     resp.status = HTTP_201
-    resp.text = json_dumps(get_user_data(None, {'name': user_name})[0])
+    resp.text = json_dumps(get_user_data(None, {'name': user_name}, dbinfo=(connection, cursor))[0])
+    cursor.close()
+    connection.close()
@@ -8,7 +8,8 @@ from ...utils import load_json_body, invalid_char_reg, subscribe_notifications,
 from ...constants import TEAM_CREATED
 
 from ... import db, iris
-from ...auth import login_required
+from ...auth import login_required, invalidate_permissions
+from .search_index import invalidate_search_index
 
 constraints = {
     'name': '`team`.`name` = %s',
@@ -83,7 +84,7 @@ def on_get(req, resp):
     if 'active' not in req.params:
         req.params['active'] = True
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     keys = []
     query_values = []
@@ -204,7 +205,7 @@ def on_post(req, resp):
                 description='no iris plan named %s exists' % iris_plan
             )
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     # if team creation request is coming from api use the username from the admin field in lieu of the user context var
     if 'user' not in req.context:
@@ -240,6 +241,8 @@ def on_post(req, resp):
         subscribe_notifications(team_name, req.context['user'], cursor)
         create_audit({'team_id': team_id}, team_name, TEAM_CREATED, req, cursor)
         connection.commit()
+        invalidate_search_index('teams', 'team_users')
+        invalidate_permissions(team=team_name)
     except db.IntegrityError:
         raise HTTPError(
             '422 Unprocessable Entity',
@@ -66,7 +66,7 @@ def on_get(req, resp, user_name):
     if role:
         query_end = ' AND `role`.`name` = %s' + query_end
         query_params.append(role)
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
     cursor.execute(query + query_end, query_params)
     data = cursor.fetchall()
@@ -4,9 +4,13 @@
 from falcon import HTTPNotFound, HTTP_204, HTTPBadRequest
 from ujson import dumps as json_dumps
 from ... import db
-from ...auth import login_required, check_user_auth
+from ...auth import login_required, check_user_auth, invalidate_permissions
 from ...utils import load_json_body
 from .users import get_user_data
+from .roster_visibility import invalidate_roster_visibility
+from .ical import invalidate_ical
+from .oncall_snapshot import invalidate_oncall
+from .search_index import invalidate_search_index
 
 
 writable_columns = {
@@ -69,7 +73,11 @@ def on_get(req, resp, user_name):
     """
     # Format request to filter query on user name
     req.params['name'] = user_name
-    data = get_user_data(req.get_param_as_list('fields'), req.params)
+    connection = db.connect(req)
+    cursor = connection.cursor(db.DictCursor)
+    data = get_user_data(req.get_param_as_list('fields'), req.params, dbinfo=(connection, cursor))
+    cursor.close()
+    connection.close()
     if not data:
         raise HTTPNotFound()
     resp.text = json_dumps(data[0])
@@ -90,10 +98,15 @@ def on_delete(req, resp, user_name):
     :statuscode 404: User not found
     """
     check_user_auth(user_name, req)
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     cursor.execute('DELETE FROM `user` WHERE `name`=%s', user_name)
     connection.commit()
+    invalidate_search_index()
+    invalidate_permissions(user=user_name)
+    invalidate_roster_visibility()
+    invalidate_ical()
+    invalidate_oncall()
     cursor.close()
     connection.close()
 
@@ -151,7 +164,7 @@ def on_put(req, resp, user_name):
             set_columns.append('`{0}` = %s'.format(field))
     set_clause = ', '.join(set_columns)
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     if set_clause:
         query = 'UPDATE `user` SET {0} WHERE `name` = %s'.format(set_clause)
@@ -180,6 +193,13 @@ def on_put(req, resp, user_name):
             contacts.append(contact)
         cursor.executemany(contacts_query, contacts)
     connection.commit()
+    invalidate_search_index('users')
+    invalidate_permissions(user=user_name)
+    if 'name' in data:
+        invalidate_permissions(user=data['name'])
+        invalidate_roster_visibility()
+    invalidate_ical()
+    invalidate_oncall()
     cursor.close()
     connection.close()
     resp.status = HTTP_204
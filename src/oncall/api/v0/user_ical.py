@@ -5,13 +5,9 @@ import time
 from . import ical
 from .roles import get_role_ids
 from .teams import get_team_ids
-from ... import db
 
 
-def get_user_events(user_name, start, roles=None, excluded_teams=None):
-    connection = db.connect()
-    cursor = connection.cursor(db.DictCursor)
-
+def get_user_events_query(cursor, user_name, start, roles=None, excluded_teams=None):
     role_condition = ''
     role_ids = get_role_ids(cursor, roles)
     if role_ids:
@@ -32,7 +28,9 @@ def get_user_events(user_name, start, roles=None, excluded_teams=None):
             `user`.`name` AS user,
             `role`.`name` AS role,
             `event`.`start`,
-            `event`.`end`
+            `event`.`end`,
+            `event`.`team_id`,
+            `event`.`user_id`
         FROM `event`
             JOIN `team` ON `event`.`team_id` = `team`.`id`
             JOIN `user` ON `event`.`user_id` = `user`.`id`
@@ -41,13 +39,12 @@ def get_user_events(user_name, start, roles=None, excluded_teams=None):
             `event`.`end` > %s AND
             `user`.`name` = %s
         ''' + role_condition + excluded_teams_condition
+    return query, (start, user_name)
 
-    cursor.execute(query, (start, user_name))
 
-    events = cursor.fetchall()
-    cursor.close()
-    connection.close()
-    return events
+def get_user_tags(cursor, user_name):
+    cursor.execute('SELECT `id` FROM `user` WHERE `name` = %s', user_name)
+    return {('user', row['id']) for row in cursor}
 
 
 def on_get(req, resp, user_name):
@@ -67,15 +64,17 @@ def on_get(req, resp, user_name):
         ...
 
     """
-    start = req.get_param_as_int('start')
-    if start is None:
-        start = int(time.time())
+    start_param = req.get_param_as_int('start')
+    start = int(time.time()) if start_param is None else start_param
     contact = req.get_param_as_bool('contact')
     if contact is None:
         contact = True
     roles = req.get_param_as_list('roles')
     excluded_teams = req.get_param_as_list('excludedTeams')
 
-    events = get_user_events(user_name, start, roles=roles, excluded_teams=excluded_teams)
-    resp.text = ical.events_to_ical(events, user_name, contact)
-    resp.set_header('Content-Type', 'text/calendar')
+    def prepare(cursor):
+        query, args = get_user_events_query(cursor, user_name, start, roles, excluded_teams)
+        return query, args, get_user_tags(cursor, user_name)
+
+    key = ('user', user_name, start_param, tuple(roles or ()), contact, tuple(excluded_teams or ()))
+    ical.respond(req, resp, key, user_name, contact, prepare)
@@ -27,7 +27,7 @@ def on_delete(req, resp, notification_id):
     :statuscode 200: Successful delete
     :statuscode 404: Notification setting not found
     '''
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     try:
         cursor.execute('SELECT `user`.`name` FROM `notification_setting` '
@@ -85,7 +85,7 @@ def on_put(req, resp, notification_id):
     cols = [columns[c] for c in data if c in columns]
     query_params = [data[c] for c in params if c in columns]
     query = 'UPDATE notification_setting SET %s WHERE id = %%s' % ', '.join(cols)
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
 
     try:
@@ -72,7 +72,7 @@ def on_get(req, resp, user_name):
                    JOIN `setting_role` ON `notification_setting`.`id` = `setting_role`.`setting_id`
                    JOIN `role` ON `setting_role`.`role_id` = `role`.`id`
                WHERE `user`.`name` = %s'''
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
     cursor.execute(query, user_name)
     data = {}
@@ -166,7 +166,7 @@ def on_post(req, resp, user_name):
             title='invalid notification setting',
             description='missing required parameters: %s' % ', '.join(missing_params)
         )
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     cursor.execute('SELECT is_reminder FROM notification_type WHERE name = %s', data['type'])
 
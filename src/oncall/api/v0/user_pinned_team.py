@@ -22,7 +22,7 @@ def on_delete(req, resp, user_name, team_name):
     :statuscode 404: Team not found in user's pinned teams
     '''
     check_user_auth(user_name, req)
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     cursor.execute('''DELETE FROM `pinned_team`
                       WHERE `user_id` = (SELECT `id` FROM `user` WHERE `name` = %s)
@@ -30,7 +30,7 @@ def on_get(req, resp, user_name):
             "team-foo"
         ]
     '''
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     cursor.execute('''SELECT `team`.`name`
                       FROM `pinned_team` JOIN `team` ON `pinned_team`.`team_id` = `team`.`id`
@@ -69,7 +69,7 @@ def on_post(req, resp, user_name):
             title='Invalid team pin',
             description='Missing team parameter'
         )
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     try:
         cursor.execute('''INSERT INTO `pinned_team` (`user_id`, `team_id`)
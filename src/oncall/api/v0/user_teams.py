@@ -30,7 +30,7 @@ def on_get(req, resp, user_name):
             "team-bar"
         ]
     """
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     cursor.execute('SELECT `id` FROM `user` WHERE `name` = %s', user_name)
     if cursor.rowcount < 1:
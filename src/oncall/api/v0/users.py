@@ -6,6 +6,7 @@ from ujson import dumps as json_dumps
 from ... import db
 from ... import auth
 from ...utils import load_json_body
+from .search_index import invalidate_search_index
 
 
 JOIN_CONTACT_TABLES = (' LEFT JOIN `user_contact` ON `user`.`id` = `user_contact`.`user_id`'
@@ -48,10 +49,15 @@ constraints = {
 }
 
 
-def get_user_data(fields, filter_params, dbinfo=None):
+def get_user_data(fields, filter_params, dbinfo=None, names=None, ids=None):
     """
     Get user data for a request
+
+    :param names: optional list of user names to fetch, all in one query
+    :param ids: optional list of user ids to fetch, all in one query
     """
+    if (names is not None and not names) or (ids is not None and not ids):
+        return []
     contacts = False
     from_clause = '`user`'
 
@@ -81,9 +87,14 @@ def get_user_data(fields, filter_params, dbinfo=None):
     else:
         connection, cursor = dbinfo
 
-    where = ' AND '.join(constraints[key] % connection.escape(value)
-                         for key, value in filter_params.items()
-                         if key in constraints)
+    where = [constraints[key] % connection.escape(value)
+             for key, value in filter_params.items()
+             if key in constraints]
+    if names is not None:
+        where.append('`user`.`name` IN %s' % connection.escape(list(names)))
+    if ids is not None:
+        where.append('`user`.`id` IN %s' % connection.escape(list(ids)))
+    where = ' AND '.join(where)
     query = 'SELECT %s FROM %s' % (cols, from_clause)
     if where:
         query = '%s WHERE %s' % (query, where)
@@ -169,7 +180,11 @@ def on_get(req, resp):
         ]
 
     """
-    resp.text = json_dumps(get_user_data(req.get_param_as_list('fields'), req.params))
+    connection = db.connect(req)
+    cursor = connection.cursor(db.DictCursor)
+    resp.text = json_dumps(get_user_data(req.get_param_as_list('fields'), req.params, dbinfo=(connection, cursor)))
+    cursor.close()
+    connection.close()
 
 
 @auth.debug_only
@@ -178,11 +193,12 @@ def on_post(req, resp):
     Create user. Currently used only in debug mode.
     """
     data = load_json_body(req)
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     try:
         cursor.execute('INSERT INTO `user` (`name`) VALUES (%(name)s)', data)
         connection.commit()
+        invalidate_search_index('users')
     except db.IntegrityError:
         raise HTTPError(
             '422 Unprocessable Entity',
@@ -9,7 +9,7 @@ import re
 from beaker.middleware import SessionMiddleware
 from falcon_cors import CORS
 
-from . import db, constants, iris, auth
+from . import db, constants, iris, auth, metrics, settings
 
 import logging
 logger = logging.getLogger('oncall.app')
@@ -45,6 +45,40 @@ class ReqBodyMiddleware(object):
         req.context['body'] = req.bounded_stream.read()
 
 
+class DBConnectionMiddleware(object):
+    '''
+    Give each request one lazily checked-out pooled connection, shared by the auth checks and the handler
+    through db.connect(req). It is committed if the request succeeded, rolled back otherwise, and returned
+    to the pool once the response is ready.
+    '''
+
+    def process_request(self, req, resp):
+        req.context['db_connection'] = db.RequestConnection()
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        connection = req.context.get('db_connection')
+        if connection is None:
+            return
+        try:
+            connection.release(req_succeeded)
+        except Exception:
+            logger.exception('Failed to release request DB connection')
+
+
+class MetricsSenderMiddleware(object):
+    '''
+    Start the metrics sender of each worker process on its first request. Under uWSGI without lazy-apps
+    the app is loaded in the master and forked into the workers, so a sender started while loading would
+    only run in the master, which serves no requests and whose pool is idle.
+    '''
+
+    def __init__(self, interval):
+        self.interval = interval
+
+    def process_request(self, req, resp):
+        metrics.start_sender(self.interval)
+
+
 class AuthMiddleware(object):
     def process_resource(self, req, resp, resource, params):
         try:
@@ -61,16 +95,21 @@ class AuthMiddleware(object):
 
 
 application = None
+# seconds between metrics emits, if metrics are enabled
+metrics_interval = None
 
 
 def init_falcon_api(config):
     global application
     cors = CORS(allow_origins_list=config.get('allow_origins_list', []))
     middlewares = [
+        DBConnectionMiddleware(),
         SecurityHeaderMiddleware(),
         ReqBodyMiddleware(),
         cors.middleware
     ]
+    if metrics_interval:
+        middlewares.append(MetricsSenderMiddleware(metrics_interval))
     if config.get('require_auth'):
         middlewares.append(AuthMiddleware())
     application = falcon.App(middleware=middlewares)
@@ -120,7 +159,18 @@ class RawPathPatcher(object):
 
 
 def init(config):
+    global metrics_interval
+    settings.init(config)
     db.init(config['db'])
+    if 'metrics' in config:
+        try:
+            metrics.init(config, 'oncall-api', db.default_pool_stats())
+        except Exception:
+            # e.g. several gunicorn workers competing for the prometheus port
+            logger.exception('Failed to initialize metrics')
+        else:
+            # started per process, on the first request (see MetricsSenderMiddleware)
+            metrics_interval = config.get('metrics_interval', 60)
     constants.init(config)
     if 'iris_plan_integration' in config:
         iris.init(config['iris_plan_integration'])
@@ -158,5 +208,9 @@ def init(config):
 def get_wsgi_app():
     import sys
     from . import utils
-    init(utils.read_config(sys.argv[1]))
+    config = utils.read_config(sys.argv[1])
+    settings.init(config, sys.argv[1])
+    init(config)
+    if config.get('reload_config_on_sighup', False):
+        settings.enable_sighup_reload()
     return application
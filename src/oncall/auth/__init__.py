@@ -10,11 +10,25 @@ import importlib
 from urllib.parse import quote
 from falcon import HTTPUnauthorized, HTTPForbidden, Request
 from .. import db
+from ..cache import TTLCache
 
 logger = logging.getLogger('oncall.auth')
 auth_manager = None
 sso_auth_manager = None
 
+# (challenger, team) admin/member flags, (challenger, user) admin-of relations and god flags.
+# Entries are dropped by invalidate_permissions() when the write handlers change them, and
+# otherwise expire after the ttl so that changes made by other processes are picked up.
+permission_cache = TTLCache('permission', max_size=10000, ttl=30)
+
+team_permission_query = '''SELECT `team`.`name`,
+        EXISTS(SELECT 1 FROM `team_admin`
+               WHERE `team_admin`.`team_id` = `team`.`id` AND `team_admin`.`user_id` = `user`.`id`) AS `admin`,
+        EXISTS(SELECT 1 FROM `team_user`
+               WHERE `team_user`.`team_id` = `team`.`id` AND `team_user`.`user_id` = `user`.`id`) AS `member`
+    FROM `team`, `user`
+    WHERE `user`.`name` = %%s AND `team`.`%s` = %%s'''
+
 
 def debug_only(function):
     def wrapper(*args, **kwargs):
@@ -25,18 +39,60 @@ def debug_only(function):
     return wrapper
 
 
-def is_god(challenger):
-    connection = db.connect()
-    cursor = connection.cursor()
-    cursor.execute('SELECT `id` FROM `user` WHERE `god` = TRUE AND `name` = %s', challenger)
-    is_god = cursor.rowcount
-    cursor.close()
-    connection.close()
-    return is_god != 0
+def is_god(challenger, req=None):
+    key = ('god', challenger)
+    is_god = permission_cache.get(key)
+    if is_god is None:
+        connection = db.connect(req)
+        cursor = connection.cursor()
+        cursor.execute('SELECT `id` FROM `user` WHERE `god` = TRUE AND `name` = %s', challenger)
+        is_god = cursor.rowcount != 0
+        cursor.close()
+        connection.close()
+        permission_cache.set(key, is_god)
+    return is_god
+
+
+def check_ical_key_admin(challenger, req=None):
+    return is_god(challenger, req)
+
+
+def get_team_permissions(challenger, req, team=None, team_id=None):
+    """
+    Get {'team', 'admin', 'member'} for challenger in a team given by name or id. Cached in permission_cache.
+    """
+    if team_id is None:
+        key = ('team', challenger, team)
+        column, value = 'name', team
+    else:
+        key = ('team_id', challenger, team_id)
+        column, value = 'id', team_id
+    permissions = permission_cache.get(key)
+    if permissions is None:
+        connection = db.connect(req)
+        cursor = connection.cursor()
+        cursor.execute(team_permission_query % column, (challenger, value))
+        row = cursor.fetchone()
+        cursor.close()
+        connection.close()
+        if row:
+            permissions = {'team': row[0], 'admin': bool(row[1]), 'member': bool(row[2])}
+        else:
+            permissions = {'team': team, 'admin': False, 'member': False}
+        permission_cache.set(key, permissions)
+    return permissions
 
 
-def check_ical_key_admin(challenger):
-    return is_god(challenger)
+def invalidate_permissions(user=None, team=None):
+    """
+    Drop cached permissions involving a user (as challenger or target) and/or a team name. Call this
+    after committing any change to team_admin, team_user, god status, or user/team names.
+    """
+    def stale(key, value):
+        if user is not None and (key[1] == user or (key[0] == 'user' and key[2] == user)):
+            return True
+        return team is not None and key[0] in ('team', 'team_id') and value['team'] == team
+    permission_cache.invalidate_where(stale)
 
 
 def check_user_auth(user, req):
@@ -48,20 +104,24 @@ def check_user_auth(user, req):
     challenger = req.context['user']
     if user == challenger:
         return
-    connection = db.connect()
-    cursor = connection.cursor()
-    get_allowed_query = '''SELECT DISTINCT(`user`.`name`)
-        FROM `team_admin`
-        JOIN `team_user` ON `team_admin`.`team_id` = `team_user`.`team_id`
-        JOIN `user` ON `user`.`id` = `team_user`.`user_id`
-        JOIN `user` AS `admin` ON `admin`.`id` = `team_admin`.`user_id`
-        WHERE `admin`.`name` = %s
-        AND `user`.`name` = %s'''
-    cursor.execute(get_allowed_query, (challenger, user))
-    user_in_query = cursor.rowcount
-    cursor.close()
-    connection.close()
-    if user_in_query != 0 or is_god(challenger):
+    key = ('user', challenger, user)
+    user_in_query = permission_cache.get(key)
+    if user_in_query is None:
+        connection = db.connect(req)
+        cursor = connection.cursor()
+        get_allowed_query = '''SELECT DISTINCT(`user`.`name`)
+            FROM `team_admin`
+            JOIN `team_user` ON `team_admin`.`team_id` = `team_user`.`team_id`
+            JOIN `user` ON `user`.`id` = `team_user`.`user_id`
+            JOIN `user` AS `admin` ON `admin`.`id` = `team_admin`.`user_id`
+            WHERE `admin`.`name` = %s
+            AND `user`.`name` = %s'''
+        cursor.execute(get_allowed_query, (challenger, user))
+        user_in_query = cursor.rowcount != 0
+        cursor.close()
+        connection.close()
+        permission_cache.set(key, user_in_query)
+    if user_in_query or is_god(challenger, req):
         return
     raise HTTPForbidden(
         title='Unauthorized',
@@ -76,19 +136,7 @@ def check_team_auth(team, req):
     if 'app' in req.context:
         return
     challenger = req.context['user']
-    connection = db.connect()
-    cursor = connection.cursor()
-    get_allowed_query = '''SELECT `team`.`name`
-                           FROM `team_admin`
-                           JOIN `team` ON `team_admin`.`team_id` = `team`.`id`
-                           JOIN `user` ON `team_admin`.`user_id` = `user`.`id`
-                           WHERE `user`.`name` = %s
-                           AND `team`.`name` = %s'''
-    cursor.execute(get_allowed_query, (challenger, team))
-    team_in_query = cursor.rowcount
-    cursor.close()
-    connection.close()
-    if team_in_query != 0 or is_god(challenger):
+    if get_team_permissions(challenger, req, team=team)['admin'] or is_god(challenger, req):
         return
     raise HTTPForbidden(
         title='Unauthorized',
@@ -100,17 +148,7 @@ def check_calendar_auth(team, req, user=None):
     if 'app' in req.context:
         return
     challenger = user if (user is not None) else req.context['user']
-    connection = db.connect()
-    cursor = connection.cursor()
-    cursor.execute('''SELECT `user`.`name`
-        FROM `team_user`
-        JOIN `user` ON `team_user`.`user_id` = `user`.`id`
-        WHERE `team_user`.`team_id` = (SELECT `id` FROM `team` WHERE `name` = %s)
-            AND `user`.`name` = %s''', (team, challenger))
-    user_in_team = cursor.rowcount
-    cursor.close()
-    connection.close()
-    if user_in_team != 0 or is_god(challenger):
+    if get_team_permissions(challenger, req, team=team)['member'] or is_god(challenger, req):
         return
     raise HTTPForbidden(
         title='Unauthorized',
@@ -122,18 +160,7 @@ def check_calendar_auth_by_id(team_id, req):
     if 'app' in req.context:
         return
     challenger = req.context['user']
-    query = '''SELECT `user`.`name`
-               FROM `team_user`
-               JOIN `user` ON `team_user`.`user_id` = `user`.`id`
-               WHERE `team_user`.`team_id` = %s
-               AND `user`.`name` = %s'''
-    connection = db.connect()
-    cursor = connection.cursor()
-    cursor.execute(query, (team_id, challenger))
-    user_in_team = cursor.rowcount
-    cursor.close()
-    connection.close()
-    if user_in_team != 0 or is_god(challenger):
+    if get_team_permissions(challenger, req, team_id=team_id)['member'] or is_god(challenger, req):
         return
     raise HTTPForbidden(
         title='Unauthorized',
@@ -171,7 +198,7 @@ def authenticate_application(auth_token, req):
     body = req.context['body'].decode('utf-8')
     try:
         app_name, client_digest = auth_token[5:].split(':', 1)
-        connection = db.connect()
+        connection = db.connect(req)
         cursor = connection.cursor()
         cursor.execute('SELECT `key` FROM `application` WHERE `name` = %s', app_name)
         if cursor.rowcount > 0:
@@ -228,7 +255,7 @@ def _authenticate_user(req):
     try:
         req.context['user'] = session['user']
 
-        connection = db.connect()
+        connection = db.connect(req)
         cursor = connection.cursor()
 
         cursor.execute('SELECT `csrf_token` FROM `session` WHERE `id` = %s', session['_id'])
@@ -291,6 +318,9 @@ def init(application, config):
     global sso_auth_manager
     global authenticate_user
 
+    cache_config = config.get('permission_cache', {})
+    permission_cache.configure(max_size=cache_config.get('max_size'), ttl=cache_config.get('ttl'))
+
     if config.get('sso_module'):
         sso_auth = importlib.import_module(config['sso_module'])
         sso_auth_manager = getattr(sso_auth, 'Authenticator')(config)
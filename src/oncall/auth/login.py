@@ -31,9 +31,9 @@ def on_post(req, resp):
             challenges=[]
         )
 
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor(db.DictCursor)
-    data = get_user_data(None, {'name': user}, dbinfo=(connection, cursor))
+    data = get_user_data(None, {}, dbinfo=(connection, cursor), names=[user])
     if not data:
         cursor.close()
         connection.close()
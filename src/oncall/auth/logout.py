@@ -6,7 +6,7 @@ from .. import db
 
 def on_post(req, resp):
     session = req.env['beaker.session']
-    connection = db.connect()
+    connection = db.connect(req)
     cursor = connection.cursor()
     cursor.execute('DELETE FROM `session` WHERE `id` = %s', session['_id'])
     connection.commit()
@@ -1,13 +1,11 @@
 # Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
 # See LICENSE in the project root for license information.
 import ldap
-from oncall import db
+from oncall import db, settings
 import os
 import logging
 from oncall.user_sync.ldap_sync import user_exists, import_user, update_user
 from falcon import HTTPNotFound
-import oncall.utils
-import sys
 
 logger = logging.getLogger(__name__)
 
@@ -60,7 +58,7 @@ class Authenticator:
         }
 
     def ldap_auth(self, username, password, ldap_domain):
-        config = oncall.utils.read_config(sys.argv[1])['auth']
+        config = settings.get('auth')
 
         ldap_config = self.get_ldap_config(config, ldap_domain)
 
@@ -6,13 +6,16 @@ import logging
 import logging.handlers
 import time
 import os
+import random
 from importlib import import_module
+from uuid import uuid4
 from ujson import loads as json_loads
-from gevent import queue, spawn, sleep
+from gevent import queue, spawn, sleep, killall
 
 from oncall import db, metrics
+from oncall import messengers
 from oncall.messengers import init_messengers, send_message
-from oncall.notifier import reminder, user_validator
+from oncall.notifier import reminder, user_validator, leader, registry
 
 # logging
 logger = logging.getLogger()
@@ -27,10 +30,25 @@ logger.setLevel(logging.INFO)
 logger.addHandler(ch)
 
 
-# queue for messages entering the system
-send_queue = queue.Queue()
+# queue for messages entering the system; poll() only claims as many rows as it has room for
+send_queue = queue.Queue(maxsize=1000)
+
+# ids of messages sent, and (id, attempts, error) of messages failed, since the last flush_message_status()
+sent_ids = []
+failures = []
+# claims of this process: claim id -> [lease end, ids of the rows claimed with it whose status is not flushed]
+leases = {}
+# ids of queued messages whose lease was lost to another poller, which the workers must not send
+lost_ids = set()
 
 default_timezone = None
+# seconds a claimed message is reserved for this process before other pollers may claim it again
+claim_lease = 300
+flush_interval = 1
+# settings of the optional digest stage (see coalesce), or None to send one message per row
+digest = None
+# failed messages are retried with jittered exponential backoff, and dead-lettered after max_attempts
+retry = {'max_attempts': 5, 'base_delay': 60, 'max_delay': 3600}
 
 
 def load_config_file(config_path):
@@ -50,8 +68,14 @@ def load_config_file(config_path):
 
 def init_notifier(config):
     db.init(config['db'])
-    global default_timezone
+    global default_timezone, send_queue, claim_lease, flush_interval, digest, retry
     default_timezone = config['notifier'].get('default_timezone', 'US/Pacific')
+    send_queue = queue.Queue(maxsize=config['notifier'].get('max_queue_size', send_queue.maxsize))
+    claim_lease = config['notifier'].get('claim_lease', claim_lease)
+    flush_interval = config['notifier'].get('flush_interval', flush_interval)
+    registry.refresh_interval = config['notifier'].get('registry_refresh_interval', registry.refresh_interval)
+    digest = config['notifier'].get('digest')
+    retry = dict(retry, **config['notifier'].get('retry', {}))
     if config['notifier']['skipsend']:
         global send_message
         send_message = blackhole
@@ -63,42 +87,212 @@ def blackhole(msg):
 
 
 def mark_message_as_sent(msg_info):
+    sent_ids.append(msg_info['id'])
+
+
+def mark_message_as_unsent(msg_info, error=None):
+    failures.append((msg_info['id'], msg_info.get('attempts', 0) + 1, str(error)[:1024] if error else None))
+
+
+def retry_delay(attempts):
+    '''
+    :return: seconds to wait before the next attempt at a message that failed attempts times, drawn
+             from the upper half of an exponentially growing, capped delay
+    '''
+    delay = min(retry['max_delay'], retry['base_delay'] * 2 ** (attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+
+def case_by_id(values):
+    '''
+    :param values: list of (id, value)
+    :return: SQL CASE expression picking the value of each id, and its arguments
+    '''
+    args = []
+    for message_id, value in values:
+        args += [message_id, value]
+    return 'CASE `id` %s END' % ' '.join(['WHEN %s THEN %s'] * len(values)), args
+
+
+def flush_message_status():
+    '''
+    Record the messages sent or failed since the last flush. Sent messages are updated with one
+    UPDATE; failed ones with one UPDATE scheduling their retries, and one for those that ran out
+    of attempts, which are moved to the dead-letter state.
+    '''
+    global sent_ids, failures
+    sent, failed = sent_ids, failures
+    if not sent and not failed:
+        return
+    sent_ids, failures = [], []
+    now = int(time.time())
+    retries = [failure for failure in failed if failure[1] < retry['max_attempts']]
+    dead = [failure for failure in failed if failure[1] >= retry['max_attempts']]
+    try:
+        connection = db.connect()
+        cursor = connection.cursor()
+        if sent:
+            cursor.execute('UPDATE `notification_queue` SET `active` = 0, `sent` = 1 WHERE `id` IN %s', (sent,))
+        if retries:
+            next_attempt, next_args = case_by_id([(message_id, now + int(retry_delay(attempts)))
+                                                  for message_id, attempts, _ in retries])
+            last_error, error_args = case_by_id([(message_id, error) for message_id, _, error in retries])
+            cursor.execute('''UPDATE `notification_queue`
+                              SET `attempts` = `attempts` + 1, `next_attempt` = %s, `last_error` = %s,
+                                  `claimed_until` = NULL
+                              WHERE `id` IN %%s''' % (next_attempt, last_error),
+                           next_args + error_args + [[message_id for message_id, _, _ in retries]])
+        if dead:
+            last_error, error_args = case_by_id([(message_id, error) for message_id, _, error in dead])
+            cursor.execute('''UPDATE `notification_queue`
+                              SET `active` = 0, `sent` = 0, `dead_letter` = 1, `attempts` = `attempts` + 1,
+                                  `next_attempt` = NULL, `last_error` = %s
+                              WHERE `id` IN %%s''' % last_error,
+                           error_args + [[message_id for message_id, _, _ in dead]])
+            logger.warning('Moved %s messages to the dead-letter state after %s attempts',
+                           len(dead), retry['max_attempts'])
+            metrics.stats['message_dead_letter_cnt'] += len(dead)
+        connection.commit()
+        cursor.close()
+        connection.close()
+    except Exception:
+        logger.exception('Failed to update status of %s messages, retrying', len(sent) + len(failed))
+        sent_ids.extend(sent)
+        failures.extend(failed)
+        return
+    release_leases(set(sent) | {message_id for message_id, _, _ in failed})
+
+
+def release_leases(ids):
+    for claim in list(leases):
+        leases[claim][1] -= ids
+        if not leases[claim][1]:
+            del leases[claim]
+
+
+def renew_leases():
+    '''
+    Extend the leases of claimed messages still waiting to be sent, or for their status to be flushed,
+    once they are within half a lease of expiring, so that messages held up behind slow or rate-limited
+    messengers are not claimed and sent again by another poller. Messages whose lease was lost anyway
+    are added to lost_ids.
+    '''
+    now = int(time.time())
+    due = [(claim, lease) for claim, lease in leases.items() if lease[0] - now < claim_lease / 2]
+    if not due:
+        return
     connection = db.connect()
     cursor = connection.cursor()
-    cursor.execute('UPDATE `notification_queue` SET `active` = 0, `sent` = 1 WHERE `id` = %s',
-                   msg_info['id'])
-    connection.commit()
-    connection.close()
-    cursor.close()
-
-
-def mark_message_as_unsent(msg_info):
-    connection = db.connect()
-    cursor = connection.cursor()
-    cursor.execute('UPDATE `notification_queue` SET `active` = 0, `sent` = 0 WHERE `id` = %s',
-                   msg_info['id'])
-    connection.commit()
-    connection.close()
-    cursor.close()
+    try:
+        for claim, lease in due:
+            ids = list(lease[1])
+            cursor.execute('''UPDATE `notification_queue` SET `claimed_until` = %s
+                              WHERE `claimed_by` = %s AND `active` = 1 AND `id` IN %s''',
+                           (now + claim_lease, claim, ids))
+            if cursor.rowcount < len(ids):
+                cursor.execute('''SELECT `id` FROM `notification_queue`
+                                  WHERE `claimed_by` = %s AND `active` = 1 AND `id` IN %s''', (claim, ids))
+                lost = lease[1] - {row[0] for row in cursor}
+                if lost:
+                    logger.warning('Lost the lease of %s messages claimed with %s', len(lost), claim)
+                    metrics.stats['message_lease_lost_cnt'] += len(lost)
+                    lost_ids.update(lost)
+                    lease[1] -= lost
+            lease[0] = now + claim_lease
+            if not lease[1]:
+                del leases[claim]
+        connection.commit()
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def status_flusher():
+    while True:
+        sleep(flush_interval)
+        flush_message_status()
+        try:
+            renew_leases()
+        except Exception:
+            logger.exception('Failed to renew message leases')
 
 
 def poll():
-    query = '''SELECT `user`.`name` AS `user`, `contact_mode`.`name` AS `mode`, `notification_queue`.`send_time`,
-                      `user`.`time_zone`,`notification_type`.`subject`, `notification_queue`.`context`,
-                      `notification_type`.`body`, `notification_queue`.`id`
-               FROM `notification_queue` JOIN `user` ON `notification_queue`.`user_id` = `user`.`id`
-                   JOIN `contact_mode` ON `notification_queue`.`mode_id` = `contact_mode`.`id`
-                   JOIN `notification_type` ON `notification_queue`.`type_id` = `notification_type`.`id`
-               WHERE `notification_queue`.`active` = 1 AND `notification_queue`.`send_time` <= UNIX_TIMESTAMP()'''
-    logger.info('[-] start send task...')
+    '''
+    Claim due messages, as many as there is room for in send_queue, and queue them for the workers.
+    Claimed rows are leased to this process for claim_lease seconds, so other pollers (and the next
+    poll of this one) skip them while they wait to be sent; the status flusher renews the leases of
+    those still waiting (see renew_leases).
+
+    :return: True if the claim was limited by the room in send_queue, and more messages may be due
+    '''
+    room = send_queue.maxsize - send_queue.qsize()
+    if room <= 0:
+        return True
+    claim = uuid4().hex
+    now = int(time.time())
 
     connection = db.connect()
     cursor = connection.cursor(db.DictCursor)
-    cursor.execute(query)
-    for row in cursor:
-        send_queue.put(row)
+    cursor.execute('''UPDATE `notification_queue` SET `claimed_by` = %s, `claimed_until` = %s
+                      WHERE `active` = 1 AND `send_time` <= %s
+                          AND (`claimed_until` IS NULL OR `claimed_until` <= %s)
+                          AND (`next_attempt` IS NULL OR `next_attempt` <= %s)
+                      ORDER BY `send_time` LIMIT %s''',
+                   (claim, now + claim_lease, now, now, now, room))
+    claimed = cursor.rowcount
+    connection.commit()
+
+    logger.info('[-] start send task for %s messages...', claimed)
+    # notification types and contact modes are resolved from the registry
+    query = '''SELECT `user`.`name` AS `user`, `notification_queue`.`mode_id`, `notification_queue`.`send_time`,
+                      `user`.`time_zone`, `notification_queue`.`type_id`, `notification_queue`.`context`,
+                      `notification_queue`.`id`, `notification_queue`.`attempts`
+               FROM `notification_queue` JOIN `user` ON `notification_queue`.`user_id` = `user`.`id`
+               WHERE `notification_queue`.`active` = 1 AND `notification_queue`.`send_time` <= %s
+                   AND `notification_queue`.`claimed_by` = %s'''
+    if claimed:
+        cursor.execute(query, (now, claim))
+        rows = cursor.fetchall()
+    else:
+        rows = []
     cursor.close()
     connection.close()
+    if rows:
+        leases[claim] = [now + claim_lease, {row['id'] for row in rows}]
+    for group in coalesce(rows):
+        send_queue.put(group)
+    return claimed == room
+
+
+def coalesce(rows):
+    '''
+    Digest stage: group the rows for the same user, contact mode and notification type whose send times
+    are at most digest['window'] seconds apart, up to digest['max_messages'] rows per group. Only types
+    named in digest['types'] are grouped, or all of them if it is not set.
+
+    :return: list of groups of rows, each sent as one message
+    '''
+    if not digest:
+        return [[row] for row in rows]
+    window = digest.get('window', 300)
+    max_messages = digest.get('max_messages', 50)
+    types = digest.get('types')
+    groups = []
+    open_groups = {}
+    for row in sorted(rows, key=lambda row: (row['send_time'], row['id'])):
+        if types is not None:
+            template = registry.get_template(row['type_id'])
+            if template is None or template.name not in types:
+                groups.append([row])
+                continue
+        key = (row['user'], row['mode_id'], row['type_id'])
+        group = open_groups.get(key)
+        if group is None or len(group) >= max_messages or row['send_time'] - group[0]['send_time'] > window:
+            group = open_groups[key] = []
+            groups.append(group)
+        group.append(row)
+    return groups
 
 
 def worker():
@@ -106,23 +300,87 @@ def worker():
         format_and_send_message()
 
 
+def render_message(rows):
+    '''
+    Render the message for a group of rows: the row's own subject and body, or for several rows a
+    digest listing each of them.
+    '''
+    mode = registry.get_mode(rows[0]['mode_id'])
+    template = registry.get_template(rows[0]['type_id'])
+    if mode is None or template is None:
+        raise ValueError('Unknown contact mode %s or notification type %s' % (rows[0]['mode_id'], rows[0]['type_id']))
+    rendered = [template.render(json_loads(row['context'])) for row in rows]
+    if len(rendered) == 1:
+        subject, body = rendered[0]
+    else:
+        subject = '%s (and %d more)' % (rendered[0][0], len(rendered) - 1)
+        body = '\n\n'.join('%s\n%s' % part for part in rendered)
+    return {'user': rows[0]['user'], 'mode': mode, 'subject': subject, 'body': body}
+
+
 def format_and_send_message():
-    msg_info = send_queue.get()
-    msg = {}
-    msg['user'] = msg_info['user']
-    msg['mode'] = msg_info['mode']
-    context = json_loads(msg_info['context'])
-    msg['subject'] = msg_info['subject'] % context
-    msg['body'] = msg_info['body'] % context
+    rows = send_queue.get()
+    if lost_ids:
+        held = [row for row in rows if row['id'] not in lost_ids]
+        lost_ids.difference_update(row['id'] for row in rows)
+        if not held:
+            return
+        rows = held
+    msg = {'user': rows[0]['user']}
     try:
+        msg = render_message(rows)
         send_message(msg)
-    except Exception:
+    except Exception as e:
         logger.exception('Failed to send message %s', msg)
-        mark_message_as_unsent(msg_info)
-        metrics.stats['message_fail_cnt'] += 1
+        for row in rows:
+            mark_message_as_unsent(row, e)
+        metrics.stats['message_fail_cnt'] += len(rows)
     else:
-        mark_message_as_sent(msg_info)
-        metrics.stats['message_sent_cnt'] += 1
+        for row in rows:
+            mark_message_as_sent(row)
+        metrics.stats['message_sent_cnt'] += len(rows)
+        if len(rows) > 1:
+            metrics.stats['message_digest_cnt'] += 1
+
+
+def leader_tasks(config):
+    '''
+    :return: dict of name to (function, config) of the tasks to run on the leader instance only
+    '''
+    tasks = {}
+    if config['reminder']['activated']:
+        tasks['reminder'] = (reminder.reminder, config['reminder'])
+    if config['user_validator']['activated']:
+        tasks['user validator'] = (user_validator.user_validator, config['user_validator'])
+    return tasks
+
+
+def update_leader_tasks(election, tasks, running):
+    '''
+    Start (or restart, if they failed) the leader tasks if this instance is the leader, and stop
+    them if it is not.
+    '''
+    if election.check():
+        for name, (task, task_config) in tasks.items():
+            greenlet = running.get(name)
+            if greenlet is not None and not bool(greenlet):
+                logger.error("%s failed, %s", name, greenlet.exception)
+            if greenlet is None or not bool(greenlet):
+                running[name] = spawn(task, task_config)
+    elif running:
+        logger.info('Stopping %s, as this notifier is not the leader', ', '.join(running))
+        killall(list(running.values()))
+        running.clear()
+
+
+def leader_worker(election, tasks):
+    running = {}
+    while True:
+        try:
+            update_leader_tasks(election, tasks, running)
+        except Exception:
+            logger.exception('Failed to update leader tasks')
+        sleep(election.check_interval)
 
 
 def metrics_sender():
@@ -136,25 +394,27 @@ def main():
         config = yaml.safe_load(config_file)
 
     init_notifier(config)
+    init_messengers(config.get('messengers', []))
     metrics_on = False
     if 'metrics' in config:
-        metrics.init(config, 'oncall-notifier', {'message_blackhole_cnt': 0, 'message_sent_cnt': 0, 'message_fail_cnt': 0})
+        default_stats = {'message_blackhole_cnt': 0, 'message_sent_cnt': 0, 'message_fail_cnt': 0,
+                         'message_digest_cnt': 0, 'message_dead_letter_cnt': 0, 'message_lease_lost_cnt': 0}
+        default_stats.update(db.default_pool_stats())
+        default_stats.update(messengers.default_stats())
+        metrics.init(config, 'oncall-notifier', default_stats)
         metrics_worker = spawn(metrics_sender)
         metrics_on = True
     else:
         logger.warning('Not running with metrics')
 
-    init_messengers(config.get('messengers', []))
+    flusher_worker = spawn(status_flusher)
 
     worker_tasks = [spawn(worker) for x in range(100)]
-    reminder_on = False
-    if config['reminder']['activated']:
-        reminder_worker = spawn(reminder.reminder, config['reminder'])
-        reminder_on = True
-    validator_on = False
-    if config['user_validator']['activated']:
-        validator_worker = spawn(user_validator.user_validator, config['user_validator'])
-        validator_on = True
+    # any number of notifiers can share the queue, but the reminder and the user validator run on one
+    election = leader.LeaderElection(config['notifier'].get('leader_check_interval', 10))
+    tasks = leader_tasks(config)
+    if tasks:
+        leader_greenlet = spawn(leader_worker, election, tasks)
 
     interval = 60
 
@@ -162,7 +422,9 @@ def main():
     while True:
         runtime = int(time.time())
         logger.info('--> notifier loop started.')
-        poll()
+        # keep claiming as the workers free up room while more messages are due
+        while poll() and time.time() - runtime < interval:
+            sleep(1)
 
         # check status for all background greenlets and respawn if necessary
         bad_workers = []
@@ -172,16 +434,16 @@ def main():
                 bad_workers.append(i)
         for i in bad_workers:
             worker_tasks[i] = spawn(worker)
-        # Check greenlet health for metrics, reminder, and validator tasks
+        if not bool(flusher_worker):
+            logger.error("status flusher failed, %s", flusher_worker.exception)
+            flusher_worker = spawn(status_flusher)
+        # Check greenlet health for metrics and leader tasks
         if metrics_on and not bool(metrics_worker):
             logger.error("metrics worker failed, %s", metrics_worker.exception)
             metrics_worker = spawn(metrics_sender)
-        if reminder_on and not bool(reminder_worker):
-            logger.error("reminder worker failed, %s", reminder_worker.exception)
-            reminder_worker = spawn(reminder.reminder, config['reminder'])
-        if validator_on and not bool(validator_worker):
-            logger.error("user validator failed, %s", validator_worker.exception)
-            validator_worker = spawn(user_validator.user_validator, config['user_validator'])
+        if tasks and not bool(leader_greenlet):
+            logger.error("leader worker failed, %s", leader_greenlet.exception)
+            leader_greenlet = spawn(leader_worker, election, tasks)
 
         now = time.time()
         elapsed_time = now - runtime
@@ -10,9 +10,12 @@ import importlib
 import os
 import logging
 import logging.handlers
+import threading
+import zlib
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from oncall import db, utils
+from oncall import db, metrics, utils
 from oncall.api.v0.schedules import get_schedules
 
 logger = logging.getLogger()
@@ -31,11 +34,114 @@ def load_scheduler(scheduler_name):
     return importlib.import_module('oncall.scheduler.' + scheduler_name).Scheduler()
 
 
+def parse_shard(value):
+    '''
+    Parse a ``i/n`` shard spec into (i, n), with 0 <= i < n.
+    '''
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ValueError('invalid shard %r, expected i/n' % value)
+    if count < 1 or not 0 <= index < count:
+        raise ValueError('invalid shard %r, expected 0 <= i < n' % value)
+    return index, count
+
+
+def in_shard(team, shard):
+    if shard is None:
+        return True
+    index, count = shard
+    return zlib.crc32(str(team['id']).encode('utf-8')) % count == index
+
+
+def get_schedules_by_team(dbinfo):
+    '''
+    Fetch every schedule at once, grouped by team id and then by scheduler name.
+    '''
+    schedules_by_team = defaultdict(lambda: defaultdict(list))
+    for schedule in get_schedules({}, dbinfo=dbinfo):
+        schedules_by_team[schedule['team_id']][schedule['scheduler']['name']].append(schedule)
+    return schedules_by_team
+
+
+class WorkerConnections(object):
+    '''
+    Hands each worker thread its own (connection, cursor), opened on first use.
+    '''
+
+    def __init__(self):
+        self.local = threading.local()
+        self.opened = []
+        self.lock = threading.Lock()
+
+    def get(self):
+        dbinfo = getattr(self.local, 'dbinfo', None)
+        if dbinfo is None:
+            connection = db.connect()
+            dbinfo = self.local.dbinfo = (connection, connection.cursor(db.DictCursor))
+            with self.lock:
+                self.opened.append(dbinfo)
+        return dbinfo
+
+    def close_all(self):
+        with self.lock:
+            for connection, cursor in self.opened:
+                cursor.close()
+                connection.close()
+            self.opened = []
+
+
+def schedule_team(team, schedule_map, schedulers, connections):
+    logger.info('scheduling for team: %s', team['name'])
+    start = time.time()
+    connection, cursor = connections.get()
+    try:
+        for scheduler_name, schedules in schedule_map.items():
+            schedulers[scheduler_name].schedule(team, schedules, (connection, cursor))
+    except Exception:
+        logger.exception('Failed to schedule team %s', team['name'])
+        connection.rollback()
+    return time.time() - start
+
+
+def summarize_cycle(durations, elapsed, slowest=5):
+    '''
+    :param durations: dict mapping team name to the seconds spent scheduling it
+    :param elapsed: wall clock seconds for the whole cycle
+    :return: dict with the team count, teams/sec and the slowest teams
+    '''
+    return {
+        'teams': len(durations),
+        'seconds': elapsed,
+        'teams_per_second': len(durations) / elapsed if elapsed > 0 else 0.0,
+        'slowest': sorted(durations.items(), key=lambda item: item[1], reverse=True)[:slowest],
+    }
+
+
 def main():
+    if len(sys.argv) <= 1:
+        sys.exit('USAGE: %s CONFIG_FILE [--shard i/n]' % sys.argv[0])
     config = utils.read_config(sys.argv[1])
     db.init(config['db'])
 
+    shard = None
+    if '--shard' in sys.argv[2:]:
+        try:
+            shard = parse_shard(sys.argv[sys.argv.index('--shard') + 1])
+        except (IndexError, ValueError) as e:
+            sys.exit('%s: %s' % (sys.argv[0], e))
+        logger.info('Scheduling shard %s of %s', *shard)
+
+    if 'metrics' in config:
+        default_stats = {'scheduled_team_cnt': 0, 'teams_per_second': 0, 'cycle_seconds': 0}
+        default_stats.update(db.default_pool_stats())
+        metrics.init(config, 'oncall-scheduler', default_stats)
+    else:
+        logger.warning('Not running with metrics')
+
     cycle_time = config.get('scheduler_cycle_time', 3600)
+    worker_count = config.get('scheduler_workers', 1)
+    slowest_count = config.get('scheduler_slowest_teams', 5)
     schedulers = {}
 
     while 1:
@@ -54,17 +160,29 @@ def main():
             except (ImportError, AttributeError):
                 logger.exception('Failed to load scheduler %s, skipping', row['name'])
 
-        # Iterate through all teams
+        # Iterate through all teams in this shard
         db_cursor.execute('SELECT id, name, scheduling_timezone FROM team WHERE active = TRUE')
-        teams = db_cursor.fetchall()
-        for team in teams:
-            logger.info('scheduling for team: %s', team['name'])
-            schedule_map = defaultdict(list)
-            for schedule in get_schedules({'team_id': team['id']}):
-                schedule_map[schedule['scheduler']['name']].append(schedule)
-
-            for scheduler_name, schedules in schedule_map.items():
-                schedulers[scheduler_name].schedule(team, schedules, (connection, db_cursor))
+        teams = [team for team in db_cursor.fetchall() if in_shard(team, shard)]
+        schedules_by_team = get_schedules_by_team((connection, db_cursor))
+        connection.commit()
+
+        connections = WorkerConnections()
+        durations = {}
+        with ThreadPoolExecutor(max_workers=worker_count) as executor:
+            futures = {executor.submit(schedule_team, team, schedules_by_team[team['id']], schedulers, connections):
+                       team for team in teams if team['id'] in schedules_by_team}
+            for future in as_completed(futures):
+                durations[futures[future]['name']] = future.result()
+        connections.close_all()
+
+        summary = summarize_cycle(durations, time.time() - start, slowest_count)
+        logger.info('Scheduled %d teams in %.2f seconds (%.2f teams/sec), slowest: %s',
+                    summary['teams'], summary['seconds'], summary['teams_per_second'],
+                    ', '.join('%s (%.2fs)' % item for item in summary['slowest']))
+        metrics.stats['scheduled_team_cnt'] = summary['teams']
+        metrics.stats['teams_per_second'] = summary['teams_per_second']
+        metrics.stats['cycle_seconds'] = summary['seconds']
+        metrics.emit_metrics()
 
         # Sleep until next time
         sleep_time = cycle_time - (time.time() - start)
@@ -0,0 +1,85 @@
+# Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
+# See LICENSE in the project root for license information.
+
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from . import metrics
+
+
+class TTLCache(object):
+    '''
+    In-process LRU cache whose entries also expire ``ttl`` seconds after being set.
+
+    Lookups count ``<name>_cache_hit_cnt`` and ``<name>_cache_miss_cnt`` in ``oncall.metrics.stats``.
+    A ttl of 0 disables the cache: every lookup is a miss and nothing is stored.
+
+    ``generation`` changes on every invalidation. Callers that build a value from the database can read
+    it before querying and pass it to set(), which then skips storing a value an invalidation made stale.
+    '''
+
+    def __init__(self, name, max_size=1024, ttl=60):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hit_stat = '%s_cache_hit_cnt' % name
+        self.miss_stat = '%s_cache_miss_cnt' % name
+        self.data = OrderedDict()
+        self.generation = 0
+        self.lock = Lock()
+
+    def configure(self, max_size=None, ttl=None):
+        with self.lock:
+            if max_size is not None:
+                self.max_size = max_size
+            if ttl is not None:
+                self.ttl = ttl
+            self.data.clear()
+            self.generation += 1
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is not None and entry[0] > now:
+                self.data.move_to_end(key)
+                metrics.stats[self.hit_stat] += 1
+                return entry[1]
+            if entry is not None:
+                del self.data[key]
+        metrics.stats[self.miss_stat] += 1
+        return default
+
+    def set(self, key, value, generation=None):
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.data[key] = (time.time() + self.ttl, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+            self.generation += 1
+
+    def invalidate_where(self, predicate):
+        '''
+        Drop every entry for which predicate(key, value) is true.
+        '''
+        with self.lock:
+            for key in [k for k, (_, v) in self.data.items() if predicate(k, v)]:
+                del self.data[key]
+            self.generation += 1
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.generation += 1
+
+    def __len__(self):
+        return len(self.data)
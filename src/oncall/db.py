@@ -1,29 +1,173 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 import ssl
+import time
 
-connect = None
+from . import metrics
+
+connect_raw = None
 DictCursor = None
 IntegrityError = None
+engine = None
+
+# db.pool config keys and the create_engine arguments they set
+pool_options = {
+    'size': 'pool_size',
+    'max_overflow': 'max_overflow',
+    'timeout': 'pool_timeout',
+    'recycle': 'pool_recycle',
+    'pre_ping': 'pool_pre_ping',
+    'lifo': 'pool_use_lifo',
+}
+
+# upper bounds, in ms, of the pool checkout wait histogram buckets
+wait_buckets = (1, 10, 100, 1000)
+
+
+def default_pool_stats():
+    '''
+    Pool stats reset after every metrics emit, to pass into metrics.init.
+    '''
+    stats = {
+        'db_pool_checkout_cnt': 0,
+        'db_pool_connect_cnt': 0,
+        'db_pool_close_cnt': 0,
+        'db_pool_invalidate_cnt': 0,
+        'db_pool_wait_max_ms': 0,
+        'db_pool_wait_over_%sms_cnt' % wait_buckets[-1]: 0,
+    }
+    for bucket in wait_buckets:
+        stats['db_pool_wait_le_%sms_cnt' % bucket] = 0
+    return stats
+
+
+def record_wait(wait_ms):
+    for bucket in wait_buckets:
+        if wait_ms <= bucket:
+            metrics.stats['db_pool_wait_le_%sms_cnt' % bucket] += 1
+            break
+    else:
+        metrics.stats['db_pool_wait_over_%sms_cnt' % wait_buckets[-1]] += 1
+    metrics.stats['db_pool_wait_max_ms'] = max(metrics.stats['db_pool_wait_max_ms'], int(wait_ms))
+
+
+def collect_pool_stats():
+    '''
+    Sample the pool gauges: connections checked out, idle in the pool, and overflow in use.
+    '''
+    if engine is None:
+        return
+    pool = engine.pool
+    for stat, method in (('db_pool_checked_out', 'checkedout'), ('db_pool_idle', 'checkedin'),
+                         ('db_pool_overflow', 'overflow'), ('db_pool_size', 'size')):
+        if hasattr(pool, method):
+            metrics.stats[stat] = getattr(pool, method)()
+
+
+def timed_checkout():
+    start = time.time()
+    try:
+        return engine.raw_connection()
+    finally:
+        record_wait((time.time() - start) * 1000)
+
+
+class RequestConnection(object):
+    '''
+    Pooled connection shared by the auth checks and the handler of a single request.
+
+    The underlying connection is only checked out of the pool on first use. Handlers keep calling
+    ``close()`` as they always have; that is a no-op here, and the connection is committed or rolled
+    back and returned to the pool exactly once by ``release()`` (see DBConnectionMiddleware).
+    '''
+
+    def __init__(self):
+        self.connection = None
+
+    def checkout(self):
+        if self.connection is None:
+            self.connection = connect_raw()
+        return self.connection
+
+    def cursor(self, *args, **kwargs):
+        return self.checkout().cursor(*args, **kwargs)
+
+    def commit(self):
+        if self.connection is not None:
+            self.connection.commit()
+
+    def rollback(self):
+        if self.connection is not None:
+            self.connection.rollback()
+
+    def close(self):
+        pass
+
+    def release(self, commit):
+        if self.connection is None:
+            return
+        try:
+            if commit:
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+        finally:
+            self.connection.close()
+            self.connection = None
+
+    def __getattr__(self, name):
+        return getattr(self.checkout(), name)
+
+
+def connect(req=None):
+    '''
+    Get a DB connection. If req carries a request-scoped connection, that one is returned
+    so that every query made while serving the request shares a single pool checkout.
+    '''
+    if req is not None:
+        connection = req.context.get('db_connection')
+        if connection is not None:
+            return connection
+    return connect_raw()
+
+
+def count(stat):
+    def listener(*args):
+        metrics.stats[stat] += 1
+    return listener
 
 
 def init(config):
-    global connect
+    '''
+    Create the engine and its connection pool. Pool settings come from the optional ``pool`` section
+    (see pool_options); anything in ``kwargs`` is passed to create_engine as is and takes precedence.
+    '''
+    global connect_raw
     global DictCursor
     global IntegrityError
+    global engine
 
     connect_args = {}
     if config['conn'].get('use_ssl'):
         ssl_ctx = ssl.create_default_context()
         connect_args["ssl"] = ssl_ctx
 
+    engine_kwargs = {pool_options[key]: value for key, value in config.get('pool', {}).items()
+                     if key in pool_options}
+    engine_kwargs.update(config.get('kwargs', {}))
     engine = create_engine(
         config['conn']['str'] % config['conn']['kwargs'],
         connect_args=connect_args,
-        **config['kwargs']
+        **engine_kwargs
     )
+    event.listen(engine.pool, 'checkout', count('db_pool_checkout_cnt'))
+    event.listen(engine.pool, 'connect', count('db_pool_connect_cnt'))
+    # closes include recycled connections and overflow connections discarded on checkin
+    event.listen(engine.pool, 'close', count('db_pool_close_cnt'))
+    event.listen(engine.pool, 'invalidate', count('db_pool_invalidate_cnt'))
+    metrics.register_collector(collect_pool_stats)
 
     dbapi = engine.dialect.dbapi
     IntegrityError = dbapi.IntegrityError
 
     DictCursor = dbapi.cursors.DictCursor
-    connect = engine.raw_connection
+    connect_raw = timed_checkout
@@ -26,7 +26,7 @@ class HealthCheck(object):
             status = self.dummy_status
         else:
             try:
-                connection = db.connect()
+                connection = db.connect(req)
                 cursor = connection.cursor()
                 cursor.execute("SELECT VERSION();")
                 cursor.close()
@@ -4,15 +4,198 @@
 from collections import defaultdict
 import logging
 import importlib
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from gevent import sleep
+from gevent.lock import BoundedSemaphore
+
+from oncall import metrics
 
 logger = logging.getLogger()
 _active_messengers = defaultdict(list)
+_guards = []
 
 
 class OncallMessengerException(Exception):
     pass
 
 
+class MessengerUnavailable(OncallMessengerException):
+    pass
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    '''
+    HTTPAdapter applying a default timeout to requests that do not set one.
+    '''
+
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        super(TimeoutHTTPAdapter, self).__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super(TimeoutHTTPAdapter, self).send(request, **kwargs)
+
+
+def http_session(config, session=None):
+    '''
+    Set up a requests session for a messenger: connections are kept alive and pooled, up to
+    config['pool_size'] (default 20) per host, and requests time out after config['timeout'] seconds
+    (default 10; may also be a [connect, read] pair).
+
+    :param session: session to configure, such as a client library's Session subclass; a new one by default
+    '''
+    if session is None:
+        session = requests.Session()
+    timeout = config.get('timeout', 10)
+    if isinstance(timeout, list):
+        timeout = tuple(timeout)
+    pool_size = config.get('pool_size', 20)
+    adapter = TimeoutHTTPAdapter(timeout=timeout, pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class TokenBucket(object):
+    '''
+    Allows ``rate`` sends per second on average, and bursts of up to ``burst`` sends.
+    '''
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self.tokens = self.burst
+        self.updated = time.time()
+
+    def reserve(self):
+        '''
+        Take a token, going into debt if there is none left.
+
+        :return: seconds to wait before using the token
+        '''
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self):
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+class MessengerGuard(object):
+    '''
+    Wraps a messenger instance to cap its concurrent sends and its send rate, and to stop using it
+    for breaker_cooldown seconds after breaker_threshold consecutive failures (after which a single
+    trial send decides whether it is used again). Sends that would wait more than max_wait seconds
+    for a slot or for the rate limit, and sends while the breaker is open, raise MessengerUnavailable
+    so that send_message moves on to the next messenger for the mode.
+
+    Optional settings, in the messenger's config: name (defaults to the type), max_concurrency,
+    rate (sends per second), burst, max_wait, breaker_threshold and breaker_cooldown.
+    '''
+
+    def __init__(self, messenger, config):
+        self.messenger = messenger
+        self.name = config.get('name', config['type'])
+        self.supports = messenger.supports
+        max_concurrency = config.get('max_concurrency')
+        self.slots = BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self.bucket = TokenBucket(config['rate'], config.get('burst')) if config.get('rate') else None
+        self.max_wait = config.get('max_wait', 10)
+        self.breaker_threshold = config.get('breaker_threshold', 5)
+        self.breaker_cooldown = config.get('breaker_cooldown', 30)
+        self.failures = 0
+        self.open_until = 0
+        self.trial = False
+
+    def stat(self, name):
+        return 'messenger_%s_%s' % (self.name, name)
+
+    def default_stats(self):
+        return {self.stat(name): 0 for name in ('sent_cnt', 'fail_cnt', 'skip_cnt', 'latency_total_ms',
+                                                'latency_max_ms')}
+
+    def collect_stats(self):
+        metrics.stats[self.stat('breaker_open')] = int(self.open_until > time.time())
+
+    def check_breaker(self):
+        '''
+        :return: whether a send may go through
+        '''
+        if self.failures < self.breaker_threshold:
+            return True
+        if time.time() < self.open_until or self.trial:
+            return False
+        # cooldown over: let one send through to see whether the messenger recovered
+        self.trial = True
+        return True
+
+    def record(self, success, latency_ms):
+        self.trial = False
+        if success:
+            self.failures = 0
+            metrics.stats[self.stat('sent_cnt')] += 1
+            metrics.stats[self.stat('latency_total_ms')] += int(latency_ms)
+            metrics.stats[self.stat('latency_max_ms')] = max(metrics.stats[self.stat('latency_max_ms')],
+                                                             int(latency_ms))
+        else:
+            self.failures += 1
+            metrics.stats[self.stat('fail_cnt')] += 1
+            if self.failures >= self.breaker_threshold:
+                if time.time() >= self.open_until:
+                    logger.warning('Opening circuit breaker for messenger %s after %s failures',
+                                   self.name, self.failures)
+                self.open_until = time.time() + self.breaker_cooldown
+
+    def skip(self, reason):
+        metrics.stats[self.stat('skip_cnt')] += 1
+        raise MessengerUnavailable('%s for messenger %s' % (reason, self.name))
+
+    def send(self, message):
+        if self.slots is not None and not self.slots.acquire(timeout=self.max_wait):
+            self.skip('Concurrency limit reached')
+        try:
+            if self.bucket is not None:
+                wait = self.bucket.reserve()
+                if wait > self.max_wait:
+                    self.bucket.refund()
+                    self.skip('Rate limit reached')
+                sleep(wait)
+            if not self.check_breaker():
+                if self.bucket is not None:
+                    self.bucket.refund()
+                self.skip('Circuit breaker open')
+            start = time.time()
+            try:
+                result = self.messenger.send(message)
+            except Exception:
+                self.record(False, 0)
+                raise
+            self.record(True, (time.time() - start) * 1000)
+            return result
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+
+    def __repr__(self):
+        return '<%s %r>' % (self.name, self.messenger)
+
+
+def default_stats():
+    '''
+    Messenger stats reset after every metrics emit, to pass into metrics.init after init_messengers.
+    '''
+    stats = {}
+    for guard in _guards:
+        stats.update(guard.default_stats())
+    return stats
+
+
 def init_messengers(messengers):
     for messenger in messengers:
         if '.' in messenger['type']:
@@ -22,8 +205,11 @@ def init_messengers(messengers):
             module_path = 'oncall.messengers.' + messenger['type']
 
         instance = getattr(importlib.import_module(module_path), messenger['type'])(messenger)
+        guard = MessengerGuard(instance, messenger)
+        _guards.append(guard)
+        metrics.register_collector(guard.collect_stats)
         for transport in instance.supports:
-            _active_messengers[transport].append(instance)
+            _active_messengers[transport].append(guard)
 
 
 def send_message(message):
@@ -31,6 +217,9 @@ def send_message(message):
         logger.debug('Attempting %s send using messenger %s', message['mode'], messenger)
         try:
             return messenger.send(message)
+        except MessengerUnavailable as e:
+            logger.warning('Skipping messenger %s: %s', messenger, e)
+            continue
         except Exception:
             logger.exception('Sending %s with messenger %s failed', message, messenger)
             continue
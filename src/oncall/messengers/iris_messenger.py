@@ -4,13 +4,15 @@
 
 from oncall.constants import EMAIL_SUPPORT, SMS_SUPPORT, CALL_SUPPORT, SLACK_SUPPORT
 from irisclient import IrisClient
+from oncall.messengers import http_session
 
 
 class iris_messenger(object):
     supports = frozenset([EMAIL_SUPPORT, SMS_SUPPORT, CALL_SUPPORT, SLACK_SUPPORT])
 
     def __init__(self, config):
-        self.iris_client = IrisClient(config['application'], config['iris_api_key'], config['api_host'])
+        self.iris_client = http_session(config, IrisClient(config['application'], config['iris_api_key'],
+                                                           config['api_host']))
 
     def send(self, message):
         try:
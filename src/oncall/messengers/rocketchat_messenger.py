@@ -1,7 +1,7 @@
-import requests
-import time
+from gevent.lock import RLock
 from oncall.constants import ROCKET_SUPPORT
 from oncall import db
+from oncall.messengers import http_session
 
 
 class rocketchat_messenger(object):
@@ -11,25 +11,36 @@ class rocketchat_messenger(object):
         self.user = config['user']
         self.password = config['password']
         self.api_host = config['api_host']
-        self.refresh = config.get('refresh', 2592000)  # default 30 days
-        self.last_auth = None
+        self.session = http_session(config)
+        # the auth token is kept until the server rejects it; the 'refresh' setting is no longer used
+        self.auth_lock = RLock()
         self.token = None
         self.user_id = None
         self.authenticate()
 
     def authenticate(self):
-        self.last_auth = time.time()
-        re = requests.post(self.api_host + '/api/v1/login',
-                           json={'username': self.user, 'password': self.password})
+        re = self.session.post(self.api_host + '/api/v1/login',
+                               json={'username': self.user, 'password': self.password})
         data = re.json()
         if re.status_code != 200 or data['status'] != 'success':
             raise ValueError('Invalid RocketChat credentials')
         self.token = data['data']['authToken']
         self.user_id = data['data']['userId']
 
+    def post_message(self, payload):
+        token = self.token
+        re = self.session.post(self.api_host + '/api/v1/chat.postMessage', json=payload,
+                               headers={'X-User-Id': self.user_id, 'X-Auth-Token': token})
+        if re.status_code == 401:
+            with self.auth_lock:
+                # log in again only if no other send did meanwhile
+                if self.token == token:
+                    self.authenticate()
+            re = self.session.post(self.api_host + '/api/v1/chat.postMessage', json=payload,
+                                   headers={'X-User-Id': self.user_id, 'X-Auth-Token': self.token})
+        return re
+
     def send(self, message):
-        if time.time() - self.last_auth > self.refresh:
-            self.authenticate()
         connection = db.connect()
         cursor = connection.cursor()
         try:
@@ -43,10 +54,7 @@ class rocketchat_messenger(object):
         finally:
             cursor.close()
             connection.close()
-        re = requests.post(self.api_host + '/api/v1/chat.postMessage',
-                           json={'channel': '@%s' % target,
-                                 'text': ' -- '.join([message['subject'], message['body']])},
-                           headers={'X-User-Id': self.user_id,
-                                    'X-Auth-Token': self.token})
+        re = self.post_message({'channel': '@%s' % target,
+                                'text': ' -- '.join([message['subject'], message['body']])})
         if re.status_code != 200 or not re.json()['success']:
             raise ValueError('Failed to contact rocketchat')
@@ -1,6 +1,7 @@
 import pymsteams
 import logging
 from oncall.constants import TEAMS_SUPPORT
+from oncall.messengers import http_session
 
 
 class teams_messenger(object):
@@ -8,6 +9,7 @@ class teams_messenger(object):
 
     def __init__(self, config):
         self.webhook = config['webhook']
+        self.session = http_session(config)
 
     def send(self, message):
         heading = message.get("subject")
@@ -17,6 +19,10 @@ class teams_messenger(object):
             myTeamsMessage = pymsteams.connectorcard(self.webhook)
             myTeamsMessage.title(str(heading))
             myTeamsMessage.text(str(final_message))
-            myTeamsMessage.send()
-        except:
-            logging.info("An issue occured while sending message to teams messenger")
+            # posted through the pooled session rather than connectorcard.send(), which opens a new connection
+            re = self.session.post(self.webhook, json=myTeamsMessage.payload)
+            re.raise_for_status()
+        except Exception:
+            # raised so that send_message fails over to the next messenger, and the guard counts the failure
+            logging.exception("An issue occured while sending message to teams messenger")
+            raise
@@ -7,6 +7,9 @@
 from oncall.utils import import_custom_module
 from collections import defaultdict
 import logging
+import os
+import threading
+import time
 logger = logging.getLogger(__name__)
 
 stats_reset = {}
@@ -16,13 +19,30 @@ stats = defaultdict(int)
 
 metrics_provider = None
 
+# callables run before each emit, to sample gauges into stats
+collectors = []
+
+# pid of the process whose sender thread is running
+sender_pid = None
+sender_lock = threading.Lock()
+
 
 def get_metrics_provider(config, app_name):
     return import_custom_module('oncall.metrics',
                                 config['metrics'])(config, app_name)
 
 
+def register_collector(collector):
+    if collector not in collectors:
+        collectors.append(collector)
+
+
 def emit_metrics():
+    for collector in collectors:
+        try:
+            collector()
+        except Exception:
+            logger.exception('Metrics collector %s failed', collector)
     if metrics_provider:
         metrics_provider.send_metrics(stats)
     stats.update(stats_reset)
@@ -34,3 +54,28 @@ def init(config, app_name, default_stats):
     logger.info('Loaded metrics handler %s', config['metrics'])
     stats_reset.update(default_stats)
     stats.update(stats_reset)
+
+
+def start_sender(interval=60):
+    '''
+    Emit metrics every ``interval`` seconds from a daemon thread, for processes that don't run their own
+    gevent sender loop. At most one sender is started per process; since threads do not survive a fork,
+    preforked workers must call this themselves, after the fork.
+    '''
+    global sender_pid
+    pid = os.getpid()
+    if sender_pid == pid:
+        return
+    with sender_lock:
+        if sender_pid == pid:
+            return
+        sender_pid = pid
+
+    def sender():
+        while True:
+            time.sleep(interval)
+            emit_metrics()
+
+    thread = threading.Thread(target=sender, name='metrics-sender', daemon=True)
+    thread.start()
+    return thread
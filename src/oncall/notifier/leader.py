@@ -0,0 +1,69 @@
+import logging
+
+from oncall import db
+
+logger = logging.getLogger(__name__)
+
+LOCK_NAME = 'oncall-notifier-leader'
+
+
+class LeaderElection(object):
+    '''
+    Elects one leader among the notifier instances with a MySQL named lock (GET_LOCK).
+
+    The lock belongs to the database session of the leader, which keeps the connection it was taken
+    with checked out. It is released when that process or connection dies, and the first instance to
+    call check() afterwards takes over.
+    '''
+
+    def __init__(self, check_interval=10, lock_name=LOCK_NAME):
+        self.check_interval = check_interval
+        self.lock_name = lock_name
+        self.connection = None
+
+    @property
+    def is_leader(self):
+        return self.connection is not None
+
+    def check(self):
+        '''
+        Try to take the leadership, or make sure this instance still holds it.
+
+        :return: whether this instance is the leader
+        '''
+        if self.connection is None:
+            connection = db.connect()
+            try:
+                cursor = connection.cursor()
+                cursor.execute('SELECT GET_LOCK(%s, 0)', self.lock_name)
+                acquired = cursor.fetchone()[0] == 1
+                cursor.close()
+            except Exception:
+                logger.exception('Failed to acquire notifier leader lock')
+                connection.invalidate()
+                return False
+            if acquired:
+                logger.info('Became notifier leader')
+                self.connection = connection
+            else:
+                connection.close()
+        else:
+            try:
+                cursor = self.connection.cursor()
+                cursor.execute('SELECT IS_USED_LOCK(%s) = CONNECTION_ID()', self.lock_name)
+                held = cursor.fetchone()[0] == 1
+                cursor.close()
+            except Exception:
+                logger.exception('Failed to check notifier leader lock')
+                held = False
+            if not held:
+                logger.warning('Lost notifier leadership')
+                self.resign()
+        return self.is_leader
+
+    def resign(self):
+        if self.connection is None:
+            return
+        # dropping the session releases the lock, whether or not the connection still works
+        self.connection.invalidate()
+        self.connection = None
@@ -0,0 +1,115 @@
+import logging
+import time
+
+from gevent.lock import BoundedSemaphore
+
+from oncall import db
+
+logger = logging.getLogger(__name__)
+
+# seconds between reloads of the notification types and contact modes
+refresh_interval = 300
+# minimum seconds between reloads caused by lookups of unknown ids or names
+miss_reload_interval = 10
+
+# templates by notification type id, type ids by name, mode names by id and mode ids by name
+tables = {'types': {}, 'type_ids': {}, 'modes': {}, 'mode_ids': {}}
+loaded_at = 0
+# held by the greenlet reloading the tables
+load_lock = BoundedSemaphore()
+
+
+class ProbeContext(dict):
+    '''
+    Supplies a value for any key, to check that a template is well formed without a real context.
+    '''
+
+    def __missing__(self, key):
+        return 0
+
+
+class NotificationTemplate(object):
+    '''
+    Subject and body of a notification type, %-formatted with the context of each message. Templates
+    are checked once when loaded; error is set, and render() raises, if they are malformed.
+    '''
+
+    def __init__(self, name, subject, body):
+        self.name = name
+        self.subject = subject
+        self.body = body
+        self.error = None
+        try:
+            subject % ProbeContext()
+            body % ProbeContext()
+        except (ValueError, TypeError) as e:
+            self.error = 'Malformed %s template: %s' % (name, e)
+            logger.error(self.error)
+
+    def render(self, context):
+        if self.error:
+            raise ValueError(self.error)
+        return self.subject % context, self.body % context
+
+
+def load():
+    global loaded_at
+    connection = db.connect()
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SELECT `id`, `name`, `subject`, `body` FROM `notification_type`')
+        types = {row[0]: NotificationTemplate(row[1], row[2], row[3]) for row in cursor}
+        cursor.execute('SELECT `id`, `name` FROM `contact_mode`')
+        modes = dict(cursor)
+    finally:
+        cursor.close()
+        connection.close()
+    tables['types'] = types
+    tables['type_ids'] = {template.name: type_id for type_id, template in types.items()}
+    tables['modes'] = modes
+    tables['mode_ids'] = {name: mode_id for mode_id, name in modes.items()}
+    loaded_at = time.time()
+
+
+def reload_due(table, key):
+    age = time.time() - loaded_at
+    return age > refresh_interval or (key not in tables[table] and age > miss_reload_interval)
+
+
+def lookup(table, key):
+    '''
+    Look key up in the named table, reloading the registry first if it is due for a refresh, or
+    if it does not know the key and was not reloaded in the last miss_reload_interval seconds.
+
+    Only one greenlet reloads at a time. While it does, lookups of known keys are answered from
+    the current tables, and lookups of unknown keys wait for it and then check again.
+    '''
+    if not reload_due(table, key):
+        return tables[table].get(key)
+    if key in tables[table]:
+        if load_lock.acquire(blocking=False):
+            try:
+                load()
+            finally:
+                load_lock.release()
+    else:
+        with load_lock:
+            if reload_due(table, key):
+                load()
+    return tables[table].get(key)
+
+
+def get_template(type_id):
+    return lookup('types', type_id)
+
+
+def get_mode(mode_id):
+    return lookup('modes', mode_id)
+
+
+def get_type_id(name):
+    return lookup('type_ids', name)
+
+
+def get_mode_id(name):
+    return lookup('mode_ids', name)
@@ -5,6 +5,7 @@ from ujson import dumps as json_dumps
 from datetime import datetime
 from pytz import timezone
 from oncall import db, constants
+from oncall.notifier import registry
 
 logger = logging.getLogger(__name__)
 
@@ -13,39 +14,44 @@ DAY = HOUR * 24
 WEEK = DAY * 7
 
 
+# rows per INSERT, to keep statements well under max_allowed_packet after a large populate
+insert_batch_size = 1000
+
+
+def create_reminders(reminders, cursor):
+    '''
+    Queue reminders with one multi-row INSERT per insert_batch_size rows.
+
+    :param reminders: list of (user_id, mode, send_time, context, type_name)
+    '''
+    for i in range(0, len(reminders), insert_batch_size):
+        query_vals = []
+        query_params = []
+        for user_id, mode, send_time, context, type_name in reminders[i:i + insert_batch_size]:
+            query_vals.append('(%s, %s, %s, 1, %s, %s)')
+            query_params += [user_id, send_time, registry.get_mode_id(mode), json_dumps(context),
+                             registry.get_type_id(type_name)]
+        cursor.execute('''INSERT INTO `notification_queue`(`user_id`, `send_time`, `mode_id`, `active`, `context`,
+                                                           `type_id`)
+                          VALUES %s''' % ', '.join(query_vals), query_params)
+
+
 def create_reminder(user_id, mode, send_time, context, type_name, cursor):
-    context = json_dumps(context)
-    cursor.execute('''INSERT INTO `notification_queue`(`user_id`, `send_time`, `mode_id`, `active`, `context`, `type_id`)
-                      VALUES (%s,
-                              %s,
-                              (SELECT `id` FROM `contact_mode` WHERE `name` = %s),
-                              1,
-                              %s,
-                              (SELECT `id` FROM `notification_type` WHERE `name` = %s))''',
-                   (user_id, send_time, mode, context, type_name))
-
-
-def check_user_contact_info(user_id, cursor):
-    """Check if user has complete contact information (phone number for SMS/call)"""
-    # Check if user has SMS contact info
-    cursor.execute('''SELECT destination FROM user_contact
-                      WHERE user_id = %s AND mode_id = (SELECT id FROM contact_mode WHERE name = 'sms')''',
-                   (user_id,))
-    sms_contact = cursor.fetchone()
-
-    # Check if user has call contact info
-    cursor.execute('''SELECT destination FROM user_contact
-                      WHERE user_id = %s AND mode_id = (SELECT id FROM contact_mode WHERE name = 'call')''',
-                   (user_id,))
-    call_contact = cursor.fetchone()
-
-    missing_contacts = []
-    if not sms_contact:
-        missing_contacts.append('SMS Number')
-    if not call_contact:
-        missing_contacts.append('Call Number')
-
-    return missing_contacts
+    create_reminders([(user_id, mode, send_time, context, type_name)], cursor)
+
+
+def get_missing_contacts(user_ids, cursor):
+    """Find which users lack contact information (phone number for SMS/call), in one query"""
+    required = [('SMS Number', registry.get_mode_id('sms')), ('Call Number', registry.get_mode_id('call'))]
+    present = set()
+    if user_ids:
+        cursor.execute('''SELECT `user_id`, `mode_id` FROM `user_contact`
+                          WHERE `user_id` IN %s AND `mode_id` IN %s
+                          GROUP BY `user_id`, `mode_id`''',
+                       (list(user_ids), [mode_id for _, mode_id in required]))
+        present = {(row['user_id'], row['mode_id']) for row in cursor}
+    return {user_id: [label for label, mode_id in required if (user_id, mode_id) not in present]
+            for user_id in user_ids}
 
 
 def timestamp_to_human_str(timestamp, tz):
@@ -62,6 +68,62 @@ def sec_to_human_str(seconds):
         return '%d hours' % (seconds / HOUR)
 
 
+def create_window_reminders(window_start, window_end, default_timezone, cursor):
+    '''
+    Queue the reminders due in [window_start, window_end): one per notification setting and the
+    first event of each linked event group (or unlinked event) starting time_before after that.
+
+    :return: number of reminders created
+    '''
+    # an event is the first of its link if none starts before it, found with the (link_id, start) index
+    query = '''
+        SELECT `user`.`name`, `user`.`id` AS `user_id`, `time_before`, `contact_mode`.`name` AS `mode`,
+               `team`.`name` AS `team`, `event`.`start`, `event`.`id`, `role`.`name` AS `role`, `user`.`time_zone`
+        FROM `user` JOIN `notification_setting` ON `notification_setting`.`user_id` = `user`.`id`
+                AND `notification_setting`.`type_id` = %s
+            JOIN `setting_role` ON `notification_setting`.`id` = `setting_role`.`setting_id`
+            JOIN `event` ON `event`.`start` >= `time_before` + %s AND `event`.`start` < `time_before` + %s
+              AND `event`.`user_id` = `user`.`id`
+              AND `event`.`role_id` = `setting_role`.`role_id`
+              AND `event`.`team_id` = `notification_setting`.`team_id`
+            JOIN `contact_mode` ON `notification_setting`.`mode_id` = `contact_mode`.`id`
+            JOIN `team` ON `event`.`team_id` = `team`.`id`
+            JOIN `role` ON `event`.`role_id` = `role`.`id`
+            WHERE `user`.`active` = 1
+              AND (`event`.`link_id` IS NULL
+                   OR NOT EXISTS (SELECT 1 FROM `event` AS `e`
+                                  WHERE `e`.`link_id` = `event`.`link_id` AND `e`.`start` < `event`.`start`))
+    '''
+    cursor.execute(query, (registry.get_type_id(constants.ONCALL_REMINDER), window_start, window_end))
+    notifications = cursor.fetchall()
+    missing = get_missing_contacts({row['user_id'] for row in notifications}, cursor)
+
+    reminders = []
+    for row in notifications:
+        context = {'team': row['team'],
+                   'start_time': timestamp_to_human_str(row['start'],
+                                                        row['time_zone'] if row['time_zone'] else default_timezone),
+                   'time_before': sec_to_human_str(row['time_before']),
+                   'role': row['role']}
+
+        # Add contact update message if missing contact info
+        missing_contacts = missing[row['user_id']]
+        if missing_contacts:
+            contact_warning = (
+                f"\n\nIMPORTANT: Your contact information is incomplete. "
+                f"Please update your {', '.join(missing_contacts)} in your profile "
+                f"ASAP to ensure you receive critical notifications."
+            )
+            context['contact_warning'] = contact_warning
+            logger.warning('User %s has missing contact information: %s', row['name'], ', '.join(missing_contacts))
+
+        reminders.append((row['user_id'], row['mode'], row['start'] - row['time_before'], context, 'oncall_reminder'))
+        logger.info('Created reminder with context %s for %s', context, row['name'])
+
+    create_reminders(reminders, cursor)
+    return len(reminders)
+
+
 def reminder(config):
     interval = config['polling_interval']
     default_timezone = config['default_timezone']
@@ -79,24 +141,6 @@ def reminder(config):
     cursor.close()
     connection.close()
 
-    query = '''
-        SELECT `user`.`name`, `user`.`id` AS `user_id`, `time_before`, `contact_mode`.`name` AS `mode`,
-               `team`.`name` AS `team`, `event`.`start`, `event`.`id`, `role`.`name` AS `role`, `user`.`time_zone`
-        FROM `user` JOIN `notification_setting` ON `notification_setting`.`user_id` = `user`.`id`
-                AND `notification_setting`.`type_id` = (SELECT `id` FROM `notification_type`
-                                                                  WHERE `name` = %s)
-            JOIN `setting_role` ON `notification_setting`.`id` = `setting_role`.`setting_id`
-            JOIN `event` ON `event`.`start` >= `time_before` + %s AND `event`.`start` < `time_before` + %s
-              AND `event`.`user_id` = `user`.`id`
-              AND `event`.`role_id` = `setting_role`.`role_id`
-              AND `event`.`team_id` = `notification_setting`.`team_id`
-            JOIN `contact_mode` ON `notification_setting`.`mode_id` = `contact_mode`.`id`
-            JOIN `team` ON `event`.`team_id` = `team`.`id`
-            JOIN `role` ON `event`.`role_id` = `role`.`id`
-            LEFT JOIN `event` AS `e` ON `event`.`link_id` = `e`.`link_id` AND `e`.`start` < `event`.`start`
-            WHERE `e`.`id` IS NULL AND `user`.`active` = 1
-    '''
-
     while (1):
         logger.info('Reminder polling loop started')
         window_end = int(time.time())
@@ -104,33 +148,7 @@ def reminder(config):
         connection = db.connect()
         cursor = connection.cursor(db.DictCursor)
 
-        cursor.execute(query, (constants.ONCALL_REMINDER, window_start, window_end))
-        notifications = cursor.fetchall()
-
-        for row in notifications:
-            # Check if user has missing contact information
-            missing_contacts = check_user_contact_info(row['user_id'], cursor)
-
-            context = {'team': row['team'],
-                       'start_time': timestamp_to_human_str(row['start'],
-                                                            row['time_zone'] if row['time_zone'] else default_timezone),
-                       'time_before': sec_to_human_str(row['time_before']),
-                       'role': row['role']}
-
-            # Add contact update message if missing contact info
-            if missing_contacts:
-                contact_warning = (
-                    f"\n\nIMPORTANT: Your contact information is incomplete. "
-                    f"Please update your {', '.join(missing_contacts)} in your profile "
-                    f"ASAP to ensure you receive critical notifications."
-                )
-                context['contact_warning'] = contact_warning
-                logger.warning('User %s has missing contact information: %s', row['name'], ', '.join(missing_contacts))
-
-            create_reminder(row['user_id'], row['mode'], row['start'] - row['time_before'],
-                            context, 'oncall_reminder', cursor)
-            logger.info('Created reminder with context %s for %s', context, row['name'])
-
+        create_window_reminders(window_start, window_end, default_timezone, cursor)
         cursor.execute('UPDATE `notifier_state` SET `last_window_end` = %s', window_end)
         connection.commit()
         logger.info('Created reminders for window [%s, %s), sleeping for %s s', window_start, window_end, interval)
@@ -1,13 +1,14 @@
 from datetime import datetime, timedelta
 from pytz import timezone, utc
-from oncall.utils import gen_link_id, create_notification, read_config
+from oncall.utils import gen_link_id, create_notifications
+from oncall import settings
 from ..constants import EVENT_CREATED
 from falcon import HTTPBadRequest
 from ujson import dumps as json_dumps
 import time
-import sys
 import logging
 import operator
+from bisect import bisect_left, bisect_right, insort
 
 logger = logging.getLogger()
 
@@ -15,29 +16,163 @@ UNIX_EPOCH = datetime(1970, 1, 1, tzinfo=utc)
 SECONDS_IN_A_DAY = 24 * 60 * 60
 SECONDS_IN_A_WEEK = SECONDS_IN_A_DAY * 7
 
-columns = {
-    'id': '`temp_event`.`id` as `id`',
-    'start': '`temp_event`.`start` as `start`',
-    'end': '`temp_event`.`end` as `end`',
-    'role': '`role`.`name` as `role`',
-    'team': '`team`.`name` as `team`',
-    'user': '`user`.`name` as `user`',
-    'full_name': '`user`.`full_name` as `full_name`',
-    'schedule_id': '`temp_event`.`schedule_id`',
-    'link_id': '`temp_event`.`link_id`',
-    'note': '`temp_event`.`note`',
-}
-
-constraints = {
-    'start__lt': '`temp_event`.`start` < %s',
-    'end__ge': '`temp_event`.`end` >= %s',
-    'team__eq': '`team`.`name` = %s',
-}
+# Event fields returned by a preview, in response order
+preview_fields = ('id', 'start', 'end', 'role', 'team', 'user', 'full_name', 'schedule_id', 'link_id', 'note')
+
+
+class EventIndex(object):
+    '''
+    In-memory copy of the events that decide who gets scheduled next on one team, so that
+    Scheduler.schedule() can pick users for every epoch without going back to the database.
+
+    * busy: per user, sorted (start, end) intervals that conflict with new shifts on this team: the
+      team's own events, events of subscribed (team, role) pairs and vacations, or every event of the
+      user when busy_across_teams is set. Only events ending after the first epoch are kept.
+    * history: per (role, user), sorted end times of the user's events for that role on this team.
+    '''
+
+    def __init__(self, team_id, subscriptions=(), vacation_role_id=None, across_teams=False):
+        self.team_id = team_id
+        self.subscriptions = set(subscriptions)
+        self.vacation_role_id = vacation_role_id
+        self.across_teams = across_teams
+        self.roster_users = {}
+        self.busy = {}
+        self.history = {}
+
+    def is_conflicting(self, team_id, role_id):
+        return (self.across_teams or team_id == self.team_id or (team_id, role_id) in self.subscriptions
+                or role_id == self.vacation_role_id)
+
+    def add_busy(self, user_id, start, end):
+        insort(self.busy.setdefault(user_id, []), (start, end))
+
+    def add_history(self, user_id, role_id, end):
+        insort(self.history.setdefault((role_id, user_id), []), end)
+
+    def add_events(self, user_id, team_id, role_id, events):
+        for event in events:
+            if self.is_conflicting(team_id, role_id):
+                self.add_busy(user_id, event['start'], event['end'])
+            if team_id == self.team_id:
+                self.add_history(user_id, role_id, event['end'])
+
+    def is_busy(self, user_id, events):
+        intervals = self.busy.get(user_id)
+        if not intervals:
+            return False
+        for event in events:
+            # intervals starting before the event ends, checked for ending after it starts
+            idx = bisect_left(intervals, (event['end'],))
+            if any(end > event['start'] for _, end in intervals[:idx]):
+                return True
+        return False
+
+    def last_end(self, user_id, role_id, before):
+        '''
+        End of the user's last event for this role and team ending at or before ``before``, or None.
+        '''
+        ends = self.history.get((role_id, user_id))
+        if not ends:
+            return None
+        idx = bisect_right(ends, before)
+        return ends[idx - 1] if idx else None
+
+
+class MemoryEventStore(object):
+    '''
+    In-memory event storage for running a schedule without writing to the database, as the preview
+    endpoint does. It holds a copy of the events relevant to one schedule plus the roster data the
+    schedulers read, and answers the same questions as the event table.
+
+    :param events: event dicts with the event table columns plus the ``team``, ``role``, ``user`` and
+        ``full_name`` names
+    :param roster: list of dicts with ``user_id``, ``name``, ``full_name``, ``in_rotation`` and ``active``
+        for the schedule's roster
+    :param schedule_order: user ids of the schedule's round-robin order
+    :param subscriptions: dict mapping team id to (subscription_id, role_id) pairs
+    :param team_ids: dict mapping team name to id, for the teams in subscriptions
+    '''
+
+    def __init__(self, events, roster=(), schedule_order=(), subscriptions=None, team_ids=None,
+                 vacation_role_id=None):
+        self.events = list(events)
+        self.roster = {row['user_id']: row for row in roster}
+        self.schedule_order = list(schedule_order)
+        self.subscriptions = subscriptions or {}
+        self.team_ids = team_ids or {}
+        self.vacation_role_id = vacation_role_id
+        self.last_scheduled_user_ids = {}
+
+    def roster_user_ids(self, active_only=True):
+        return {user_id for user_id, row in self.roster.items()
+                if row['in_rotation'] and (row['active'] or not active_only)}
+
+    def delete_events(self, schedule_id, start):
+        self.events = [ev for ev in self.events if not (ev['schedule_id'] == schedule_id and ev['start'] >= start)]
+
+    def count_matching(self, events, role_id, team_id):
+        '''
+        Number of stored events matching the start, end, role and team of any of the given events.
+        '''
+        keys = {(ev['start'], ev['end']) for ev in events}
+        return sum(1 for ev in self.events
+                   if (ev['start'], ev['end']) in keys and ev['role_id'] == role_id and ev['team_id'] == team_id)
+
+    def insert_events(self, team_id, team, schedule_id, user_id, events, role_id, role):
+        link_id = gen_link_id() if len(events) > 1 else None
+        user = self.roster[user_id]
+        for event in events:
+            # new events have no id, as they had none in the temporary table previews used to run against
+            self.events.append({
+                'id': 0, 'team_id': team_id, 'role_id': role_id, 'schedule_id': schedule_id, 'link_id': link_id,
+                'user_id': user_id, 'start': event['start'], 'end': event['end'], 'note': None,
+                'team': team, 'role': role, 'user': user['name'], 'full_name': user['full_name']})
+        self.last_scheduled_user_ids[schedule_id] = user_id
+
+    def event_index(self, team_id, roster_id, role_id, window_start, across_teams=False):
+        '''
+        Build the EventIndex Scheduler.schedule() would load for a single schedule.
+        '''
+        index = EventIndex(team_id, self.subscriptions.get(team_id, ()), self.vacation_role_id, across_teams)
+        index.roster_users[roster_id] = self.roster_user_ids()
+        for ev in self.events:
+            if ev['end'] > window_start and index.is_conflicting(ev['team_id'], ev['role_id']):
+                index.add_busy(ev['user_id'], ev['start'], ev['end'])
+            if ev['team_id'] == team_id and ev['role_id'] == role_id:
+                index.add_history(ev['user_id'], role_id, ev['end'])
+        return index
+
+    def last_started_user_id(self, team_id, role_id, user_ids, before):
+        '''
+        Of the given users, the one with the latest event for this team and role starting at or before ``before``.
+        '''
+        starts = {}
+        for ev in self.events:
+            if ev['team_id'] == team_id and ev['role_id'] == role_id and ev['user_id'] in user_ids \
+                    and ev['start'] <= before:
+                starts[ev['user_id']] = max(starts.get(ev['user_id'], ev['start']), ev['start'])
+        if not starts:
+            return None
+        return max(starts, key=starts.get)
 
-all_columns = ', '.join(columns.values())
+    def get_events(self, start__lt, end__ge, team__eq):
+        '''
+        Events of the named team, and of its subscriptions, overlapping [end__ge, start__lt).
+        '''
+        team_id = self.team_ids.get(team__eq)
+        subscriptions = set(self.subscriptions.get(team_id, ()))
+        return [{field: ev[field] for field in preview_fields} for ev in self.events
+                if ev['start'] < start__lt and ev['end'] >= end__ge
+                and (ev['team'] == team__eq or (ev['team_id'], ev['role_id']) in subscriptions)]
 
 
 class Scheduler(object):
+    # Whether any event of a user, regardless of team and role, blocks scheduling them
+    busy_across_teams = False
+    # Whether an epoch is skipped when events with the same times, role and team already exist
+    skip_matching_events = True
+
     def __init__(self):
         pass
 
@@ -138,8 +273,11 @@ class Scheduler(object):
         return {row['id'] for row in cursor}
 
     def create_events(self, team_id, schedule_id, user_id, events, role_id, cursor, table_name='event', skip_match=True):
+        '''
+        :return: True if the events were inserted, False if they were skipped
+        '''
         if len(events) == 0:
-            return
+            return False
         # Skip creating this epoch of events if matching events exist
         if skip_match:
             matching = ' OR '.join(['(start = %s AND end = %s AND role_id = %s AND team_id = %s)'] * len(events))
@@ -152,57 +290,95 @@ class Scheduler(object):
 
             cursor.execute(query, query_params)
             if cursor.fetchone()['num_events'] == len(events):
-                return
-
-        if len(events) == 1:
-            [event] = events
-            event_args = (team_id, schedule_id, event['start'], event['end'], user_id, role_id)
-            logger.debug('inserting event: %s', event_args)
-            query = '''
-                INSERT INTO `%s` (
-                    `team_id`, `schedule_id`, `start`, `end`, `user_id`, `role_id`
-                ) VALUES (
-                    %%s, %%s, %%s, %%s, %%s, %%s
-                )''' % table_name
-            cursor.execute(query, event_args)
-            cursor.execute('SELECT `name` FROM `user` WHERE `id` = %s', user_id)
-            name = cursor.fetchone()
-            context = {
-                'team': team_id,
-                'role': role_id,
-                'full_name': name
-            }
-            create_notification(context, team_id,
-                                [role_id],
-                                EVENT_CREATED,
-                                [user_id],
-                                cursor,
-                                start_time=event['start'])
-        else:
-            link_id = gen_link_id()
-            for event in events:
-                event_args = (team_id, schedule_id, event['start'], event['end'], user_id, role_id, link_id)
-                logger.debug('inserting event: %s', event_args)
-                query = '''
-                    INSERT INTO `%s` (
-                        `team_id`, `schedule_id`, `start`, `end`, `user_id`, `role_id`, `link_id`
-                    ) VALUES (
-                        %%s, %%s, %%s, %%s, %%s, %%s, %%s
-                    )''' % table_name
-                cursor.execute(query, event_args)
-                cursor.execute('SELECT `name` FROM `user` WHERE `id` = %s', user_id)
-                name = cursor.fetchone()
-                context = {
-                    'team': team_id,
-                    'role': role_id,
-                    'full_name': name
-                }
-                create_notification(context, team_id,
-                                    [role_id],
-                                    EVENT_CREATED,
-                                    [user_id],
-                                    cursor,
-                                    start_time=event['start'])
+                return False
+
+        self.insert_events(team_id, schedule_id, user_id, events, role_id, cursor, table_name)
+        return True
+
+    def insert_events(self, team_id, schedule_id, user_id, events, role_id, cursor, table_name='event'):
+        '''
+        Insert one epoch of events for a user in a single statement and queue their EVENT_CREATED
+        notifications. Epochs with more than one event are linked.
+        '''
+        link_id = gen_link_id() if len(events) > 1 else None
+        event_args = [(team_id, schedule_id, event['start'], event['end'], user_id, role_id, link_id)
+                      for event in events]
+        logger.debug('inserting events: %s', event_args)
+        query = '''
+            INSERT INTO `%s` (
+                `team_id`, `schedule_id`, `start`, `end`, `user_id`, `role_id`, `link_id`
+            ) VALUES (
+                %%s, %%s, %%s, %%s, %%s, %%s, %%s
+            )''' % table_name
+        cursor.executemany(query, event_args)
+
+        cursor.execute('SELECT `name` FROM `user` WHERE `id` = %s', user_id)
+        name = cursor.fetchone()
+        notifications = [({'team': team_id, 'role': role_id, 'full_name': name}, {'start_time': event['start']})
+                         for event in events]
+        create_notifications(notifications, team_id, [role_id], EVENT_CREATED, [user_id], cursor)
+
+    def load_event_index(self, team_id, schedules, window_start, cursor):
+        '''
+        Load an EventIndex for the rosters and roles of the given schedules, keeping conflicting
+        events that end after window_start.
+        '''
+        cursor.execute('''SELECT `subscription_id`, `role_id`
+                          FROM `team_subscription`
+                          WHERE `team_id` = %s''',
+                       team_id)
+        subscriptions = [(row['subscription_id'], row['role_id']) for row in cursor]
+        cursor.execute("SELECT `id` FROM `role` WHERE `name` = 'vacation'")
+        row = cursor.fetchone()
+        index = EventIndex(team_id, subscriptions, row['id'] if row else None, self.busy_across_teams)
+
+        cursor.execute('''
+            SELECT `roster_user`.`roster_id`, `roster_user`.`user_id` FROM `roster_user`
+            JOIN `user` ON `user`.`id` = `roster_user`.`user_id`
+            WHERE `roster_user`.`in_rotation` = 1 AND `roster_user`.`roster_id` IN %s
+                AND `user`.`active` = TRUE''', ({s['roster_id'] for s in schedules},))
+        for row in cursor:
+            index.roster_users.setdefault(row['roster_id'], set()).add(row['user_id'])
+        user_ids = set().union(*index.roster_users.values())
+        if not user_ids:
+            return index
+
+        cursor.execute('''SELECT `user_id`, `team_id`, `role_id`, `start`, `end` FROM `event`
+                          WHERE `user_id` IN %s AND `end` > %s''', (user_ids, window_start))
+        for row in cursor:
+            if index.is_conflicting(row['team_id'], row['role_id']):
+                index.add_busy(row['user_id'], row['start'], row['end'])
+
+        cursor.execute('''SELECT `user_id`, `role_id`, `end` FROM `event`
+                          WHERE `team_id` = %s AND `user_id` IN %s AND `role_id` IN %s''',
+                       (team_id, user_ids, {s['role_id'] for s in schedules}))
+        for row in cursor:
+            index.add_history(row['user_id'], row['role_id'], row['end'])
+        return index
+
+    def find_next_user_id_from_index(self, schedule, future_events, index):
+        '''
+        Same choice as find_next_user_id, answered from an EventIndex instead of the database.
+        '''
+        role_id = schedule['role_id']
+        user_ids = set(index.roster_users.get(schedule['roster_id'], ()))
+        if not user_ids:
+            logger.info('Empty roster, skipping')
+            return None
+        logger.debug('filtering users: %s', user_ids)
+        start = min([e['start'] for e in future_events])
+        user_ids = {uid for uid in user_ids if not index.is_busy(uid, future_events)}
+        if not user_ids:
+            logger.info('All users have conflicting events, skipping...')
+            return None
+        last_ends = {uid: index.last_end(uid, role_id, start) for uid in user_ids}
+        available_and_new = {uid for uid, last_end in last_ends.items() if last_end is None}
+        if available_and_new:
+            logger.info('Picking new and available user from %s', available_and_new)
+            return available_and_new.pop()
+
+        logger.debug('picking user between: %s, team: %s', user_ids, schedule['team_id'])
+        return min(user_ids, key=lambda uid: (last_ends[uid], uid))
 
     def set_last_epoch(self, schedule_id, last_epoch, cursor):
         cursor.execute('UPDATE `schedule` SET `last_epoch_scheduled` = %s WHERE `id` = %s',
@@ -311,7 +487,9 @@ class Scheduler(object):
         # Return future events and the last epoch events were scheduled for.
         return future_events, self.utc_from_naive_date(next_epoch - timedelta(days=7 * period), schedule)
 
-    def find_next_user_id(self, schedule, future_events, cursor, table_name='event'):
+    def find_next_user_id(self, schedule, future_events, cursor, table_name='event', index=None):
+        if index is not None:
+            return self.find_next_user_id_from_index(schedule, future_events, index)
         team_id = schedule['team_id']
         role_id = schedule['role_id']
         roster_id = schedule['roster_id']
@@ -353,58 +531,35 @@ class Scheduler(object):
                 events.append((schedule, epoch))
             self.set_last_epoch(schedule['id'], last_epoch, cursor)
 
+        # Load the events deciding who is picked once, then keep the index in step with inserted events
+        index = None
+        if events:
+            window_start = min(ev['start'] for _, epoch in events for ev in epoch)
+            index = self.load_event_index(team['id'], [schedule for schedule, _ in events], window_start, cursor)
+
         # Create events in the db, associating a user to them
         # Iterate through events in order of (start time, role) to properly assign users
         for schedule, epoch in sorted(events, key=lambda x: (min(ev['start'] for ev in x[1]), x[0]['role_id'])):
-            user_id = self.find_next_user_id(schedule, epoch, cursor)
+            user_id = self.find_next_user_id(schedule, epoch, cursor, index=index)
             if not user_id:
                 logger.info('Failed to find available user')
                 continue
             logger.info('Found user: %s', user_id)
-            self.create_events(team['id'], schedule['id'], user_id, epoch, schedule['role_id'], cursor)
+            if self.create_events(team['id'], schedule['id'], user_id, epoch, schedule['role_id'], cursor):
+                index.add_events(user_id, team['id'], schedule['role_id'], epoch)
         connection.commit()
 
-    def build_preview_response(self, cursor, start__lt, end__ge, team__eq, table_name='temp_event'):
-        # get existing events
-
-        cols = all_columns
-        query = '''SELECT %s FROM `%s`
-                JOIN `user` ON `user`.`id` = `%s`.`user_id`
-                JOIN `team` ON `team`.`id` = `%s`.`team_id`
-                JOIN `role` ON `role`.`id` = `%s`.`role_id`''' % (cols, table_name, table_name, table_name, table_name)
-        where_params = [constraints['start__lt'], constraints['end__ge']]
-        where_vals = [start__lt, end__ge]
-
-        # Deal with team subscriptions and team parameters
-        team_where = [constraints['team__eq']]
-        subs_vals = [team__eq]
-        subs_and = ' AND '.join(team_where)
-        cursor.execute('''SELECT `subscription_id`, `role_id` FROM `team_subscription`
-                        JOIN `team` ON `team_id` = `team`.`id`
-                        WHERE %s''' % subs_and, subs_vals)
-        if cursor.rowcount != 0:
-            # Build where clause based on team params and subscriptions
-            subs_and = '(%s OR (%s))' % (subs_and, ' OR '.join(['`team`.`id` = %s AND `role`.`id` = %s' %
-                                                                (row['subscription_id'], row['role_id']) for row in cursor]))
-        where_params.append(subs_and)
-        where_vals += subs_vals
-
-        where_query = ' AND '.join(where_params)
-        if where_query:
-            query = '%s WHERE %s' % (query, where_query)
-        cursor.execute(query, where_vals)
-        data = cursor.fetchall()
-        return json_dumps(data)
+    def build_preview_response(self, store, start__lt, end__ge, team__eq):
+        return json_dumps(store.get_events(float(start__lt), float(end__ge), team__eq))
 
-    def populate(self, schedule, start_time, dbinfo, table_name='event'):
-        config = read_config(sys.argv[1])
-        connection, cursor = dbinfo
+    def calculate_populate_events(self, schedule, start_time):
+        '''
+        Epochs of events to create when (re)populating a schedule from start_time, and the last epoch.
+        Raises 400 for a start time in the past unless allow_past_events is set.
+        '''
         start_dt = datetime.fromtimestamp(start_time, utc)
         start_epoch = self.epoch_from_datetime(start_dt)
 
-        # Get schedule info
-        role_id = schedule['role_id']
-        team_id = schedule['team_id']
         first_event_start = min(ev['start'] for ev in schedule['events'])
         period = self.get_period_len(schedule)
         handoff = start_epoch + timedelta(seconds=first_event_start)
@@ -414,20 +569,25 @@ class Scheduler(object):
         if start_dt > handoff:
             start_epoch += timedelta(weeks=period)
             handoff += timedelta(weeks=period)
-        if handoff < datetime.now(utc) and config.get('allow_past_events', False) is not True:
-            cursor.execute("DROP TEMPORARY TABLE IF EXISTS `temp_event`")
-            connection.commit()
+        if handoff < datetime.now(utc) and settings.get('allow_past_events', False) is not True:
             raise HTTPBadRequest(
                 title='Invalid populate/preview request',
                 description='cannot populate/preview starting in the past'
             )
 
-        future_events, last_epoch = self.calculate_future_events(schedule, cursor, start_epoch)
+        future_events, last_epoch = self.calculate_future_events(schedule, None, start_epoch)
+        future_events = [[x for x in evs if x['start'] >= start_time] for evs in future_events]
+        future_events = [x for x in future_events if x != []]
+        return future_events, last_epoch
+
+    def populate(self, schedule, start_time, dbinfo, table_name='event'):
+        connection, cursor = dbinfo
+        role_id = schedule['role_id']
+        team_id = schedule['team_id']
+        future_events, last_epoch = self.calculate_populate_events(schedule, start_time)
         self.set_last_epoch(schedule['id'], last_epoch, cursor)
 
         # Delete existing events from the start of the first event
-        future_events = [[x for x in evs if x['start'] >= start_time] for evs in future_events]
-        future_events = [x for x in future_events if x != []]
         if future_events:
             first_event_start = min(future_events[0], key=lambda x: x['start'])['start']
             query = 'DELETE FROM %s WHERE schedule_id = %%s AND start >= %%s' % table_name
@@ -440,3 +600,31 @@ class Scheduler(object):
                 continue
             self.create_events(team_id, schedule['id'], user_id, epoch, role_id, cursor, table_name)
         connection.commit()
+
+    def find_next_user_id_in_store(self, schedule, future_events, store, index):
+        return self.find_next_user_id_from_index(schedule, future_events, index)
+
+    def preview(self, schedule, start_time, store):
+        '''
+        Run populate() against a MemoryEventStore: the store ends up with the events populate would
+        leave in the event table, and nothing is written to the database.
+        '''
+        future_events, _ = self.calculate_populate_events(schedule, start_time)
+        if not future_events:
+            return
+        first_event_start = min(future_events[0], key=lambda x: x['start'])['start']
+        store.delete_events(schedule['id'], first_event_start)
+
+        team_id = schedule['team_id']
+        role_id = schedule['role_id']
+        index = store.event_index(team_id, schedule['roster_id'], role_id,
+                                  min(ev['start'] for epoch in future_events for ev in epoch),
+                                  self.busy_across_teams)
+        for epoch in future_events:
+            user_id = self.find_next_user_id_in_store(schedule, epoch, store, index)
+            if not user_id:
+                continue
+            if self.skip_matching_events and store.count_matching(epoch, role_id, team_id) == len(epoch):
+                continue
+            store.insert_events(team_id, schedule['team'], schedule['id'], user_id, epoch, role_id, schedule['role'])
+            index.add_events(user_id, team_id, role_id, epoch)
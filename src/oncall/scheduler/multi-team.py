@@ -2,9 +2,12 @@ from . import default
 
 
 class Scheduler(default.Scheduler):
+    busy_across_teams = True
+    skip_matching_events = False
+
     # same as no-skip-matching
     def create_events(self, team_id, schedule_id, user_id, events, role_id, cursor, table_name='event', skip_match=True):
-        super(Scheduler, self).create_events(team_id, schedule_id, user_id, events, role_id, cursor, table_name, skip_match=False)
+        return super(Scheduler, self).create_events(team_id, schedule_id, user_id, events, role_id, cursor, table_name, skip_match=False)
 
     def get_busy_user_by_event_range(self, user_ids, team_id, events, cursor, table_name='event'):
         ''' Find which users have overlapping events for the same team in this time range'''
@@ -2,5 +2,7 @@ from . import default
 
 
 class Scheduler(default.Scheduler):
+    skip_matching_events = False
+
     def create_events(self, team_id, schedule_id, user_id, events, role_id, cursor, table_name='event', skip_match=True):
-        super(Scheduler, self).create_events(team_id, schedule_id, user_id, events, role_id, cursor, table_name, skip_match=False)
\ No newline at end of file
+        return super(Scheduler, self).create_events(team_id, schedule_id, user_id, events, role_id, cursor, table_name, skip_match=False)
\ No newline at end of file
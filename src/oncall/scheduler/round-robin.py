@@ -1,5 +1,3 @@
-from oncall.utils import gen_link_id, create_notification
-from ..constants import EVENT_CREATED
 from . import default
 import logging
 
@@ -7,6 +5,7 @@ logger = logging.getLogger()
 
 
 class Scheduler(default.Scheduler):
+    skip_matching_events = False
 
     def guess_last_scheduled_user(self, schedule, start, roster, cursor, table_name='event'):
         query = '''
@@ -24,7 +23,7 @@ class Scheduler(default.Scheduler):
         else:
             return None
 
-    def find_next_user_id(self, schedule, future_events, cursor, table_name='event'):
+    def find_next_user_id(self, schedule, future_events, cursor, table_name='event', index=None):
         cursor.execute('''SELECT `user_id` FROM `roster_user`
                            WHERE `roster_id` = %s AND in_rotation = TRUE''',
                        schedule['roster_id'])
@@ -51,57 +50,25 @@ class Scheduler(default.Scheduler):
         last_idx = roster.index(last_user)
         return roster[(last_idx + 1) % len(roster)]
 
+    def find_next_user_id_in_store(self, schedule, future_events, store, index):
+        # populate() forgets the last scheduled user, so the store starts without one
+        roster_users = store.roster_user_ids(active_only=False)
+        roster = [user_id for user_id in store.schedule_order if user_id in roster_users]
+        if roster == []:
+            return None
+        last_user = store.last_scheduled_user_ids.get(schedule['id'])
+        if last_user not in roster:
+            start = min(e['start'] for e in future_events)
+            last_user = store.last_started_user_id(schedule['team_id'], schedule['role_id'], roster, start)
+            if last_user is None:
+                return roster[0]
+        last_idx = roster.index(last_user)
+        return roster[(last_idx + 1) % len(roster)]
+
     def create_events(self, team_id, schedule_id, user_id, events, role_id, cursor, table_name='event', skip_match=True):
-        if len(events) == 1:
-            [event] = events
-            event_args = (team_id, schedule_id, event['start'], event['end'], user_id, role_id)
-            logger.debug('inserting event: %s', event_args)
-            query = '''
-                INSERT INTO `%s` (
-                    `team_id`, `schedule_id`, `start`, `end`, `user_id`, `role_id`
-                ) VALUES (
-                    %%s, %%s, %%s, %%s, %%s, %%s
-                )''' % table_name
-            cursor.execute(query, event_args)
-            cursor.execute('SELECT `name` FROM `user` WHERE `id` = %s', user_id)
-            name = cursor.fetchone()
-            context = {
-                'team': team_id,
-                'role': role_id,
-                'full_name': name
-            }
-            create_notification(context, team_id,
-                                [role_id],
-                                EVENT_CREATED,
-                                [user_id],
-                                cursor,
-                                start_time=event['start'])
-        else:
-            link_id = gen_link_id()
-            for event in events:
-                event_args = (team_id, schedule_id, event['start'], event['end'], user_id, role_id, link_id)
-                logger.debug('inserting event: %s', event_args)
-                query = '''
-                    INSERT INTO `%s` (
-                        `team_id`, `schedule_id`, `start`, `end`, `user_id`, `role_id`, `link_id`
-                    ) VALUES (
-                        %%s, %%s, %%s, %%s, %%s, %%s, %%s
-                    )''' % table_name
-                cursor.execute(query, event_args)
-                cursor.execute('SELECT `name` FROM `user` WHERE `id` = %s', user_id)
-                name = cursor.fetchone()
-                context = {
-                    'team': team_id,
-                    'role': role_id,
-                    'full_name': name
-                }
-                create_notification(context, team_id,
-                                    [role_id],
-                                    EVENT_CREATED,
-                                    [user_id],
-                                    cursor,
-                                    start_time=event['start'])
+        self.insert_events(team_id, schedule_id, user_id, events, role_id, cursor, table_name)
         cursor.execute('UPDATE `schedule` SET `last_scheduled_user_id` = %s WHERE `id` = %s', (user_id, schedule_id))
+        return True
 
     def populate(self, schedule, start_time, dbinfo, table_name='event'):
         _, cursor = dbinfo
@@ -0,0 +1,65 @@
+# Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
+# See LICENSE in the project root for license information.
+
+'''
+Process-wide configuration registry.
+
+The config is parsed once at startup (``oncall.app.init`` for the API) and is then read from here
+instead of re-reading the config file. With ``reload_config_on_sighup`` set, SIGHUP re-reads the file
+in place. Only settings looked up through this module pick up a reload; the db pool, auth and other
+state built at startup keep their original config.
+'''
+
+import logging
+import signal
+
+from .utils import read_config
+
+logger = logging.getLogger(__name__)
+
+config = {}
+config_path = None
+reload_hooks = []
+
+
+def init(new_config, path=None):
+    global config_path
+    if new_config is not config:
+        config.clear()
+        config.update(new_config)
+    if path is not None:
+        config_path = path
+
+
+def get(key, default=None):
+    return config.get(key, default)
+
+
+def add_reload_hook(hook):
+    '''
+    Register a callable run with the new config after every reload.
+    '''
+    reload_hooks.append(hook)
+
+
+def reload():
+    if config_path is None:
+        logger.warning('No config file to reload from')
+        return
+    try:
+        new_config = read_config(config_path)
+    except Exception:
+        logger.exception('Failed to reload config from %s, keeping the current one', config_path)
+        return
+    config.clear()
+    config.update(new_config)
+    logger.info('Reloaded config from %s', config_path)
+    for hook in reload_hooks:
+        try:
+            hook(config)
+        except Exception:
+            logger.exception('Config reload hook %s failed', hook)
+
+
+def enable_sighup_reload():
+    signal.signal(signal.SIGHUP, lambda signum, frame: reload())
@@ -7,8 +7,6 @@
 
 import logging
 import re
-import oncall.utils
-import sys
 from ..constants import SUPPORTED_TIMEZONES
 from .. import auth
 from .. import db
@@ -89,14 +87,13 @@ def index(req, resp):
         resp.content_type = 'text/html'
         resp.text = jinja2_env.get_template('loginsplash.html').render()
     else:
-        config = oncall.utils.read_config(sys.argv[1])
         # Get ldap domains for login
         ldap_domains = []
         
         # if 'auth' in config and 'module' in config['auth'] and config['auth']['module'] == 'oncall.auth.modules.ldap_import':
         if True:
             try:
-                connection = db.connect()
+                connection = db.connect(req)
                 cursor = connection.cursor(db.DictCursor)
 
                 query = 'SELECT `name`, `display_name` FROM `ldap_domain` WHERE `active` = 1'
@@ -33,11 +33,16 @@ def yaml_env_tag_constructor(loader, node):
     arr = loader.construct_sequence(node)
     return environ.get(arr[0], "" if len(arr) < 2 else arr[1])
 
+class ConfigLoader(yaml.SafeLoader):
+    pass
+
+
+ConfigLoader.add_constructor("!env", yaml_env_tag_constructor)
+
+
 def read_config(config_path):
     with open(config_path, 'r', encoding='utf8') as file:
-        l = yaml.SafeLoader
-        l.add_constructor("!env", yaml_env_tag_constructor)
-        return yaml.load(file, l)
+        return yaml.load(file, ConfigLoader)
 
 def create_notification(context, team_id, role_ids, type_name, users_involved, cursor, **kwargs):
     '''
@@ -50,6 +55,20 @@ def create_notification(context, team_id, role_ids, type_name, users_involved, c
     :param kwargs: components of context that require timezone formatting, passed as unix timestamps
     :return: None
     '''
+    create_notifications([(context, kwargs)], team_id, role_ids, type_name, users_involved, cursor)
+
+
+def create_notifications(notifications, team_id, role_ids, type_name, users_involved, cursor):
+    '''
+    Queue several notifications of one type for the same team and roles. Recipients are looked up once
+    and all notification_queue rows are written in a single INSERT.
+
+    :param notifications: list of (context, timestamps) pairs, where timestamps is a dict of context
+        components that require timezone formatting, passed as unix timestamps
+    :return: None
+    '''
+    if not notifications:
+        return
     cursor.execute('''SELECT `user_id`, `mode_id`, `type_id`, `user`.`time_zone` FROM notification_setting
                       JOIN `notification_type` ON `notification_setting`.`type_id` = `notification_type`.`id`
                       JOIN `setting_role` ON `notification_setting`.`id` = `setting_role`.`setting_id`
@@ -58,18 +77,24 @@ def create_notification(context, team_id, role_ids, type_name, users_involved, c
                           AND (user_id IN %s OR only_if_involved = FALSE)
                       GROUP BY `user_id`, `mode_id`
                   ''', (team_id, role_ids, type_name, users_involved))
-    notifications = cursor.fetchall()
-
-    for notification in notifications:
-        tz = notification['time_zone'] if notification['time_zone'] else 'UTC'
-        for var_name, timestamp in kwargs.items():
-            context[var_name] = ' '.join([datetime.fromtimestamp(timestamp,
-                                                                 timezone(tz)).strftime('%Y-%m-%d %H:%M:%S'),
-                                          tz])
-        cursor.execute('''INSERT INTO `notification_queue` (`user_id`, `send_time`, `mode_id`, `context`, `type_id`,
-                              `active`)
-                          VALUES (%s, UNIX_TIMESTAMP(), %s, %s, %s, 1)''',
-                       (notification['user_id'], notification['mode_id'], json_dumps(context), notification['type_id']))
+    recipients = cursor.fetchall()
+    if not recipients:
+        return
+
+    query_vals = []
+    query_params = []
+    for recipient in recipients:
+        tz = recipient['time_zone'] if recipient['time_zone'] else 'UTC'
+        for context, timestamps in notifications:
+            for var_name, timestamp in timestamps.items():
+                context[var_name] = ' '.join([datetime.fromtimestamp(timestamp,
+                                                                     timezone(tz)).strftime('%Y-%m-%d %H:%M:%S'),
+                                              tz])
+            query_vals.append('(%s, UNIX_TIMESTAMP(), %s, %s, %s, 1)')
+            query_params += [recipient['user_id'], recipient['mode_id'], json_dumps(context), recipient['type_id']]
+    cursor.execute('''INSERT INTO `notification_queue` (`user_id`, `send_time`, `mode_id`, `context`, `type_id`,
+                          `active`)
+                      VALUES %s''' % ', '.join(query_vals), query_params)
 
 
 def subscribe_notifications(team, user, cursor):
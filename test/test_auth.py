@@ -6,6 +6,7 @@ import time
 import hmac
 import hashlib
 import base64
+import pytest
 
 
 class DummyAPI(object):
@@ -59,3 +60,32 @@ def test_application_auth(mocker):
 
     re = client.simulate_post('/dummy_path', body=body, headers={'AUTHORIZATION': auth})
     assert re.status_code == 201
+
+
+def test_team_auth_cache(mocker):
+    from oncall import auth
+    from falcon import HTTPForbidden
+    connect = mocker.MagicMock(name='dummyDB')
+    cursor = mocker.MagicMock(name='dummyCursor')
+    cursor.fetchone.return_value = ('team-foo', 1, 1)
+    connect.cursor.return_value = cursor
+    db = mocker.MagicMock()
+    db.connect.return_value = connect
+    mocker.patch('oncall.auth.db', db)
+    auth.permission_cache.clear()
+
+    req = mocker.MagicMock()
+    req.context = {'user': 'jdoe'}
+    auth.check_team_auth('team-foo', req)
+    auth.check_calendar_auth('team-foo', req)
+    assert cursor.execute.call_count == 1
+
+    # Revoking admin is picked up once the handler invalidates the cache
+    cursor.fetchone.return_value = ('team-foo', 0, 1)
+    cursor.rowcount = 0
+    auth.invalidate_permissions(user='jdoe')
+    with pytest.raises(HTTPForbidden):
+        auth.check_team_auth('team-foo', req)
+    auth.check_calendar_auth('team-foo', req)
+    assert cursor.execute.call_count == 3
+    auth.permission_cache.clear()
@@ -0,0 +1,28 @@
+# Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
+# See LICENSE in the project root for license information.
+
+import pytest
+from oncall.bin.scheduler import parse_shard, in_shard, summarize_cycle
+
+
+def test_parse_shard():
+    assert parse_shard('0/1') == (0, 1)
+    assert parse_shard('2/4') == (2, 4)
+    for value in ('4/4', '-1/4', '1/0', 'a/b', '1'):
+        with pytest.raises(ValueError):
+            parse_shard(value)
+
+
+def test_shards_partition_teams():
+    teams = [{'id': i} for i in range(1, 500)]
+    assigned = [[team['id'] for team in teams if in_shard(team, (i, 3))] for i in range(3)]
+    assert sorted(sum(assigned, [])) == [team['id'] for team in teams]
+    assert all(assigned)
+    assert all(in_shard(team, None) for team in teams)
+
+
+def test_summarize_cycle():
+    summary = summarize_cycle({'foo': 0.5, 'bar': 2.0, 'baz': 1.0}, 2.0, slowest=2)
+    assert summary['teams'] == 3
+    assert summary['teams_per_second'] == 1.5
+    assert summary['slowest'] == [('bar', 2.0), ('baz', 1.0)]
@@ -0,0 +1,72 @@
+# Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
+# See LICENSE in the project root for license information.
+
+import falcon
+import falcon.testing
+from ujson import loads
+from oncall.api.v0 import bulk_oncall
+
+
+class FakeCursor(object):
+    '''
+    team-foo (1, override number) subscribes to team-bar's (2) primary role; service-foo is owned
+    by team-bar. On call at 100: foo primary for team-foo, bar primary and baz secondary for team-bar.
+    '''
+    def __init__(self):
+        self.rows = []
+        self.queries = []
+
+    def execute(self, query, args):
+        self.queries.append((query, args))
+        if 'UNION ALL' in query or 'FROM `team` WHERE' in query or 'FROM `team_service`' in query:
+            self.rows = [{'id': 1, 'name': 'team-foo', 'override_phone_number': '+1 999', 'service': None},
+                         {'id': 2, 'name': 'team-bar', 'override_phone_number': None, 'service': 'service-foo'}]
+        elif 'team_subscription' in query:
+            self.rows = [{'team_id': 1, 'subscription_id': 2, 'role_id': 1}]
+        else:
+            assert args[0] == 100
+            self.rows = [
+                {'id': 1, 'team_id': 1, 'role_id': 1, 'full_name': 'Foo', 'start': 0, 'end': 200, 'mode': 'call',
+                 'destination': '+1 111', 'user': 'foo', 'team': 'team-foo', 'role': 'primary'},
+                {'id': 1, 'team_id': 1, 'role_id': 1, 'full_name': 'Foo', 'start': 0, 'end': 200, 'mode': 'email',
+                 'destination': 'foo@example.com', 'user': 'foo', 'team': 'team-foo', 'role': 'primary'},
+                {'id': 2, 'team_id': 2, 'role_id': 1, 'full_name': 'Bar', 'start': 50, 'end': 150, 'mode': None,
+                 'destination': None, 'user': 'bar', 'team': 'team-bar', 'role': 'primary'},
+                {'id': 3, 'team_id': 2, 'role_id': 2, 'full_name': 'Baz', 'start': 50, 'end': 150, 'mode': 'call',
+                 'destination': '+1 333', 'user': 'baz', 'team': 'team-bar', 'role': 'secondary'},
+            ]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        pass
+
+
+def test_bulk_oncall(mocker):
+    cursor = FakeCursor()
+    connection = mocker.MagicMock()
+    connection.cursor.return_value = cursor
+    mocker.patch('oncall.db.connect', return_value=connection)
+    app = falcon.App()
+    app.add_route('/api/v0/oncall', bulk_oncall)
+    client = falcon.testing.TestClient(app)
+
+    re = client.simulate_get('/api/v0/oncall', params={'team': ['team-foo', 'team-missing'],
+                                                       'service': ['service-foo', 'service-missing'], 'at': 100})
+    assert re.status_code == 200
+    # entities, subscriptions and events: three queries whatever the number of teams and services
+    assert len(cursor.queries) == 3
+    data = loads(re.text)
+    foo, bar = data['teams']['team-foo']
+    assert foo['user'] == 'foo'
+    assert foo['contacts'] == {'call': '+1 999', 'email': 'foo@example.com', 'sms': '+1 999'}
+    # subscribed events carry the subscriber's override number, as in team_oncall
+    assert bar['user'] == 'bar'
+    assert bar['contacts'] == {'call': '+1 999', 'sms': '+1 999'}
+    assert data['teams']['team-missing'] == []
+    assert sorted(row['user'] for row in data['services']['service-foo']) == ['bar', 'baz']
+    assert data['services']['service-missing'] == []
+
+    re = client.simulate_get('/api/v0/oncall')
+    assert re.status_code == 400
@@ -0,0 +1,54 @@
+# Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
+# See LICENSE in the project root for license information.
+
+from oncall.cache import TTLCache
+from oncall import metrics
+
+
+def test_ttl_cache_lru_eviction():
+    cache = TTLCache('test_lru', max_size=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert metrics.stats['test_lru_cache_hit_cnt'] == 3
+    assert metrics.stats['test_lru_cache_miss_cnt'] == 1
+
+
+def test_ttl_cache_expiry(mocker):
+    cache = TTLCache('test_ttl', ttl=10)
+    mocker.patch('time.time').return_value = 100
+    cache.set('a', 1)
+    mocker.patch('time.time').return_value = 109
+    assert cache.get('a') == 1
+    mocker.patch('time.time').return_value = 111
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_ttl_cache_invalidate_where():
+    cache = TTLCache('test_invalidate')
+    cache.set(('team', 'jdoe', 'foo'), 1)
+    cache.set(('team', 'asmith', 'foo'), 2)
+    cache.invalidate_where(lambda key, value: key[1] == 'jdoe')
+    assert cache.get(('team', 'jdoe', 'foo')) is None
+    assert cache.get(('team', 'asmith', 'foo')) == 2
+
+
+def test_ttl_cache_disabled():
+    cache = TTLCache('test_disabled', ttl=0)
+    cache.set('a', 1)
+    assert cache.get('a') is None
+
+
+def test_ttl_cache_generation():
+    cache = TTLCache('test_generation')
+    generation = cache.generation
+    cache.invalidate('other')
+    cache.set('a', 1, generation=generation)
+    assert cache.get('a') is None
+    cache.set('a', 2, generation=cache.generation)
+    assert cache.get('a') == 2
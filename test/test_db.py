@@ -0,0 +1,131 @@
+# Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
+# See LICENSE in the project root for license information.
+
+from collections import defaultdict
+
+import falcon
+import falcon.testing
+from oncall import db
+from oncall.app import DBConnectionMiddleware
+
+
+class DummyAPI(object):
+
+    def on_get(self, req, resp):
+        for _ in range(3):
+            connection = db.connect(req)
+            cursor = connection.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            connection.close()
+        resp.text = 'GOOD'
+
+    def on_post(self, req, resp):
+        connection = db.connect(req)
+        connection.cursor().execute('SELECT 1')
+        raise falcon.HTTPBadRequest()
+
+
+def test_request_connection_shared(mocker):
+    raw_connection = mocker.MagicMock(name='dummyDB')
+    connect_raw = mocker.patch('oncall.db.connect_raw', return_value=raw_connection)
+
+    api = falcon.App(middleware=[DBConnectionMiddleware()])
+    api.add_route('/dummy_path', DummyAPI())
+    client = falcon.testing.TestClient(api)
+
+    re = client.simulate_get('/dummy_path')
+    assert re.status_code == 200
+    connect_raw.assert_called_once()
+    raw_connection.commit.assert_called_once()
+    raw_connection.rollback.assert_not_called()
+    raw_connection.close.assert_called_once()
+
+    connect_raw.reset_mock()
+    raw_connection.reset_mock()
+    re = client.simulate_post('/dummy_path')
+    assert re.status_code == 400
+    connect_raw.assert_called_once()
+    raw_connection.commit.assert_not_called()
+    raw_connection.rollback.assert_called_once()
+    raw_connection.close.assert_called_once()
+
+
+def test_request_connection_lazy(mocker):
+    connect_raw = mocker.patch('oncall.db.connect_raw')
+    connection = db.RequestConnection()
+    connection.commit()
+    connection.close()
+    connection.release(True)
+    connect_raw.assert_not_called()
+
+
+def test_pool_config_and_metrics(mocker):
+    create_engine = mocker.patch('oncall.db.create_engine')
+    mocker.patch('oncall.db.event')
+    mocker.patch('oncall.db.metrics.stats', defaultdict(int))
+    db.init({
+        'conn': {'str': '%(scheme)s://', 'kwargs': {'scheme': 'mysql+pymysql'}},
+        'pool': {'size': 20, 'max_overflow': 5, 'timeout': 3, 'pre_ping': True, 'lifo': True},
+        'kwargs': {'pool_recycle': 3600},
+    })
+    assert create_engine.call_args[1] == {
+        'connect_args': {}, 'pool_size': 20, 'max_overflow': 5, 'pool_timeout': 3,
+        'pool_pre_ping': True, 'pool_use_lifo': True, 'pool_recycle': 3600}
+
+    pool = create_engine.return_value.pool
+    pool.checkedout.return_value = 7
+    pool.overflow.return_value = 2
+    db.connect()
+    db.record_wait(50)
+    db.record_wait(5000)
+    db.collect_pool_stats()
+    assert db.metrics.stats['db_pool_wait_le_1ms_cnt'] == 1
+    assert db.metrics.stats['db_pool_wait_le_100ms_cnt'] == 1
+    assert db.metrics.stats['db_pool_wait_over_1000ms_cnt'] == 1
+    assert db.metrics.stats['db_pool_wait_max_ms'] == 5000
+    assert db.metrics.stats['db_pool_checked_out'] == 7
+    assert db.metrics.stats['db_pool_overflow'] == 2
+
+
+def test_ical_key_detail_shares_request_connection(mocker):
+    from oncall.api.v0 import ical_key_detail
+    raw_connection = mocker.MagicMock(name='dummyDB')
+    raw_connection.cursor.return_value.rowcount = 1
+    raw_connection.cursor.return_value.fetchall.return_value = [{'requester': 'jdoe', 'name': 'foo', 'type': 'team',
+                                                                 'time_created': 0}]
+    connect_raw = mocker.patch('oncall.db.connect_raw', return_value=raw_connection)
+    mocker.patch('oncall.auth.authenticate_user', side_effect=lambda req: req.context.__setitem__('user', 'jdoe'))
+
+    api = falcon.App(middleware=[DBConnectionMiddleware()])
+    api.add_route('/api/v0/ical_key/key/{key}', ical_key_detail)
+    client = falcon.testing.TestClient(api)
+
+    # the requester check and the handler's own query share one checkout
+    assert client.simulate_get('/api/v0/ical_key/key/abc').status_code == 200
+    connect_raw.assert_called_once()
+    connect_raw.reset_mock()
+    assert client.simulate_delete('/api/v0/ical_key/key/abc').status_code == 200
+    connect_raw.assert_called_once()
+
+
+def test_metrics_sender_started_per_process(mocker):
+    from oncall import metrics
+    from oncall.app import MetricsSenderMiddleware
+    thread = mocker.patch('oncall.metrics.threading.Thread')
+    getpid = mocker.patch('oncall.metrics.os.getpid', return_value=100)
+    mocker.patch('oncall.metrics.sender_pid', None)
+
+    api = falcon.App(middleware=[MetricsSenderMiddleware(60)])
+    api.add_route('/dummy_path', DummyAPI())
+    client = falcon.testing.TestClient(api)
+    mocker.patch('oncall.db.connect_raw')
+    client.simulate_get('/dummy_path')
+    client.simulate_get('/dummy_path')
+    assert thread.return_value.start.call_count == 1
+
+    # a forked worker starts its own
+    getpid.return_value = 101
+    client.simulate_get('/dummy_path')
+    assert thread.return_value.start.call_count == 2
+    assert metrics.sender_pid == 101
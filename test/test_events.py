@@ -0,0 +1,122 @@
+# Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
+# See LICENSE in the project root for license information.
+
+import falcon
+import falcon.testing
+from ujson import loads
+from oncall.api.v0 import events
+
+EVENTS = [{'id': i, 'start': 100 * (i // 2), 'end': 100 * (i // 2) + 50, 'user': 'foo'} for i in range(1, 6)]
+
+
+class FakeCursor(object):
+    '''
+    Answers the event query from EVENTS, honouring the keyset condition and LIMIT.
+    '''
+    def __init__(self):
+        self.rows = []
+        self.queries = []
+
+    def execute(self, query, args=None):
+        self.queries.append((query, args))
+        if query.startswith('SELECT `id` FROM `team`'):
+            self.rows = [{'id': 1}]
+            return
+        rows = sorted(EVENTS, key=lambda ev: (ev['start'], ev['id']))
+        if '`event`.`id` > %s' in query:
+            start, event_id = args[-3], args[-1]
+            rows = [ev for ev in rows if (ev['start'], ev['id']) > (start, event_id)]
+        if 'LIMIT' in query:
+            rows = rows[:int(query.rsplit('LIMIT', 1)[1])]
+        self.rows = [dict(ev, _page_start=ev['start'], _page_id=ev['id']) if '_page_id' in query else dict(ev)
+                     for ev in rows]
+
+    def fetchone(self):
+        return self.rows[0]
+
+    def fetchall(self):
+        return self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    @property
+    def rowcount(self):
+        return len(self.rows)
+
+    def close(self):
+        pass
+
+
+def make_client(mocker):
+    cursor = FakeCursor()
+    connection = mocker.MagicMock()
+    connection.cursor.return_value = cursor
+    mocker.patch('oncall.db.connect', return_value=connection)
+    mocker.patch('oncall.api.v0.events.get_roster_by_team_id',
+                 return_value={'roster-foo': {'users': [{'name': 'foo'}]}})
+    app = falcon.App()
+    app.add_route('/api/v0/events', events)
+    return falcon.testing.TestClient(app), cursor
+
+
+def get(client, **params):
+    return client.simulate_get('/api/v0/events', params=dict(params, team__eq='team-foo', include_subscribed=False),
+                               extras={'beaker.session': {'user': 'foo'}})
+
+
+def test_events_keyset_pagination(mocker):
+    client, cursor = make_client(mocker)
+    seen = []
+    token = None
+    while True:
+        params = {'limit': 2}
+        if token:
+            params['page_token'] = token
+        re = get(client, **params)
+        assert re.status_code == 200
+        page = loads(re.text)
+        assert all('_page_id' not in ev for ev in page['events'])
+        seen += [ev['id'] for ev in page['events']]
+        token = page['next_token']
+        if token is None:
+            break
+    assert seen == [1, 2, 3, 4, 5]
+    query, args = cursor.queries[-1]
+    assert '`user`.`name` IN %s' in query and ['foo'] in args
+
+    assert get(client, limit=2, page_token='not a token').status_code == 400
+
+
+def test_events_unpaginated(mocker):
+    client, _ = make_client(mocker)
+    re = get(client)
+    assert [ev['id'] for ev in loads(re.text)] == [1, 2, 3, 4, 5]
+
+
+def test_events_streamed(mocker):
+    client, _ = make_client(mocker)
+    re = get(client, stream='ndjson')
+    assert re.headers['Content-Type'] == 'application/x-ndjson'
+    assert [loads(line)['id'] for line in re.text.splitlines()] == [1, 2, 3, 4, 5]
+
+    re = get(client, stream='json')
+    assert [ev['id'] for ev in loads(re.text)] == [1, 2, 3, 4, 5]
+    assert get(client, stream='xml').status_code == 400
+
+
+def test_events_streamed_in_batches(mocker):
+    client, cursor = make_client(mocker)
+    mocker.patch('oncall.api.v0.events.stream_batch_size', 2)
+    connection = events.db.connect()
+    connection.close.reset_mock()
+    re = get(client, stream='ndjson')
+    rows = [loads(line) for line in re.text.splitlines()]
+    assert [ev['id'] for ev in rows] == [1, 2, 3, 4, 5]
+    assert all('_page_id' not in ev for ev in rows)
+    # three batches of at most two events, each on a connection released before the next
+    assert len([query for query, _ in cursor.queries if 'LIMIT 2' in query]) == 3
+    assert connection.close.call_count == 4
+
+    re = get(client, stream='json', limit=3)
+    assert [ev['id'] for ev in loads(re.text)] == [1, 2, 3]
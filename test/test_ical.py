@@ -0,0 +1,218 @@
+# Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
+# See LICENSE in the project root for license information.
+
+from datetime import datetime as dt
+from datetime import UTC
+
+import falcon
+import falcon.testing
+from icalendar import Calendar, Event, vCalAddress, vText
+from oncall.api.v0 import ical
+
+
+class FakeCursor(object):
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def execute(self, query, args):
+        self.queries.append((query, args))
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+def test_get_user_info_batched():
+    cursor = FakeCursor([
+        {'username': 'foo', 'full_name': 'Foo', 'contact_mode': 'email', 'destination': 'foo@example.com'},
+        {'username': 'foo', 'full_name': 'Foo', 'contact_mode': 'call', 'destination': '+1 111'},
+    ])
+    users = ical.get_user_info(cursor, {'foo', 'bar'})
+    assert len(cursor.queries) == 1
+    assert users['foo'] == {'username': 'foo', 'full_name': 'Foo',
+                            'contacts': {'email': 'foo@example.com', 'call': '+1 111'}}
+    # users without contacts keep showing their username
+    assert users['bar'] == {'username': 'bar', 'contacts': {}}
+    assert ical.get_user_info(cursor, set()) == {}
+    assert len(cursor.queries) == 1
+
+
+EVENTS = [
+    {'id': 1, 'team': 'team-foo', 'role': 'primary', 'user': 'foo', 'start': 1600000000, 'end': 1600086400,
+     'team_id': 1, 'user_id': 10},
+    {'id': 2, 'team': 'team-foo', 'role': 'secondary', 'user': 'bar', 'start': 1600086400, 'end': 1600172800,
+     'team_id': 1, 'user_id': 11},
+]
+CONTACTS = [
+    {'username': 'foo', 'full_name': 'Foo, Jr.', 'contact_mode': 'email', 'destination': 'foo@example.com'},
+    {'username': 'bar', 'full_name': 'Bar', 'contact_mode': 'call', 'destination': '+1 111'},
+]
+
+
+class FeedCursor(FakeCursor):
+    '''
+    Answers contact queries from CONTACTS and event queries from EVENTS, honouring the keyset condition and LIMIT.
+    '''
+    def execute(self, query, args):
+        super(FeedCursor, self).execute(query, args)
+        if 'user_contact' in query:
+            self.rows = [row for row in CONTACTS if row['username'] in args[0]]
+            return
+        rows = EVENTS
+        if '`event`.`id` > %s' in query:
+            rows = [ev for ev in rows if (ev['start'], ev['id']) > (args[-3], args[-1])]
+        if 'LIMIT' in query:
+            rows = rows[:int(query.rsplit('LIMIT', 1)[1])]
+        self.rows = rows
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+def legacy_ical(events, identifier):
+    # what events_to_ical built before feeds were streamed
+    users = {row['username']: row for row in CONTACTS}
+    cal = Calendar()
+    cal.add('calscale', 'GREGORIAN')
+    cal.add('prodid', '-//Oncall//Oncall calendar feed//EN')
+    cal.add('version', '2.0')
+    cal.add('x-wr-calname', '%s Oncall Calendar' % identifier)
+    for event in events:
+        user = users[event['user']]
+        cal_event = Event()
+        cal_event.add('uid', 'event-%s@oncall' % event['id'])
+        cal_event.add('dtstart', dt.fromtimestamp(event['start'], UTC))
+        cal_event.add('dtend', dt.fromtimestamp(event['end'], UTC))
+        cal_event.add('dtstamp', dt.now(UTC))
+        cal_event.add('summary', '%s %s shift: %s' % (event['team'], event['role'], user['full_name']))
+        cal_event.add('description', '%s\n%s: %s' % (user['full_name'], user['contact_mode'], user['destination']))
+        cal_event.add('TRANSP', 'TRANSPARENT')
+        attendee = vCalAddress('MAILTO:%s' % (user['destination'] if user['contact_mode'] == 'email' else None))
+        attendee.params['cn'] = vText(user['full_name'])
+        attendee.params['ROLE'] = vText('REQ-PARTICIPANT')
+        cal_event.add('attendee', attendee, encode=0)
+        cal.add_component(cal_event)
+    return cal.to_ical()
+
+
+def strip_dtstamp(body):
+    return b''.join(line for line in body.splitlines(True) if not line.startswith(b'DTSTAMP:'))
+
+
+class Feed(object):
+    def __init__(self):
+        self.prepared = 0
+        self.on_prepare = None
+
+    def on_get(self, req, resp, name):
+        def prepare(cursor):
+            self.prepared += 1
+            if self.on_prepare:
+                self.on_prepare()
+            return 'SELECT events', (name,), {('team', 1)}
+        ical.respond(req, resp, ('test', name), 'team-foo', True, prepare)
+
+
+def test_feed_cache_and_etag(mocker):
+    connection = mocker.MagicMock()
+    connection.cursor.side_effect = lambda *args: FeedCursor([])
+    mocker.patch('oncall.db.connect', return_value=connection)
+    ical.ical_cache.clear()
+    feed = Feed()
+    app = falcon.App()
+    app.add_route('/feed/{name}', feed)
+    client = falcon.testing.TestClient(app)
+
+    re = client.simulate_get('/feed/10')
+    assert re.status_code == 200
+    assert re.headers['Content-Type'] == 'text/calendar'
+    etag = re.headers['ETag']
+    assert strip_dtstamp(re.content) == strip_dtstamp(legacy_ical(EVENTS, 'team-foo'))
+    # the request connection, and the one the events were read from
+    assert connection.close.call_count == 2
+
+    # the rendered body was cached and is served with the same ETag
+    re = client.simulate_get('/feed/10')
+    assert feed.prepared == 1
+    assert re.headers['ETag'] == etag
+    assert strip_dtstamp(re.content) == strip_dtstamp(legacy_ical(EVENTS, 'team-foo'))
+    re = client.simulate_get('/feed/10', headers={'If-None-Match': etag})
+    assert re.status_code == 304
+    assert re.content == b''
+
+    client.simulate_get('/feed/11')
+    assert feed.prepared == 2
+    ical.invalidate_ical(users=[11])
+    client.simulate_get('/feed/10')
+    assert feed.prepared == 3
+    ical.invalidate_ical()
+    assert len(ical.ical_cache) == 0
+
+    mocker.patch('oncall.api.v0.ical.max_cached_body', 100)
+    client.simulate_get('/feed/10')
+    client.simulate_get('/feed/10')
+    assert feed.prepared == 5
+    assert len(ical.ical_cache) == 0
+
+
+def test_feed_invalidated_while_rendered_is_not_cached(mocker):
+    connection = mocker.MagicMock()
+    connection.cursor.side_effect = lambda *args: FeedCursor([])
+    mocker.patch('oncall.db.connect', return_value=connection)
+    ical.ical_cache.clear()
+    feed = Feed()
+    app = falcon.App()
+    app.add_route('/feed/{name}', feed)
+    client = falcon.testing.TestClient(app)
+
+    # an event of the team changes after the feed's generation was read
+    feed.on_prepare = lambda: ical.invalidate_ical(teams=[1])
+    re = client.simulate_get('/feed/10')
+    assert re.status_code == 200
+    assert 'ETag' in re.headers
+    assert len(ical.ical_cache) == 0
+
+    feed.on_prepare = None
+    client.simulate_get('/feed/10')
+    client.simulate_get('/feed/10')
+    assert feed.prepared == 2
+
+
+def test_feed_streamed_in_batches(mocker):
+    cursors = []
+
+    def cursor(*args):
+        cursors.append(FeedCursor([]))
+        return cursors[-1]
+
+    connection = mocker.MagicMock()
+    connection.cursor.side_effect = cursor
+    mocker.patch('oncall.db.connect', return_value=connection)
+    mocker.patch('oncall.api.v0.ical.feed_batch_size', 1)
+    ical.ical_cache.clear()
+    app = falcon.App()
+    app.add_route('/feed/{name}', Feed())
+    client = falcon.testing.TestClient(app)
+
+    re = client.simulate_get('/feed/10')
+    assert strip_dtstamp(re.content) == strip_dtstamp(legacy_ical(EVENTS, 'team-foo'))
+    # one event per batch, and an empty last batch; each batch on a connection released before it is written
+    queries = [query for cursor in cursors for query, _ in cursor.queries]
+    assert len([query for query in queries if 'LIMIT 1' in query]) == 3
+    assert len([query for query in queries if 'user_contact' in query]) == 2
+    assert connection.close.call_count == 4
+    entry = ical.ical_cache.get(('test', '10'))
+    assert re.headers['ETag'] == '"%s"' % entry['etag']
+    assert entry['tags'] == {('team', 1), ('user', 10), ('user', 11)}
+
+
+def test_events_to_ical_matches_calendar(mocker):
+    connection = mocker.MagicMock()
+    connection.cursor.return_value = FeedCursor([])
+    connection.cursor.return_value.rows = CONTACTS
+    mocker.patch('oncall.db.connect', return_value=connection)
+    body = ical.events_to_ical(EVENTS, 'team-foo')
+    assert strip_dtstamp(body) == strip_dtstamp(legacy_ical(EVENTS, 'team-foo'))
@@ -0,0 +1,221 @@
+# Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
+# See LICENSE in the project root for license information.
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from ujson import dumps, loads
+from oncall import messengers, metrics
+from oncall.messengers import MessengerGuard, MessengerUnavailable, TokenBucket
+
+
+class FakeMessenger(object):
+    supports = frozenset(['email'])
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.sent = []
+
+    def send(self, message):
+        if self.fail:
+            raise ValueError('messenger is down')
+        self.sent.append(message)
+
+
+def test_circuit_breaker(mocker):
+    clock = mocker.patch('oncall.messengers.time.time', return_value=1000)
+    guard = MessengerGuard(FakeMessenger(fail=True), {'type': 'fake', 'breaker_threshold': 2,
+                                                      'breaker_cooldown': 30})
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            guard.send({})
+    # open: the messenger is skipped without being called
+    with pytest.raises(MessengerUnavailable):
+        guard.send({})
+    assert metrics.stats['messenger_fake_fail_cnt'] >= 2
+
+    # after the cooldown, a single trial send goes through; its success closes the breaker
+    clock.return_value = 1030
+    guard.messenger.fail = False
+    guard.send({'id': 1})
+    guard.send({'id': 2})
+    assert guard.messenger.sent == [{'id': 1}, {'id': 2}]
+
+
+def test_rate_limit(mocker):
+    mocker.patch('oncall.messengers.time.time', return_value=1000)
+    sleep = mocker.patch('oncall.messengers.sleep')
+    guard = MessengerGuard(FakeMessenger(), {'type': 'fake', 'rate': 1, 'burst': 2, 'max_wait': 1})
+    guard.send({})
+    guard.send({})
+    sleep.assert_called_with(0)
+    # out of burst: waits for the next token
+    guard.send({})
+    sleep.assert_called_with(1.0)
+    with pytest.raises(MessengerUnavailable):
+        guard.send({})
+    assert len(guard.messenger.sent) == 3
+
+
+def test_token_bucket_refill(mocker):
+    clock = mocker.patch('oncall.messengers.time.time', return_value=1000)
+    bucket = TokenBucket(2, burst=1)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0.5
+    clock.return_value = 1001
+    assert bucket.reserve() == 0
+
+
+def test_send_message_skips_to_next_messenger(mocker):
+    mocker.patch.dict(messengers._active_messengers, clear=True)
+    down = MessengerGuard(FakeMessenger(fail=True), {'type': 'down', 'breaker_threshold': 1})
+    full = MessengerGuard(FakeMessenger(), {'type': 'full', 'max_concurrency': 1, 'max_wait': 0})
+    up = MessengerGuard(FakeMessenger(), {'type': 'up'})
+    full.slots.acquire()
+    messengers._active_messengers['email'] = [down, full, up]
+
+    messengers.send_message({'mode': 'email'})
+    messengers.send_message({'mode': 'email'})
+    assert len(up.messenger.sent) == 2
+    assert full.messenger.sent == []
+    assert metrics.stats['messenger_down_skip_cnt'] >= 1
+    assert metrics.stats['messenger_full_skip_cnt'] >= 2
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    '''
+    Stands in for the Rocket.Chat, Teams webhook and Iris APIs, counting the connections it accepts.
+    '''
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately; without this, delayed ACKs stall kept-alive connections
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super(StandInHandler, self).setup()
+        self.server.connections += 1
+
+    def reply(self, status, body):
+        body = dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        payload = loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append((self.path, payload))
+        if self.path == '/api/v1/login':
+            self.server.logins += 1
+            self.reply(200, {'status': 'success', 'data': {'authToken': 'token-%s' % self.server.logins,
+                                                           'userId': 'oncall'}})
+        elif self.path == '/api/v1/chat.postMessage':
+            if self.headers['X-Auth-Token'] != 'token-%s' % self.server.logins or self.server.expire_token:
+                self.server.expire_token = False
+                self.reply(401, {'success': False})
+            else:
+                self.reply(200, {'success': True})
+        elif self.path == '/down':
+            self.reply(500, {})
+        else:
+            self.reply(200, {})
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.connections = server.logins = 0
+    server.requests = []
+    server.expire_token = False
+    server.url = 'http://127.0.0.1:%s' % server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def rocketchat_contacts(mocker):
+    cursor = mocker.MagicMock()
+    cursor.rowcount = 1
+    cursor.fetchone.return_value = ('foo.chat',)
+    connection = mocker.MagicMock()
+    connection.cursor.return_value = cursor
+    mocker.patch('oncall.db.connect', return_value=connection)
+
+
+def test_rocketchat_session(mocker, stand_in):
+    from oncall.messengers.rocketchat_messenger import rocketchat_messenger
+    rocketchat_contacts(mocker)
+    messenger = rocketchat_messenger({'user': 'oncall', 'password': 'secret', 'api_host': stand_in.url,
+                                      'timeout': [1, 5]})
+    for _ in range(5):
+        messenger.send({'user': 'foo', 'subject': 'subject', 'body': 'body'})
+    assert stand_in.logins == 1
+    assert stand_in.requests[-1] == ('/api/v1/chat.postMessage', {'channel': '@foo.chat', 'text': 'subject -- body'})
+
+    # the token is only renewed when rejected
+    stand_in.expire_token = True
+    messenger.send({'user': 'foo', 'subject': 'subject', 'body': 'body'})
+    assert stand_in.logins == 2
+    assert messenger.token == 'token-2'
+    # all of it over a single kept-alive connection
+    assert stand_in.connections == 1
+
+
+def test_teams_and_iris_sessions(stand_in):
+    from oncall.messengers.teams_messenger import teams_messenger
+    from oncall.messengers.iris_messenger import iris_messenger
+    teams = teams_messenger({'webhook': stand_in.url + '/webhook'})
+    iris = iris_messenger({'application': 'oncall', 'iris_api_key': 'magic', 'api_host': stand_in.url})
+    for _ in range(3):
+        teams.send({'user': 'foo', 'subject': 'subject', 'body': 'body'})
+        iris.send({'user': 'foo', 'mode': 'email', 'subject': 'subject', 'body': 'body'})
+    assert stand_in.requests[0] == ('/webhook', {'title': 'subject', 'text': 'User: foo Message: body'})
+    assert stand_in.requests[1][0] == '/v0/notifications'
+    assert len(stand_in.requests) == 6
+    assert stand_in.connections == 2
+
+    # failed posts are raised, to fail over and trip the breaker
+    down = MessengerGuard(teams_messenger({'webhook': stand_in.url + '/down'}),
+                          {'type': 'teams_down', 'breaker_threshold': 1})
+    with pytest.raises(requests.HTTPError):
+        down.send({'user': 'foo', 'subject': 'subject', 'body': 'body'})
+    with pytest.raises(MessengerUnavailable):
+        down.send({'user': 'foo', 'subject': 'subject', 'body': 'body'})
+    assert metrics.stats['messenger_teams_down_fail_cnt'] >= 1
+
+
+def test_benchmark_keep_alive(mocker, stand_in):
+    '''
+    Messages/sec through the Rocket.Chat messenger against the local stand-in, opening a connection
+    per request (as before) and with the pooled session. Run with -s to see the numbers.
+    '''
+    from oncall.messengers.rocketchat_messenger import rocketchat_messenger
+    rocketchat_contacts(mocker)
+    messenger = rocketchat_messenger({'user': 'oncall', 'password': 'secret', 'api_host': stand_in.url})
+    message = {'user': 'foo', 'subject': 'subject', 'body': 'body'}
+    count = 200
+
+    session = messenger.session
+    messenger.session = requests
+    start = time.time()
+    for _ in range(count):
+        messenger.send(message)
+    unpooled = count / (time.time() - start)
+    unpooled_connections = stand_in.connections
+
+    messenger.session = session
+    start = time.time()
+    for _ in range(count):
+        messenger.send(message)
+    pooled = count / (time.time() - start)
+
+    print('\nrocketchat messages/sec: %.0f with a connection per message, %.0f pooled' % (unpooled, pooled))
+    assert unpooled_connections >= count
+    assert stand_in.connections - unpooled_connections <= 1
@@ -1,7 +1,11 @@
 # Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
 # See LICENSE in the project root for license information.
 
-from ujson import dumps as json_dumps
+import time
+import gevent
+import pytest
+from ujson import dumps as json_dumps, loads as json_loads
+from oncall import metrics
 
 WEEK = 60 * 60 * 24 * 7
 
@@ -15,14 +19,404 @@ def test_send_notification(mocker):
         assert msg['body'] == 'foo'
 
     from oncall.bin.notifier import send_queue, format_and_send_message
+    from oncall.notifier.registry import NotificationTemplate
     mocker.patch('oncall.bin.notifier.send_message').side_effect = check_message
     mock_mark_sent = mocker.patch('oncall.bin.notifier.mark_message_as_sent')
+    mocker.patch('oncall.notifier.registry.loaded_at', time.time())
+    mocker.patch.dict('oncall.notifier.registry.tables', {
+        'modes': {1: 'email'},
+        'types': {2: NotificationTemplate('foo', '%(foo)s', '%(baz)s')}})
 
     while send_queue.qsize() > 0:
         send_queue.get()
     send_time = 1476910800  # 14:00:00 on Oct 16, 2016
-    send_queue.put({'user': 'username', 'mode': 'email', 'context': json_dumps({'foo': 'bar', 'baz': 'foo'}),
-                    'send_time': send_time, 'subject': '%(foo)s', 'body': '%(baz)s'})
+    send_queue.put([{'id': 1, 'user': 'username', 'mode_id': 1, 'type_id': 2,
+                     'context': json_dumps({'foo': 'bar', 'baz': 'foo'}), 'send_time': send_time}])
     format_and_send_message()
     assert send_queue.qsize() == 0
     mock_mark_sent.assert_called_once()
+
+
+def test_digest(mocker):
+    from oncall.bin import notifier
+    from oncall.notifier.registry import NotificationTemplate
+    mocker.patch('oncall.bin.notifier.digest', {'window': 60, 'max_messages': 3, 'types': ['event_created']})
+    mocker.patch('oncall.notifier.registry.loaded_at', time.time())
+    mocker.patch.dict('oncall.notifier.registry.tables', {
+        'modes': {1: 'email'},
+        'types': {1: NotificationTemplate('event_created', 'Created %(id)s', 'Event %(id)s'),
+                  2: NotificationTemplate('oncall_reminder', 'Reminder %(id)s', 'Reminder %(id)s')}})
+
+    def row(id, user='foo', send_time=1000, type_id=1):
+        return {'id': id, 'user': user, 'mode_id': 1, 'type_id': type_id, 'send_time': send_time,
+                'context': json_dumps({'id': id})}
+
+    rows = [row(1), row(2, send_time=1010), row(3, user='bar'), row(4, send_time=1030), row(5, send_time=1040),
+            row(6, send_time=1100), row(7, type_id=2), row(8, type_id=2)]
+    groups = notifier.coalesce(rows)
+    assert [[r['id'] for r in group] for group in groups] == [[1, 2, 4], [3], [7], [8], [5, 6]]
+
+    sent = mocker.patch('oncall.bin.notifier.send_message')
+    mocker.patch('oncall.bin.notifier.send_queue', notifier.queue.Queue())
+    notifier.send_queue.put(groups[0])
+    notifier.format_and_send_message()
+    msg = sent.call_args[0][0]
+    assert msg['subject'] == 'Created 1 (and 2 more)'
+    assert msg['body'] == 'Created 1\nEvent 1\n\nCreated 2\nEvent 2\n\nCreated 4\nEvent 4'
+    # every coalesced row is marked sent
+    assert notifier.sent_ids[-3:] == [1, 2, 4]
+    notifier.sent_ids.clear()
+
+    sent.side_effect = Exception('messenger is down')
+    notifier.send_queue.put(groups[4])
+    notifier.format_and_send_message()
+    assert [failure[0] for failure in notifier.failures[-2:]] == [5, 6]
+    assert notifier.failures[-1][2] == 'messenger is down'
+    notifier.failures.clear()
+
+
+def test_registry(mocker):
+    from oncall.notifier import registry
+
+    class RegistryCursor(object):
+        def execute(self, query):
+            if 'notification_type' in query:
+                self.rows = [(1, 'oncall_reminder', 'Reminder: %(team)s', '%(role)s in %(time_before)s'),
+                             (2, 'broken', '%(team', 'body')]
+            else:
+                self.rows = [(1, 'email'), (2, 'sms')]
+
+        def __iter__(self):
+            return iter(self.rows)
+
+        def close(self):
+            pass
+
+    connection = mocker.MagicMock()
+    connection.cursor.return_value = RegistryCursor()
+    connect = mocker.patch('oncall.db.connect', return_value=connection)
+    clock = mocker.patch('oncall.notifier.registry.time.time', return_value=1000)
+    mocker.patch('oncall.notifier.registry.loaded_at', 0)
+
+    assert registry.get_mode_id('sms') == 2
+    assert registry.get_type_id('oncall_reminder') == 1
+    assert registry.get_mode(1) == 'email'
+    assert registry.get_template(1).render({'team': 'foo', 'role': 'primary', 'time_before': '1 day'}) == \
+        ('Reminder: foo', 'primary in 1 day')
+    assert connect.call_count == 1
+    # malformed templates are caught once, when loaded
+    assert registry.get_template(2).error is not None
+    with pytest.raises(ValueError):
+        registry.get_template(2).render({'team': 'foo'})
+
+    # unknown keys reload, but not more than once every miss_reload_interval
+    assert registry.get_mode(3) is None
+    assert connect.call_count == 1
+    clock.return_value = 1000 + registry.miss_reload_interval + 1
+    assert registry.get_mode(3) is None
+    assert connect.call_count == 2
+    clock.return_value += registry.refresh_interval + 1
+    registry.get_mode(1)
+    assert connect.call_count == 3
+
+
+def test_registry_reloaded_once(mocker):
+    from oncall.notifier import registry
+
+    class YieldingCursor(object):
+        def execute(self, query):
+            gevent.sleep(0.01)
+            self.rows = [(1, 'oncall_reminder', 'subject', 'body')] if 'notification_type' in query else [(1, 'email')]
+
+        def __iter__(self):
+            return iter(self.rows)
+
+        def close(self):
+            pass
+
+    connection = mocker.MagicMock()
+    connection.cursor.return_value = YieldingCursor()
+    connect = mocker.patch('oncall.db.connect', return_value=connection)
+    mocker.patch('oncall.notifier.registry.loaded_at', 0)
+    mocker.patch.dict('oncall.notifier.registry.tables', {'types': {}, 'type_ids': {}, 'modes': {}, 'mode_ids': {}})
+
+    # first load: every greenlet waits for the one loading
+    lookups = [gevent.spawn(registry.get_mode, 1) for _ in range(100)]
+    gevent.joinall(lookups)
+    assert [lookup.value for lookup in lookups] == ['email'] * 100
+    assert connect.call_count == 1
+
+    # refresh: one greenlet reloads, the others answer from the current tables
+    registry.loaded_at -= registry.refresh_interval + 1
+    lookups = [gevent.spawn(registry.get_mode, 1) for _ in range(100)]
+    gevent.joinall(lookups)
+    assert [lookup.value for lookup in lookups] == ['email'] * 100
+    assert connect.call_count == 2
+
+
+class FakeCursor(object):
+    def __init__(self, due):
+        self.due = due
+        self.queries = []
+        self.rowcount = 0
+        self.rows = []
+
+    def execute(self, query, args):
+        self.queries.append((query, args))
+        if query.startswith('UPDATE `notification_queue` SET `claimed_by`'):
+            self.rowcount = min(self.due, args[-1])
+            self.rows = [{'id': i} for i in range(self.rowcount)]
+            self.due -= self.rowcount
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+def test_poll_claims_room_in_queue(mocker):
+    from oncall.bin import notifier
+    mocker.patch('oncall.bin.notifier.send_queue', notifier.queue.Queue(maxsize=3))
+    cursor = FakeCursor(due=5)
+    connection = mocker.MagicMock()
+    connection.cursor.return_value = cursor
+    mocker.patch('oncall.db.connect', return_value=connection)
+
+    # the claim filled the queue, more messages may be due
+    assert notifier.poll() is True
+    assert notifier.send_queue.qsize() == 3
+    claim = cursor.queries[0][1][0]
+    assert cursor.queries[1][1][1] == claim
+    # no room: nothing is claimed
+    assert notifier.poll() is True
+    assert len(cursor.queries) == 2
+
+    notifier.send_queue.get()
+    notifier.send_queue.get()
+    assert notifier.poll() is True
+    assert cursor.due == 0
+    notifier.send_queue.get()
+    assert notifier.poll() is False
+    assert notifier.send_queue.qsize() == 2
+
+
+def test_flush_message_status(mocker):
+    from oncall.bin import notifier
+    cursor = FakeCursor(due=0)
+    connection = mocker.MagicMock()
+    connection.cursor.return_value = cursor
+    mocker.patch('oncall.db.connect', return_value=connection)
+    mocker.patch('oncall.bin.notifier.time.time', return_value=1000)
+    mocker.patch('oncall.bin.notifier.random.uniform', side_effect=lambda low, high: high)
+
+    for i in range(3):
+        notifier.mark_message_as_sent({'id': i})
+    notifier.mark_message_as_unsent({'id': 3, 'attempts': 0}, ValueError('timeout'))
+    notifier.mark_message_as_unsent({'id': 4, 'attempts': 2}, ValueError('timeout'))
+    notifier.mark_message_as_unsent({'id': 5, 'attempts': 4}, ValueError('bad user'))
+    notifier.flush_message_status()
+    sent, retried, dead = cursor.queries
+    assert sent[1] == ([0, 1, 2],)
+    # retries are pushed back 60s, then 240s after the third attempt
+    assert retried[1] == [3, 1060, 4, 1240, 3, 'timeout', 4, 'timeout', [3, 4]]
+    assert 'dead_letter' in dead[0]
+    assert dead[1] == [5, 'bad user', [5]]
+    assert notifier.sent_ids == [] and notifier.failures == []
+
+    notifier.flush_message_status()
+    assert len(cursor.queries) == 3
+
+    # ids are kept for the next flush if the update fails
+    connection.commit.side_effect = Exception('database is down')
+    notifier.mark_message_as_sent({'id': 6})
+    notifier.flush_message_status()
+    assert notifier.sent_ids == [6]
+    notifier.sent_ids.clear()
+
+
+def test_renew_leases(mocker):
+    from oncall.bin import notifier
+
+    class LeaseCursor(object):
+        # rows 1 and 2 are still held by the claim, row 3 was claimed by another poller
+        def __init__(self):
+            self.queries = []
+            self.rowcount = 0
+            self.rows = []
+
+        def execute(self, query, args):
+            self.queries.append((query, args))
+            held = [message_id for message_id in args[-1] if message_id != 3]
+            self.rowcount = len(held)
+            self.rows = [(message_id,) for message_id in held]
+
+        def __iter__(self):
+            return iter(self.rows)
+
+        def close(self):
+            pass
+
+    cursor = LeaseCursor()
+    connection = mocker.MagicMock()
+    connection.cursor.return_value = cursor
+    mocker.patch('oncall.db.connect', return_value=connection)
+    clock = mocker.patch('oncall.bin.notifier.time.time', return_value=1000)
+    mocker.patch.dict('oncall.bin.notifier.leases', {'claim': [1000 + notifier.claim_lease, {1, 2, 3}]}, clear=True)
+    mocker.patch('oncall.bin.notifier.lost_ids', set())
+
+    # not within half a lease of expiring yet
+    notifier.renew_leases()
+    assert cursor.queries == []
+
+    clock.return_value = 1000 + notifier.claim_lease // 2 + 1
+    notifier.renew_leases()
+    renew, check = cursor.queries
+    assert renew[1] == (clock.return_value + notifier.claim_lease, 'claim', [1, 2, 3])
+    assert notifier.leases == {'claim': [clock.return_value + notifier.claim_lease, {1, 2}]}
+    assert notifier.lost_ids == {3}
+    assert metrics.stats['message_lease_lost_cnt'] >= 1
+
+    # the worker drops the message it lost
+    send = mocker.patch('oncall.bin.notifier.send_message')
+    mocker.patch('oncall.bin.notifier.render_message', side_effect=lambda rows: {'ids': [row['id'] for row in rows]})
+    mocker.patch('oncall.bin.notifier.send_queue', notifier.queue.Queue())
+    notifier.send_queue.put([{'id': 2, 'user': 'foo'}, {'id': 3, 'user': 'foo'}])
+    notifier.send_queue.put([{'id': 3, 'user': 'foo'}])
+    notifier.format_and_send_message()
+    send.assert_called_once_with({'ids': [2]})
+    assert notifier.lost_ids == set()
+
+    # leases are released once the status of their messages is flushed
+    notifier.mark_message_as_sent({'id': 1})
+    notifier.flush_message_status()
+    notifier.sent_ids.clear()
+    assert notifier.leases == {}
+
+
+def test_retry_delay(mocker):
+    from oncall.bin import notifier
+    delays = [notifier.retry_delay(attempts) for attempts in range(1, 10)]
+    assert 30 <= delays[0] <= 60
+    assert 1800 <= delays[-1] <= 3600
+
+
+class LockCursor(object):
+    '''
+    Stands for the MySQL named lock, shared by the connections of several notifiers.
+    '''
+    holder = None
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.result = None
+
+    def execute(self, query, args):
+        if query.startswith('SELECT GET_LOCK'):
+            if LockCursor.holder in (None, self.connection):
+                LockCursor.holder = self.connection
+            self.result = int(LockCursor.holder is self.connection)
+        else:
+            self.result = int(LockCursor.holder is self.connection)
+
+    def fetchone(self):
+        return (self.result,)
+
+    def close(self):
+        pass
+
+
+def lock_connection(mocker):
+    connection = mocker.MagicMock()
+    connection.cursor.side_effect = lambda: LockCursor(connection)
+
+    def invalidate():
+        if LockCursor.holder is connection:
+            LockCursor.holder = None
+    connection.invalidate.side_effect = invalidate
+    return connection
+
+
+def test_leader_election_failover(mocker):
+    from oncall.notifier.leader import LeaderElection
+    LockCursor.holder = None
+    connections = []
+
+    def connect():
+        connections.append(lock_connection(mocker))
+        return connections[-1]
+    mocker.patch('oncall.db.connect', side_effect=connect)
+    first, second = LeaderElection(), LeaderElection()
+
+    assert first.check() is True
+    assert second.check() is False
+    connections[-1].close.assert_called_once()
+    assert first.check() is True
+
+    # the leader's session dies, releasing the lock
+    LockCursor.holder = None
+    assert first.check() is False
+    assert second.check() is True
+    assert first.check() is False
+
+
+def test_update_leader_tasks(mocker):
+    from oncall.bin import notifier
+    election = mocker.MagicMock()
+    spawn = mocker.patch('oncall.bin.notifier.spawn')
+    killall = mocker.patch('oncall.bin.notifier.killall')
+    task = mocker.MagicMock()
+    tasks = {'reminder': (task, {'activated': True})}
+    running = {}
+
+    election.check.return_value = True
+    notifier.update_leader_tasks(election, tasks, running)
+    spawn.assert_called_once_with(task, {'activated': True})
+    # still running: not respawned
+    notifier.update_leader_tasks(election, tasks, running)
+    assert spawn.call_count == 1
+
+    election.check.return_value = False
+    notifier.update_leader_tasks(election, tasks, running)
+    killall.assert_called_once()
+    assert running == {}
+
+
+def test_create_window_reminders(mocker):
+    from oncall.notifier import reminder
+    mocker.patch('oncall.notifier.registry.loaded_at', time.time())
+    mocker.patch.dict('oncall.notifier.registry.tables', {'type_ids': {'oncall_reminder': 1},
+                                                          'mode_ids': {'email': 1, 'sms': 2, 'call': 3}})
+    mocker.patch('oncall.notifier.reminder.insert_batch_size', 2)
+
+    class ReminderCursor(object):
+        def __init__(self):
+            self.queries = []
+
+        def execute(self, query, args):
+            self.queries.append((query, args))
+            if 'FROM `user_contact`' in query:
+                self.rows = [{'user_id': 10, 'mode_id': 2}, {'user_id': 10, 'mode_id': 3},
+                             {'user_id': 11, 'mode_id': 3}]
+
+        def fetchall(self):
+            return [{'name': 'user-%s' % user_id, 'user_id': user_id, 'time_before': 86400, 'mode': 'email',
+                     'team': 'team-foo', 'start': 1476910800 + i, 'id': i, 'role': 'primary', 'time_zone': None}
+                    for i, user_id in enumerate([10, 11, 10])]
+
+        def __iter__(self):
+            return iter(self.rows)
+
+    cursor = ReminderCursor()
+    assert reminder.create_window_reminders(1476824400, 1476824460, 'US/Pacific', cursor) == 3
+    # candidates, contacts, then the inserts of two batches
+    assert len(cursor.queries) == 4
+    assert cursor.queries[0][1][0] == 1
+    assert sorted(cursor.queries[1][1][0]) == [10, 11]
+    first, second = cursor.queries[2][1], cursor.queries[3][1]
+    assert len(first) == 10 and len(second) == 5
+    assert first[:3] == [10, 1476824400, 1]
+    contexts = [json_loads(args[3]) for args in (first[:5], first[5:], second)]
+    assert 'contact_warning' not in contexts[0]
+    assert 'SMS Number' in contexts[1]['contact_warning']
+    assert contexts[2]['start_time'] == '2016-10-19 14:00:02 US/Pacific'
@@ -0,0 +1,109 @@
+# Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
+# See LICENSE in the project root for license information.
+
+from oncall.api.v0 import oncall_snapshot
+from oncall.api.v0.oncall_snapshot import get_snapshot, get_current, invalidate_oncall, oncall_rows
+
+
+def event(id, user_id, role, start, end, team_id=1):
+    return {'id': id, 'start': start, 'end': end, 'user_id': user_id, 'team_id': team_id, 'role_id': 1,
+            'user': 'user-%s' % user_id, 'full_name': 'User %s' % user_id, 'photo_url': None,
+            'team': 'team-%s' % team_id, 'role': role, 'role_display_name': role, 'roster': 'roster-foo'}
+
+
+class FakeCursor(object):
+    '''
+    Team 1 subscribes to team 2. Events: user 10 primary 100-179, user 11 primary 180-299,
+    user 12 secondary of team 2 150-400.
+    '''
+    def __init__(self):
+        self.events = [event(1, 10, 'primary', 100, 179), event(2, 11, 'primary', 180, 299),
+                       event(3, 12, 'secondary', 150, 400, team_id=2)]
+        self.loads = 0
+        self.rows = []
+
+    def execute(self, query, args):
+        if 'FROM `team` WHERE' in query:
+            self.loads += 1
+            self.rows = [{'id': 1, 'name': 'team-1', 'override_phone_number': '+1 999'}] if args == 'team-1' else []
+        elif 'team_subscription' in query:
+            self.rows = [{'subscription_id': 2, 'role_id': 1}]
+        elif 'MIN(' in query:
+            now = args[0]
+            upcoming = [ev for ev in self.events if ev['start'] > now]
+            first = {}
+            for ev in upcoming:
+                key = (ev['team_id'], ev['role_id'])
+                first[key] = min(first.get(key, ev['start']), ev['start'])
+            self.rows = [dict(ev) for ev in upcoming if first[(ev['team_id'], ev['role_id'])] == ev['start']]
+        elif 'user_contact' in query:
+            self.rows = [{'user_id': u, 'mode': 'call', 'destination': '+1 %s' % u} for u in args[0] if u != 12]
+        else:
+            now = args[-1]
+            self.rows = [dict(ev) for ev in self.events if ev['start'] <= now <= ev['end']]
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+def test_snapshot_rolls_over_at_shift_boundaries(mocker):
+    invalidate_oncall()
+    clock = mocker.patch('oncall.api.v0.oncall_snapshot.time.time', return_value=160)
+    cursor = FakeCursor()
+
+    snapshot = get_snapshot(cursor, 'team-1')
+    assert [ev['user'] for ev in get_current(snapshot, 'primary')] == ['user-10']
+    assert [ev['user'] for ev in get_current(snapshot, 'secondary')] == ['user-12']
+    assert [ev['user'] for ev in snapshot['next']] == ['user-11']
+    assert snapshot['valid_until'] == 180
+    assert snapshot['team_ids'] == {1, 2}
+
+    clock.return_value = 179
+    assert get_snapshot(cursor, 'team-1') is snapshot
+    assert cursor.loads == 1
+
+    clock.return_value = 180
+    snapshot = get_snapshot(cursor, 'team-1')
+    assert cursor.loads == 2
+    assert [ev['user'] for ev in get_current(snapshot, 'primary')] == ['user-11']
+    assert snapshot['next'] == []
+    assert snapshot['valid_until'] == 300
+
+    assert get_snapshot(cursor, 'team-missing') is None
+
+
+def test_snapshot_invalidation(mocker):
+    invalidate_oncall()
+    mocker.patch('oncall.api.v0.oncall_snapshot.time.time', return_value=160)
+    cursor = FakeCursor()
+    get_snapshot(cursor, 'team-1')
+    invalidate_oncall(teams=[3])
+    get_snapshot(cursor, 'team-1')
+    assert cursor.loads == 1
+    # events of a subscribed team drop the subscriber's snapshot too
+    invalidate_oncall(teams=[2])
+    get_snapshot(cursor, 'team-1')
+    assert cursor.loads == 2
+    invalidate_oncall()
+    assert len(oncall_snapshot.snapshot_cache) == 0
+
+
+def test_oncall_rows(mocker):
+    invalidate_oncall()
+    mocker.patch('oncall.api.v0.oncall_snapshot.time.time', return_value=160)
+    snapshot = get_snapshot(FakeCursor(), 'team-1')
+    rows = oncall_rows(get_current(snapshot), lambda ev: snapshot['override_phone_number'])
+    assert rows == [
+        {'full_name': 'User 10', 'start': 100, 'end': 179, 'user': 'user-10', 'team': 'team-1', 'role': 'primary',
+         'contacts': {'call': '+1 999', 'sms': '+1 999'}},
+        {'full_name': 'User 12', 'start': 150, 'end': 400, 'user': 'user-12', 'team': 'team-2', 'role': 'secondary',
+         'contacts': {}, 'destination': None},
+    ]
+    # the snapshot itself is left untouched
+    assert get_current(snapshot, 'primary')[0]['contacts'] == {'call': '+1 10'}
@@ -0,0 +1,55 @@
+# Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
+# See LICENSE in the project root for license information.
+
+from oncall.api.v0.roster_visibility import get_visible_user_ids
+
+# roster 1 has users 10 (viewer, primary schedule), 11 and 12
+SNAPSHOT = {
+    'team': 'team-foo',
+    'rosters': [(1, 'roster-foo')],
+    'members': [(1, 10, 'viewer', True), (1, 11, 'bar', True), (1, 12, 'baz', False)],
+    'admins': {99},
+    'schedule_orders': {10: {1}},
+}
+
+
+class FakeCursor(object):
+    def __init__(self, current, ever):
+        self.current = current
+        self.ever = ever
+        self.rows = []
+
+    def execute(self, query, args):
+        if 'EXISTS' in query:
+            user_ids, max_order = args
+            self.rows = [{'id': u} for u in user_ids if any(o <= max_order for o in self.ever.get(u, ()))]
+        else:
+            self.rows = [{'user_id': u, 'display_order': o} for u, orders in self.current.items() for o in orders]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+def test_admin_and_god_see_everyone():
+    cursor = FakeCursor({}, {})
+    assert get_visible_user_ids(cursor, SNAPSHOT, {'id': 99, 'god': 0}) == {10, 11, 12}
+    assert get_visible_user_ids(cursor, SNAPSHOT, {'id': 50, 'god': 1}) == {10, 11, 12}
+
+
+def test_anonymous_sees_current_primary():
+    cursor = FakeCursor({11: {1}, 12: {2}}, {})
+    assert get_visible_user_ids(cursor, SNAPSHOT, None) == {11}
+
+
+def test_outsider_sees_nobody():
+    cursor = FakeCursor({11: {1}}, {11: {1}})
+    assert get_visible_user_ids(cursor, SNAPSHOT, {'id': 50, 'god': 0}) == set()
+
+
+def test_team_member_visibility():
+    # 11 held a primary shift at some point; 12 is currently secondary (display order 1 + 1)
+    cursor = FakeCursor({12: {2}}, {10: {1}, 11: {1, 3}, 12: {2}})
+    assert get_visible_user_ids(cursor, SNAPSHOT, {'id': 10, 'god': 0}) == {10, 11, 12}
+    # without the current secondary shift, 12 only ever held roles above the viewer's
+    cursor = FakeCursor({}, {10: {1}, 11: {1, 3}, 12: {2}})
+    assert get_visible_user_ids(cursor, SNAPSHOT, {'id': 10, 'god': 0}) == {10, 11}
@@ -273,3 +273,100 @@ def test_find_least_active_available_user_conflicts(mocker):
     assert scheduler.find_next_user_id(MOCK_SCHEDULE, future_events, None, table_name='event') is None
 
     mock_active_user_by_team.assert_not_called()
+
+
+def test_create_events_batched(mocker):
+    cursor = mocker.MagicMock(name='cursor')
+    cursor.fetchone.side_effect = [{'num_events': 0}, {'name': 'foo'}]
+    cursor.fetchall.return_value = [{'user_id': 7, 'mode_id': 1, 'type_id': 3, 'time_zone': 'US/Pacific'},
+                                    {'user_id': 8, 'mode_id': 2, 'type_id': 3, 'time_zone': None}]
+    events = [{'start': i * 12 * HOUR, 'end': (i + 1) * 12 * HOUR} for i in range(14)]
+    scheduler = oncall.scheduler.default.Scheduler()
+    scheduler.create_events(1, 4, 7, events, 2, cursor)
+
+    cursor.executemany.assert_called_once()
+    event_args = cursor.executemany.call_args[0][1]
+    assert len(event_args) == 14
+    assert len({args[-1] for args in event_args}) == 1
+    # match check, user name, recipients and one multi-row notification insert
+    assert cursor.execute.call_count == 4
+    insert_query, insert_params = cursor.execute.call_args[0]
+    assert insert_query.count('UNIX_TIMESTAMP()') == 28
+    assert len(insert_params) == 28 * 4
+
+
+def make_index(roster, busy=(), history=()):
+    index = oncall.scheduler.default.EventIndex(1, vacation_role_id=9)
+    index.roster_users[3] = set(roster)
+    for user_id, start, end in busy:
+        index.add_busy(user_id, start, end)
+    for user_id, end in history:
+        index.add_history(user_id, 2, end)
+    return index
+
+
+def test_index_find_new_user_as_least_active_user():
+    scheduler = oncall.scheduler.default.Scheduler()
+    index = make_index({135, 123}, history=[(135, 0)])
+    assert scheduler.find_next_user_id(MOCK_SCHEDULE, [{'start': 0, 'end': 5}], None, index=index) == 123
+
+
+def test_index_find_least_active_available_user():
+    future_events = [{'start': 440, 'end': 570},
+                     {'start': 570, 'end': 588},
+                     {'start': 600, 'end': 700}]
+    index = make_index({123, 456, 789}, busy=[(123, 580, 590), (456, 100, 440), (789, 700, 800)],
+                       history=[(123, 10), (456, 300), (789, 200), (789, 500)])
+    scheduler = oncall.scheduler.default.Scheduler()
+    # 789's event ending at 500 is after the first start, so it counts from 200
+    assert scheduler.find_next_user_id(MOCK_SCHEDULE, future_events, None, index=index) == 789
+
+
+def test_index_find_least_active_available_user_conflicts():
+    index = make_index({123, 456, 789}, busy=[(123, 400, 450), (456, 500, 600), (789, 0, 1000)])
+    scheduler = oncall.scheduler.default.Scheduler()
+    assert scheduler.find_next_user_id(MOCK_SCHEDULE, [{'start': 440, 'end': 570}], None, index=index) is None
+
+
+def test_index_tracks_created_events():
+    index = oncall.scheduler.default.EventIndex(1, subscriptions=[(5, 2)], vacation_role_id=9)
+    assert index.is_conflicting(1, 4)
+    assert index.is_conflicting(5, 2)
+    assert index.is_conflicting(6, 9)
+    assert not index.is_conflicting(5, 4)
+    index.add_events(123, 1, 2, [{'start': 100, 'end': 200}, {'start': 300, 'end': 400}])
+    assert index.is_busy(123, [{'start': 150, 'end': 160}])
+    assert not index.is_busy(123, [{'start': 200, 'end': 300}])
+    assert index.last_end(123, 2, 350) == 200
+    assert index.last_end(123, 2, 100) is None
+
+
+def make_store(events=()):
+    roster = [{'user_id': uid, 'name': 'user%s' % uid, 'full_name': 'User %s' % uid, 'in_rotation': 1, 'active': 1}
+              for uid in (123, 456)]
+    return oncall.scheduler.default.MemoryEventStore(events, roster, [456, 123], {1: []}, {'team-foo': 1})
+
+
+def test_preview_in_memory(mocker):
+    mocker.patch.dict('oncall.settings.config', {'allow_past_events': True})
+    mocker.patch('time.time').return_value = time.mktime(datetime.datetime(year=2017, month=2, day=7).timetuple())
+    start_time = calendar.timegm(datetime.datetime(year=2017, month=2, day=12, tzinfo=utc).timetuple())
+    schedule = {'id': 4, 'team_id': 1, 'team': 'team-foo', 'role_id': 2, 'role': 'primary', 'roster_id': 3,
+                'timezone': 'UTC', 'auto_populate_threshold': 14,
+                'events': [{'start': DAY + 10 * HOUR, 'duration': WEEK}]}
+    # an old event for 123 and a stale future one that the preview replaces
+    store = make_store([
+        {'id': 1, 'team_id': 1, 'role_id': 2, 'schedule_id': 4, 'link_id': None, 'user_id': 123,
+         'start': start_time - WEEK, 'end': start_time - 1, 'note': None,
+         'team': 'team-foo', 'role': 'primary', 'user': 'user123', 'full_name': 'User 123'},
+        {'id': 2, 'team_id': 1, 'role_id': 2, 'schedule_id': 4, 'link_id': None, 'user_id': 123,
+         'start': start_time + DAY + 10 * HOUR, 'end': start_time + WEEK, 'note': None,
+         'team': 'team-foo', 'role': 'primary', 'user': 'user123', 'full_name': 'User 123'},
+    ])
+    oncall.scheduler.default.Scheduler().preview(schedule, start_time, store)
+    events = store.get_events(start_time + 4 * WEEK, start_time, 'team-foo')
+    # new user 456 goes first, then the least recently active user alternates
+    assert [ev['user'] for ev in events] == ['user456', 'user123']
+    assert [ev['id'] for ev in events] == [0, 0]
+    assert list(events[0].keys()) == list(oncall.scheduler.default.preview_fields)
+    assert store.get_events(start_time + 4 * WEEK, start_time, 'team-bar') == []
@@ -0,0 +1,134 @@
+# Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
+# See LICENSE in the project root for license information.
+
+import falcon
+import falcon.testing
+import pytest
+from ujson import loads
+from oncall.api.v0 import search, search_index
+from oncall.api.v0.search_index import TrigramIndex, invalidate_search_index
+
+
+class FakeCursor(object):
+    def __init__(self):
+        self.teams = ['team-foo', 'foo', 'bar-foo-team', 'Food']
+        self.queries = []
+        self.rows = []
+
+    def execute(self, query, args=None):
+        self.queries.append(query)
+        if 'LIKE' in query:
+            self.rows = [('sql-result',)]
+        elif 'FROM `team_user`' in query:
+            self.rows = [('team-foo', 1), ('team-foo', 3), ('team-bar', 2)]
+        elif 'FROM `user`' in query:
+            self.rows = [(1, 'jdoe', 'John Doe', 1), (2, 'jane', 'Jane Doe', 1), (3, 'jdeleted', 'J Deleted', 0)]
+        elif 'FROM `service`' in query:
+            self.rows = [('service-foo', 'team-foo'), ('service-foo', 'bar-foo-team'), ('bar', 'team-foo')]
+        else:
+            self.rows = [(team,) for team in self.teams]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def refresher_thread(mocker):
+    # refreshes are run by the tests themselves
+    mocker.patch('oncall.api.v0.search_index.refresher_pid', None)
+    return mocker.patch('oncall.api.v0.search_index.Thread')
+
+
+def client(mocker, cursor):
+    connection = mocker.MagicMock()
+    connection.cursor.return_value = cursor
+    mocker.patch('oncall.db.connect', return_value=connection)
+    app = falcon.App()
+    app.add_route('/api/v0/search', search)
+    return falcon.testing.TestClient(app)
+
+
+def test_trigram_index_ranking():
+    index = TrigramIndex(['team-foo', 'foo', 'bar-foo-team', 'Food', 'bar'], lambda name: (name,))
+    assert index.search('foo') == ['foo', 'Food', 'team-foo', 'bar-foo-team']
+    assert index.search('FOO', prefix=True) == ['foo', 'Food']
+    assert index.search('fo') == ['foo', 'Food', 'team-foo', 'bar-foo-team']
+    assert index.search('team-b') == []
+    assert index.search('') == ['bar', 'foo', 'Food', 'team-foo', 'bar-foo-team']
+
+
+def test_search_uses_index(mocker):
+    cursor = FakeCursor()
+    client(mocker, cursor)
+    search_index.refresh(list(search_index.loaders))
+    loaded = len(cursor.queries)
+    re = client(mocker, cursor).simulate_get('/api/v0/search', params={'keyword': 'foo'})
+    assert re.status_code == 200
+    data = loads(re.text)
+    assert data['teams'] == ['foo', 'Food', 'team-foo', 'bar-foo-team']
+    assert data['services'] == {'service-foo': ['team-foo', 'bar-foo-team']}
+    assert data['users'] == []
+
+    re = client(mocker, cursor).simulate_get('/api/v0/search', params={'keyword': 'j', 'fields': 'users'})
+    # inactive users are left out
+    assert loads(re.text)['users'] == [{'full_name': 'Jane Doe', 'name': 'jane'},
+                                       {'full_name': 'John Doe', 'name': 'jdoe'}]
+    re = client(mocker, cursor).simulate_get('/api/v0/search', params={'keyword': 'J', 'fields': 'team_users',
+                                                                       'team': 'team-foo'})
+    assert loads(re.text)['users'] == [{'full_name': 'John Doe', 'name': 'jdoe'},
+                                       {'full_name': 'J Deleted', 'name': 'jdeleted'}]
+    # searches never load the index
+    assert len(cursor.queries) == loaded
+
+    # a stale section is answered from SQL until the refresher has reloaded it
+    cursor.teams.append('new-foo')
+    invalidate_search_index('teams')
+    assert search_index.wakeup.is_set()
+    re = client(mocker, cursor).simulate_get('/api/v0/search', params={'keyword': 'new', 'fields': 'teams'})
+    assert loads(re.text)['teams'] == ['sql-result']
+    search_index.refresh()
+    # the fallback query, and the reload of the teams section only
+    assert len(cursor.queries) == loaded + 2
+    re = client(mocker, cursor).simulate_get('/api/v0/search', params={'keyword': 'new', 'fields': 'teams'})
+    assert loads(re.text)['teams'] == ['new-foo']
+
+
+def test_search_falls_back_to_sql(mocker):
+    cursor = FakeCursor()
+    client(mocker, cursor)
+    search_index.refresh(list(search_index.loaders))
+    # the refresher has not reloaded the section for two refresh intervals
+    mocker.patch('oncall.api.v0.search_index.time.time', return_value=search_index.loaded_at['teams'] + 61)
+    re = client(mocker, cursor).simulate_get('/api/v0/search', params={'keyword': 'foo', 'fields': 'teams'})
+    assert loads(re.text)['teams'] == ['sql-result']
+
+    mocker.patch('oncall.api.v0.search_index.enabled', False)
+    re = client(mocker, cursor).simulate_get('/api/v0/search', params={'keyword': 'foo', 'fields': 'teams'})
+    assert loads(re.text)['teams'] == ['sql-result']
+
+
+def test_refresher_started_per_process(mocker, refresher_thread):
+    cursor = FakeCursor()
+    client(mocker, cursor)
+    engine = mocker.patch('oncall.db.engine')
+    getpid = mocker.patch('oncall.api.v0.search_index.os.getpid', return_value=100)
+
+    # loaded in the master: its connection is not handed down to the workers, nor is a thread started
+    search_index.init({})
+    engine.dispose.assert_called_once()
+    refresher_thread.assert_not_called()
+
+    # the worker starts its refresher on first use, once
+    getpid.return_value = 101
+    assert search_index.search_teams('foo') == ['foo', 'Food', 'team-foo', 'bar-foo-team']
+    search_index.search_teams('foo')
+    invalidate_search_index('teams')
+    assert refresher_thread.return_value.start.call_count == 1
+
+    # and so does every other worker forked from the master
+    getpid.return_value = 102
+    invalidate_search_index('teams')
+    assert refresher_thread.return_value.start.call_count == 2
@@ -0,0 +1,31 @@
+# Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
+# See LICENSE in the project root for license information.
+
+from oncall import settings
+
+
+def test_reload(mocker, tmp_path, monkeypatch):
+    mocker.patch.object(settings, 'config', {})
+    mocker.patch.object(settings, 'reload_hooks', [])
+    mocker.patch.object(settings, 'config_path', None)
+    config_file = tmp_path / 'config.yaml'
+    config_file.write_text('allow_past_events: false\n')
+    monkeypatch.setenv('ONCALL_TEST_COLOR', 'red')
+
+    config = settings.read_config(str(config_file))
+    settings.init(config, str(config_file))
+    assert settings.get('allow_past_events') is False
+    assert settings.get('missing', 'default') == 'default'
+
+    hook = mocker.Mock()
+    settings.add_reload_hook(hook)
+    config_file.write_text('allow_past_events: true\nheader_color: !env [ONCALL_TEST_COLOR]\n')
+    settings.reload()
+    assert settings.get('allow_past_events') is True
+    assert settings.get('header_color') == 'red'
+    hook.assert_called_once_with(settings.config)
+
+    # a broken file keeps the current config
+    config_file.write_text('allow_past_events: [\n')
+    settings.reload()
+    assert settings.get('allow_past_events') is True
@@ -0,0 +1,28 @@
+# Copyright (c) LinkedIn Corporation. All rights reserved. Licensed under the BSD-2 Clause license.
+# See LICENSE in the project root for license information.
+
+from pymysql.converters import escape_item
+from oncall.api.v0.users import get_user_data
+
+
+def test_get_user_data_batch(mocker):
+    connection = mocker.MagicMock()
+    connection.escape.side_effect = lambda value: escape_item(value, 'utf8')
+    cursor = mocker.MagicMock()
+    cursor.fetchall.return_value = [
+        {'id': 1, 'name': 'foo', 'contact_id': 1, 'mode': 'email', 'destination': 'foo@example.com'},
+        {'id': 1, 'name': 'foo', 'contact_id': 1, 'mode': 'call', 'destination': '+1 111-111-1111'},
+        {'id': 2, 'name': 'bar', 'contact_id': 2, 'mode': None, 'destination': None},
+    ]
+
+    data = get_user_data(None, {'active': 1}, dbinfo=(connection, cursor), names=['foo', 'bar'])
+    cursor.execute.assert_called_once()
+    query = cursor.execute.call_args[0][0]
+    assert "`user`.`name` IN ('foo','bar')" in query
+    assert '`user`.`active` = 1' in query
+    assert data == [{'id': 1, 'name': 'foo', 'contacts': {'email': 'foo@example.com', 'call': '+1 111-111-1111'}},
+                    {'id': 2, 'name': 'bar', 'destination': None, 'contacts': {}}]
+
+    cursor.reset_mock()
+    assert get_user_data(None, {}, dbinfo=(connection, cursor), ids=[]) == []
+    cursor.execute.assert_not_called()